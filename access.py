@@ -0,0 +1,146 @@
+from common import *
+
+
+def merge_grants(grants:dict, more:dict)-> None:
+    ''' Merge {name: role} into grants keeping the strongest role for each name '''
+    for name, role in more.items():
+        current = grants.get(name)
+        if current is None or role_rank(role) > role_rank(current):
+            grants[name] = role
+
+
+class AccessIndex:
+    '''
+    Effective repo permissions of every user, built from discovered org, team and repo structures.
+    A user's access to a repo is the strongest of their direct collaborator role and the roles granted
+    to every team they belong to. A child team inherits the repo access of its parent teams,
+    so members of a child team also get everything granted to its ancestors.
+
+    The index keeps only per team and per repo grants, not the full users x repos matrix,
+    so memory grows with the size of the org rather than its square. Both questions are answered
+    from it on demand and export streams one user at a time.
+    ---
+    structures = iterable of structures from get_repo_structure, get_team_structure and get_org_member_structure,
+        ie. SnapshotStore.structures() or the documents of a discovery output file
+
+    Example:
+    ```
+    index = AccessIndex(SnapshotStore('snapshots.db').structures())
+    index.user_access('DevDude76')   # {'AwesomeRepo': 'write', ...}
+    index.repo_access('AwesomeRepo') # {'DevDude76': 'write', ...}
+    ```
+    '''
+    def __init__(self, structures) -> None:
+        self.direct_by_repo = {} # repo -> {login: role}
+        self.direct_by_login = {} # login -> {repo: role}
+        self.team_grants = {} # team slug -> {repo: role} granted to the team itself
+        self.repo_teams = {} # repo -> {team slug: role}
+        self.team_members = {} # team slug -> set of logins
+        self.login_teams = {} # login -> set of team slugs
+        self.team_ids = {} # team id -> team slug
+        self.team_parent_ids = {} # team slug -> parent team id or 0
+        for structure in structures:
+            for name, data in structure.items():
+                if data.get('type') == 'repo':
+                    self._add_repo(name, data)
+                elif data.get('type') == 'team':
+                    self._add_team(name, data)
+        self.team_children = {}
+        for slug in self.team_members:
+            parent = self.parent(slug)
+            if parent:
+                self.team_children.setdefault(parent, []).append(slug)
+        self.inherited = {} # team slug -> {repo: role} including grants of parent teams. Filled as teams are asked for.
+        # Teams with repo access that were not discovered have no known members. Their grants are ignored.
+        self.missing_teams = set(self.team_grants) - set(self.team_members)
+
+    def _add_repo(self, name:str, data:dict)-> None:
+        # Outside collaborators are a subset of direct collaborators so only direct_collabs is needed
+        direct = index_roles(data.get('direct_collabs'))
+        self.direct_by_repo[name] = direct
+        for login, role in direct.items():
+            self.direct_by_login.setdefault(login, {})[name] = role
+        teams = index_roles(data.get('teams'))
+        self.repo_teams[name] = teams
+        for slug, role in teams.items():
+            self.team_grants.setdefault(slug, {})[name] = role
+
+    def _add_team(self, slug:str, data:dict)-> None:
+        members = set(index_roles(data.get('members'))) # Team member or maintainer gets the same repo access
+        self.team_members[slug] = members
+        for login in members:
+            self.login_teams.setdefault(login, set()).add(slug)
+        if data.get('id'):
+            self.team_ids[int(data['id'])] = slug
+        self.team_parent_ids[slug] = int(data.get('parent_id') or 0)
+
+    def parent(self, slug:str)-> str:
+        ''' Slug of the parent team or None '''
+        return self.team_ids.get(self.team_parent_ids.get(slug, 0))
+
+    def ancestors(self, slug:str)-> list:
+        ''' Parent, grandparent and so on of a team. Stops if the hierarchy loops. '''
+        ancestors = []
+        parent = self.parent(slug)
+        while parent and parent != slug and parent not in ancestors:
+            ancestors.append(parent)
+            parent = self.parent(parent)
+        return ancestors
+
+    def descendants(self, slug:str)-> list:
+        ''' Every team below a team in the hierarchy '''
+        descendants = []
+        seen = {slug}
+        pending = list(self.team_children.get(slug, []))
+        while pending:
+            child = pending.pop()
+            if child not in seen:
+                seen.add(child)
+                descendants.append(child)
+                pending.extend(self.team_children.get(child, []))
+        return descendants
+
+    def team_access(self, slug:str)-> dict:
+        ''' Repos a team can access as {repo: role}, including access inherited from its parent teams '''
+        if slug not in self.inherited:
+            grants = dict(self.team_grants.get(slug, {}))
+            for ancestor in self.ancestors(slug):
+                merge_grants(grants, self.team_grants.get(ancestor, {}))
+            self.inherited[slug] = grants
+        return self.inherited[slug]
+
+    def user_access(self, login:str)-> dict:
+        ''' Repos a login can access as {repo: role}, directly or through any team '''
+        access = dict(self.direct_by_login.get(login, {}))
+        for slug in self.login_teams.get(login, ()):
+            merge_grants(access, self.team_access(slug))
+        return access
+
+    def repo_access(self, repo:str)-> dict:
+        ''' Logins that can access a repo as {login: role}, directly or through any team '''
+        access = dict(self.direct_by_repo.get(repo, {}))
+        for slug, role in self.repo_teams.get(repo, {}).items():
+            for team in [slug] + self.descendants(slug):
+                merge_grants(access, dict.fromkeys(self.team_members.get(team, ()), role))
+        return access
+
+    def logins(self)-> list:
+        ''' Every login with any access, sorted '''
+        return sorted_logins(set(self.direct_by_login) | set(self.login_teams))
+
+    def repos(self)-> list:
+        return sorted_logins(self.direct_by_repo)
+
+    def get_user_access_structure(self, login:str)-> dict:
+        ''' Effective access of a login as {login: {role: [repos]}}, the same shape as the discovery output '''
+        return {login: by_role(self.user_access(login))}
+
+    def get_repo_access_structure(self, repo:str)-> dict:
+        ''' Effective access to a repo as {repo: {role: [logins]}} '''
+        return {repo: by_role(self.repo_access(repo))}
+
+    def export(self):
+        ''' Yields the effective access structure of every login, one login at a time '''
+        for login in self.logins():
+            yield self.get_user_access_structure(login)
+
@@ -0,0 +1,448 @@
+import re
+import sys
+import json
+import time
+import asyncio
+import aiohttp
+import threading
+import multidict
+from collections import deque
+from urllib.parse import urlencode, urlparse, parse_qs
+from common import *
+from ratelimit import *
+from profiler import profiled
+
+API_URL = 'https://api.github.com'
+DEFAULT_CONCURRENCY = 32 # Requests in flight at once. GitHub advises against many more than this per token.
+PER_PAGE = 100
+MAX_ATTEMPTS = 5 # Attempts per request on rate limits, server errors and dropped connections
+LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="(\w+)"')
+
+
+class AsyncGitHubClient:
+    '''
+    Minimal asyncio client for the GitHub REST API on one pooled aiohttp session.
+    At most concurrency requests are in flight at once, and each one is paced by the shared RateLimitScheduler.
+    Responses are cached for conditional requests the same way as the Transport when a ResponseCache is set.
+    The session is opened on the first request so the client can be built outside a running event loop.
+    ---
+    token:str = GitHub Personal Access Token
+    base_url:str = REST API root. Point this at GitHub Enterprise Server or a local fake API.
+    concurrency:int = Max requests in flight
+    scheduler = RateLimitScheduler shared with the other clients or None
+    profiler = ApiProfiler or None
+    cache = ResponseCache or None
+    '''
+    def __init__(self, token:str, base_url:str = API_URL, concurrency:int = DEFAULT_CONCURRENCY, scheduler:RateLimitScheduler = None,
+                 profiler = None, cache = None, timeout:int = 60) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.scheduler = scheduler
+        self.profiler = profiler
+        self.cache = cache
+        self.timeout = timeout
+        self.headers = {
+            'Authorization': f'token {token}',
+            'Accept': 'application/vnd.github+json',
+            'User-Agent': 'GitHubOrgMgmt',
+        }
+        self.session = None
+        self.semaphore = None
+
+    def url(self, path:str, params:dict = None)-> str:
+        url = path if path.startswith('http') else f'{self.base_url}{path}'
+        return f'{url}?{urlencode(params)}' if params else url
+
+    async def request(self, verb:str, url:str, headers:dict = None)-> tuple:
+        '''
+        Send one request and return (status, headers, data). Retries while rate limited, on 5xx and on dropped connections.
+        Raises github.UnknownObjectException for 404 and github.GithubException for any other error status.
+        '''
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 connector=aiohttp.TCPConnector(limit=self.concurrency))
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        headers = dict(self.headers, **(headers or {}))
+        cache_key = None
+        entry = None
+        if self.cache and verb == 'GET':
+            cache_key = self.cache.key(url, headers)
+            entry = self.cache.get(cache_key)
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        resource = rate_limit_resource(url)
+        for attempt in range(MAX_ATTEMPTS):
+            async with self.semaphore:
+                start = time.perf_counter()
+                delay = self.scheduler.reserve(resource, write=verb != 'GET') if self.scheduler else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent = time.perf_counter()
+                try:
+                    async with self.session.request(verb, url, headers=headers, allow_redirects=False) as response:
+                        status = response.status
+                        response_headers = multidict.CIMultiDict(response.headers) # Header names are case insensitive
+                        text = await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    if self.profiler:
+                        self.profiler.record(verb, url, 0, {}, 0, 0, time.perf_counter() - sent, sent - start)
+                    if attempt == MAX_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                if self.profiler:
+                    self.profiler.record(verb, url, status, response_headers, 0, len(text), time.perf_counter() - sent, sent - start)
+            retry_after = None
+            if self.scheduler:
+                retry_after = self.scheduler.update(resource, status, response_headers, text if status in (403, 429) else '')
+            if retry_after is not None:
+                continue # The scheduler holds the next attempt back until the limit resets
+            if status >= 500 and attempt < MAX_ATTEMPTS - 1:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            break
+
+        if entry and status == 304:
+            self.cache.touch(cache_key)
+            status, text = entry['status'], entry['body']
+            cached_headers = multidict.CIMultiDict(entry['headers'])
+            cached_headers.update(response_headers) # Keep the fresh rate limit and date headers from the 304
+            response_headers = cached_headers
+        elif cache_key and status == 200 and (response_headers.get('ETag') or response_headers.get('Last-Modified')):
+            self.cache.put(cache_key, {
+                'url': url,
+                'status': status,
+                'headers': dict(response_headers),
+                'body': text,
+                'etag': response_headers.get('ETag'),
+                'last_modified': response_headers.get('Last-Modified'),
+            })
+
+        data = json.loads(text) if text else None
+        if status == 404:
+            raise github.UnknownObjectException(status, data, response_headers)
+        if status >= 400:
+            raise github.GithubException(status, data, response_headers)
+        return status, response_headers, data
+
+    async def get(self, path:str, params:dict = None, headers:dict = None):
+        ''' Returns the json body of a GET '''
+        status, response_headers, data = await self.request('GET', self.url(path, params), headers)
+        return data
+
+    async def get_page(self, url:str)-> tuple:
+        ''' One page of a listing as (items, {rel: url}) from the Link header '''
+        status, headers, data = await self.request('GET', url)
+        links = {rel: link for link, rel in LINK_PATTERN.findall(headers.get('Link', ''))}
+        return data or [], links # 204 No Content for an empty repo's contributors
+
+    async def paginate(self, path:str, params:dict = None)-> list:
+        '''
+        Every item of a listing. The first page tells us the last page number,
+        so the remaining pages are fetched at the same time rather than one after another.
+        '''
+        first_url = self.url(path, dict(params or {}, per_page=PER_PAGE))
+        items, links = await self.get_page(first_url)
+        last = parse_qs(urlparse(links.get('last', '')).query).get('page')
+        if 'next' not in links:
+            return items
+        if not last: # No page numbers, ie. cursor based. Follow the next links.
+            async for page in self.pages(links['next']):
+                items.extend(page)
+            return items
+        pages = await asyncio.gather(*(self.get_page(self.url(path, dict(params or {}, per_page=PER_PAGE, page=page))) for page in range(2, int(last[0]) + 1)))
+        for page, links in pages:
+            items.extend(page)
+        return items
+
+    async def pages(self, url:str):
+        ''' Async generator yielding each page of a listing in order, one request at a time, so the caller can stop early '''
+        while url:
+            items, links = await self.get_page(url)
+            yield items
+            url = links.get('next')
+
+    async def close(self)-> None:
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncDiscovery:
+    '''
+    Builds the same OrgObject, TeamObject and RepoObject structures as discover_org, discover_team
+    and discover_repository, with every independent listing of a repo or team fetched at the same time
+    and many repos and teams discovered at once on one thread.
+    ---
+    client = AsyncGitHubClient
+    org_login:str = GitHub Organization login
+    '''
+    def __init__(self, client:AsyncGitHubClient, org_login:str) -> None:
+        self.client = client
+        self.org_login = org_login
+
+    @profiled
+    async def discover_org(self)-> OrgObject:
+        org, members, collaborators, invitations = await asyncio.gather(
+            self.client.get(f'/orgs/{self.org_login}'),
+            self.client.paginate(f'/orgs/{self.org_login}/members'),
+            self.client.paginate(f'/orgs/{self.org_login}/outside_collaborators'),
+            self.client.paginate(f'/orgs/{self.org_login}/invitations'),
+        )
+        this_org = OrgObject(org['login'])
+        this_org.name = org.get('name')
+        this_org.description = org.get('description')
+        for member in members:
+            this_org.add_member(member['login'])
+        for collab in collaborators:
+            this_org.add_collab(collab['login'])
+        for invited in invitations:
+            if invited.get('login'): # Invitations sent by email have no login
+                this_org.add_invited_user(invited['login'])
+        return this_org
+
+    @profiled
+    async def list_teams(self)-> list:
+        return await self.client.paginate(f'/orgs/{self.org_login}/teams')
+
+    @profiled
+    async def get_team(self, team_slug:str)-> dict:
+        ''' Team payload or None if the team was not found '''
+        try:
+            return await self.client.get(f'/orgs/{self.org_login}/teams/{team_slug}')
+        except github.UnknownObjectException:
+            return None
+
+    @profiled
+    async def discover_team(self, team:dict)-> TeamObject:
+        ''' TeamObject from a team payload of list_teams or get_team '''
+        this_team = TeamObject(slug=team['slug'])
+        this_team.name = team.get('name')
+        this_team.description = team.get('description')
+        this_team.id = team['id']
+        this_team.html_url = team.get('html_url')
+        if team.get('parent'):
+            this_team.parent_id = team['parent']['id']
+            this_team.parent_name = team['parent']['name']
+        maintainers, members = await asyncio.gather(
+            self.client.paginate(f"{team['url']}/members", {'role': 'maintainer'}),
+            self.client.paginate(f"{team['url']}/members", {'role': 'member'}),
+        )
+        for member in maintainers:
+            this_team.add_member(member['login'], role='maintainer')
+        for member in members:
+            this_team.add_member(member['login'], role='member')
+        return this_team
+
+    @profiled
+    async def list_repositories(self)-> list:
+        ''' Repo payloads of every repo in the org, most recently pushed first like org.get_repos(type='all', sort='pushed') '''
+        return await self.client.paginate(f'/orgs/{self.org_login}/repos', {'type': 'all', 'sort': 'pushed'})
+
+    @profiled
+    async def get_repository(self, repo_name:str)-> dict:
+        ''' Repo payload or None if the repo was not found '''
+        try:
+            return await self.client.get(f'/repos/{self.org_login}/{repo_name}')
+        except github.UnknownObjectException:
+            return None
+
+    async def collaborator_role(self, repo:dict, collab:dict)-> str:
+        role = collaborator_permission_from_payload(collab)
+        if role:
+            return role
+        data = await self.client.get(f"{repo['url']}/collaborators/{collab['login']}/permission")
+        return data['permission']
+
+    async def team_role(self, repo:dict, team:dict)-> str:
+        role = TEAM_PERMISSION_ROLES.get(team.get('permission'))
+        if role:
+            return role
+        data = await self.client.get(f"{team['url']}/repos/{repo['full_name']}", headers={'Accept': 'application/vnd.github.v3.repository+json'})
+        return team_role_from_permissions(data.get('permissions') or {})
+
+    @profiled
+    async def discover_commit_authors(self, repo:dict, branches:list, watermark:dict = None)-> tuple:
+        ''' discover_commit_authors in common.py for a repo payload and branch payloads. Authors saved in watermark are kept the same way. '''
+        previous_heads = watermark['branches'] if watermark else {}
+        authors = set(watermark['authors']) if watermark else set()
+        seen = set(previous_heads.values())
+        heads = {}
+        for branch in branches:
+            head = branch['commit']['sha']
+            heads[branch['name']] = head
+            if head in seen:
+                continue
+            # Walked one page at a time since the walk stops once the history behind the head has been scanned
+            walk = CommitWalk(head, seen)
+            async for page in self.client.pages(self.client.url(f"{repo['url']}/commits", {'sha': head, 'per_page': PER_PAGE})):
+                for commit in page:
+                    if walk.visit(commit['sha'], [parent['sha'] for parent in commit.get('parents') or []]) and commit.get('author'):
+                        authors.add(commit['author']['login'])
+                    if walk.done:
+                        break
+                if walk.done:
+                    break
+        return authors, {'branches': heads, 'authors': sorted(authors)}
+
+    @profiled
+    async def discover_repository(self, repo:dict, discover_contributors:bool = False, branch:str = None, contributor_watermarks:dict = None)-> RepoObject:
+        ''' Same as discover_repository in common.py for a repo payload of list_repositories or get_repository '''
+        this_repo = RepoObject(name=repo['name'])
+        this_repo.html_url = repo.get('html_url')
+        direct, outside, teams = await asyncio.gather(
+            self.client.paginate(f"{repo['url']}/collaborators", {'affiliation': 'direct'}),
+            self.client.paginate(f"{repo['url']}/collaborators", {'affiliation': 'outside'}),
+            self.client.paginate(f"{repo['url']}/teams"),
+        )
+        for collab, role in zip(direct, await asyncio.gather(*(self.collaborator_role(repo, collab) for collab in direct))):
+            this_repo.add_direct_collabs(login=collab['login'], role=role)
+        for collab, role in zip(outside, await asyncio.gather(*(self.collaborator_role(repo, collab) for collab in outside))):
+            this_repo.add_outside_collabs(login=collab['login'], role=role)
+        for team, role in zip(teams, await asyncio.gather(*(self.team_role(repo, team) for team in teams))):
+            if role:
+                this_repo.add_team(team['slug'], role)
+        this_repo.api_calls_saved = sum(1 for collab in direct + outside if collaborator_permission_from_payload(collab)) \
+            + sum(1 for team in teams if TEAM_PERMISSION_ROLES.get(team.get('permission')))
+
+        if discover_contributors:
+            if not branch:
+                for author in await self.client.paginate(f"{repo['url']}/contributors"):
+                    this_repo.add_contributor(str(author['login']))
+            else:
+                if branch == 'all':
+                    branches = await self.client.paginate(f"{repo['url']}/branches")
+                else:
+                    branches = [await self.client.get(f"{repo['url']}/branches/{branch}")]
+                watermark = None
+                if contributor_watermarks is not None:
+                    watermark_key = f"{repo['full_name']}@{branch}"
+                    watermark = contributor_watermarks.get(watermark_key)
+                authors, watermark = await self.discover_commit_authors(repo, branches, watermark)
+                if contributor_watermarks is not None:
+                    contributor_watermarks[watermark_key] = watermark
+                for user in authors:
+                    this_repo.add_contributor(str(user))
+        return this_repo
+
+    async def discover_many(self, items:list, discover, window:int):
+        '''
+        Async generator running discover(item) for many items at once. Yields (item, result, error) in the order
+        of items. At most window items are started ahead of the one being yielded so memory stays bounded.
+        '''
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append((item, asyncio.ensure_future(discover(item))))
+            if len(pending) >= window:
+                break
+        while pending:
+            item, task = pending.popleft()
+            try:
+                yield item, await task, None
+            except Exception as err:
+                yield item, None, err
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append((next_item, asyncio.ensure_future(discover(next_item))))
+
+
+def start_event_loop()-> asyncio.AbstractEventLoop:
+    '''
+    Event loop running on a daemon thread of its own. AsyncDiscoveryEngines of several threads can share it,
+    and with it one AsyncGitHubClient, so they draw on one connection pool and one concurrency limit.
+    Stop it with stop_event_loop.
+    '''
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='async-discovery', daemon=True).start()
+    return loop
+
+
+def stop_event_loop(loop:asyncio.AbstractEventLoop, client:AsyncGitHubClient = None)-> None:
+    ''' Close client on loop, then stop the loop started by start_event_loop '''
+    if client:
+        asyncio.run_coroutine_threadsafe(client.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+class AsyncDiscoveryEngine:
+    '''
+    Runs AsyncDiscovery on an event loop behind plain generators and functions,
+    so synchronous code like discovery.py can use it the same way as GraphQLDiscovery.
+    Discovered objects are yielded in the same order as the PyGithub discovery. While the caller handles one,
+    the next ones are still being fetched.
+    ---
+    client = AsyncGitHubClient
+    org_login:str = GitHub Organization login
+    loop = Event loop from start_event_loop to share with other engines. Default is a new loop owned by this engine,
+           which then closes the client on close().
+
+    Example:
+    ```
+    engine = AsyncDiscoveryEngine(AsyncGitHubClient(token, scheduler=scheduler), 'my-org')
+    for name, this_repo, err in engine.discover_repositories():
+        print(this_repo.get_repo_as_yaml())
+    engine.close()
+    ```
+    '''
+    def __init__(self, client:AsyncGitHubClient, org_login:str, loop:asyncio.AbstractEventLoop = None) -> None:
+        self.client = client
+        self.discovery = AsyncDiscovery(client, org_login)
+        self.owns_loop = loop is None
+        self.loop = loop or asyncio.new_event_loop()
+
+    def run(self, coroutine):
+        if self.owns_loop:
+            return self.loop.run_until_complete(coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def iterate(self, generator):
+        ''' Drive an async generator from synchronous code '''
+        async def next_item():
+            return await generator.__anext__()
+        while True:
+            try:
+                yield self.run(next_item())
+            except StopAsyncIteration:
+                return
+
+    def discover_repositories(self, discover_contributors:bool = False, branch:str = None, contributor_watermarks:dict = None, skip = ()):
+        '''
+        Generator yielding (repo_name, RepoObject, error) for every repo in the org like discover_repositories.
+        One failed repo does not stop the crawl. Repo names in skip are left out.
+        '''
+        repos = [repo for repo in self.run(self.discovery.list_repositories()) if repo['name'] not in skip]
+        discover = lambda repo: self.discovery.discover_repository(repo, discover_contributors, branch, contributor_watermarks)
+        for repo, this_repo, err in self.iterate(self.discovery.discover_many(repos, discover, self.client.concurrency)):
+            yield repo['name'], this_repo, err
+
+    def discover_repository(self, repo_name:str, discover_contributors:bool = False, branch:str = None, contributor_watermarks:dict = None)-> RepoObject:
+        ''' Returns the RepoObject for one repo or None if the repo was not found '''
+        async def discover():
+            repo = await self.discovery.get_repository(repo_name)
+            return repo and await self.discovery.discover_repository(repo, discover_contributors, branch, contributor_watermarks)
+        return self.run(discover())
+
+    def discover_teams(self, skip = ()):
+        ''' Generator yielding (team_slug, TeamObject, error) for every team in the org. Team slugs in skip are left out. '''
+        teams = [team for team in self.run(self.discovery.list_teams()) if team['slug'] not in skip]
+        for team, this_team, err in self.iterate(self.discovery.discover_many(teams, self.discovery.discover_team, self.client.concurrency)):
+            yield team['slug'], this_team, err
+
+    def discover_team(self, team_slug:str)-> TeamObject:
+        ''' Returns the TeamObject for one team or None if the team was not found '''
+        async def discover():
+            team = await self.discovery.get_team(team_slug)
+            return team and await self.discovery.discover_team(team)
+        return self.run(discover())
+
+    def discover_org(self)-> OrgObject:
+        return self.run(self.discovery.discover_org())
+
+    def close(self)-> None:
+        if self.owns_loop:
+            self.run(self.client.close())
+            self.loop.close()
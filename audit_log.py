@@ -0,0 +1,236 @@
+import os
+import re
+import sys
+import json
+import datetime
+from common import *
+from github.GithubException import GithubException
+
+DEFAULT_AUDIT_CURSOR_FILE = 'audit-log.cursor.json'
+AUDIT_LOG_PAGE_SIZE = 100
+LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="(\w+)"')
+
+# Audit log actions that change a structure discovery.py outputs, by what has to be discovered again
+TEAM_ACTIONS = {'team.create', 'team.destroy', 'team.rename', 'team.change_parent_team',
+                'team.add_member', 'team.remove_member', 'team.promote_maintainer', 'team.demote_maintainer'}
+TEAM_REPO_ACTIONS = {'team.add_repository', 'team.remove_repository', 'team.update_repository_permission'}
+REPO_ACTIONS = {'repo.create', 'repo.destroy', 'repo.rename', 'repo.transfer', 'repo.transfer_outgoing',
+                'repo.add_member', 'repo.remove_member', 'repo.update_member'}
+ORG_ACTIONS = {'org.add_member', 'org.remove_member', 'org.invite_member', 'org.cancel_invitation',
+               'org.add_outside_collaborator', 'org.remove_outside_collaborator'}
+# GitHub logs only the one event when a login leaves, not one for each team and repo it loses
+ORG_LEAVE_ACTIONS = {'org.remove_member', 'org.remove_outside_collaborator'}
+
+
+def audit_time(timestamp_ms:int)-> str:
+    ''' Audit log @timestamp in milliseconds as the second it falls in, ie. 2024-05-01T12:00:00Z '''
+    return datetime.datetime.fromtimestamp(timestamp_ms / 1000, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def short_name(name:str)-> str:
+    ''' Team slug or repo name from the org/name form the audit log uses '''
+    return name.split('/', 1)[-1] if name else name
+
+
+def audit_log_start(snapshots:list, org:str)-> str:
+    '''
+    When the last full discovery of org began, from SnapshotStore.snapshots(). Where a first delta sync starts reading the audit log.
+    Returns None if org has no finished --repo all or --team all snapshot.
+    '''
+    starts = []
+    for scope in ('all_repos', 'all_teams'):
+        full = [snapshot['started_at'] for snapshot in snapshots if snapshot['org'] == org and snapshot[scope]]
+        if full:
+            starts.append(full[-1])
+    if not starts:
+        return None
+    return datetime.datetime.fromisoformat(min(starts)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class AuditLogCursor:
+    '''
+    Where the last delta sync got to in the org audit log. Saved between runs.
+    The audit log can only be searched by second, so the cursor keeps the second of the newest event
+    and the ids of the events already seen in it. The next run searches from that second and skips those.
+        {"org": org, "created": "2024-05-01T12:00:00Z", "documents": [_document_id, ...]}
+    ---
+    cursor_file:str = JSON file the cursor is loaded from and saved to
+    org:str = GitHub Organization login
+
+    Example:
+    ```
+    cursor = AuditLogCursor('audit-log.cursor.json', 'my-org')
+    cursor.start('2024-05-01T12:00:00Z') # Only used when there is no saved cursor yet
+    for event in read_audit_log(org._requester, org.url, cursor.phrase()):
+        if cursor.is_new(event):
+            cursor.advance(event)
+    cursor.save()
+    ```
+    '''
+    def __init__(self, cursor_file:str, org:str) -> None:
+        self.cursor_file = cursor_file
+        self.org = org
+        self.created = None
+        self.documents = set()
+        if os.path.exists(cursor_file):
+            with open(cursor_file, 'r') as file:
+                saved = json.load(file)
+            if saved.get('org') == org:
+                self.created = saved['created']
+                self.documents = set(saved['documents'])
+
+    def start(self, created:str)-> None:
+        ''' Start from created, ie. when the last full discovery began, unless a cursor was saved '''
+        if not self.created:
+            self.created = created
+
+    def phrase(self)-> str:
+        ''' Audit log search phrase for the events from the cursor on '''
+        return f'created:>={self.created}'
+
+    def is_new(self, event:dict)-> bool:
+        return event.get('_document_id') not in self.documents
+
+    def advance(self, event:dict)-> None:
+        created = audit_time(event['@timestamp'])
+        if created != self.created:
+            self.created = created
+            self.documents = set()
+        self.documents.add(event.get('_document_id'))
+
+    def save(self)-> None:
+        tmp_file = f'{self.cursor_file}.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'org': self.org, 'created': self.created, 'documents': sorted(self.documents)}, file)
+        os.replace(tmp_file, self.cursor_file)
+
+
+def read_audit_log(requester, org_url:str, phrase:str):
+    '''
+    Yields the web events of an org audit log matching phrase, oldest first. Pages are followed with the Link header.
+    Needs the read:audit_log scope. The audit log API is only available to GitHub Enterprise Cloud orgs, others get a 404.
+    ---
+    requester = PyGithub requester of the org, ie. org._requester
+    org_url:str = API url of the org, ie. org.url
+    phrase:str = Search phrase, ie. created:>=2024-05-01T12:00:00Z
+    '''
+    url = f'{org_url}/audit-log'
+    parameters = {'phrase': phrase, 'order': 'asc', 'include': 'web', 'per_page': AUDIT_LOG_PAGE_SIZE}
+    while url:
+        headers, events = requester.requestJsonAndCheck('GET', url, parameters)
+        yield from events or []
+        link = next((value for key, value in headers.items() if key.lower() == 'link'), '')
+        url = {rel: next_url for next_url, rel in LINK_PATTERN.findall(link)}.get('next')
+        parameters = None # The next link carries them
+
+
+class AuditLogDelta:
+    '''
+    The teams, repos and org membership that audit log events say changed and have to be discovered again.
+    '''
+    def __init__(self) -> None:
+        self.teams = set() # Team slugs
+        self.repos = set() # Repo names
+        self.org = False # Org members, collaborators or invitations changed
+        self.left = set() # Logins removed from the org
+        self.destroyed_teams = set()
+        self.events = 0
+
+    def add(self, event:dict)-> bool:
+        ''' Add what one event touched. Returns False if it changes nothing discovery.py outputs. '''
+        action = event.get('action')
+        if action in TEAM_ACTIONS and event.get('team'):
+            self.teams.add(short_name(event['team']))
+            if action == 'team.destroy':
+                self.destroyed_teams.add(short_name(event['team']))
+        elif action in TEAM_REPO_ACTIONS and event.get('repo'):
+            self.repos.add(short_name(event['repo']))
+        elif action in REPO_ACTIONS and event.get('repo'):
+            self.repos.add(short_name(event['repo']))
+        elif action in ORG_ACTIONS:
+            self.org = True
+            if action in ORG_LEAVE_ACTIONS and event.get('user'):
+                self.left.add(event['user'])
+        else:
+            return False
+        self.events += 1
+        return True
+
+
+def sync_from_audit_log(gh:github.Github, org_name:str, store, cursor:AuditLogCursor, output,
+                        discover_contributors:bool = False, branch:str = None, discover = discover_repository)-> int:
+    '''
+    Patch the last snapshot of an org with only what changed since the cursor, going by the org audit log.
+    Teams and repos named by the events are discovered again with discover_team and discover, and the org membership
+    with discover_org, then passed to output. Those that no longer exist are removed from the store.
+    The cursor is moved on but not saved. Save it when this returns 0 so failed teams and repos are tried again next run.
+    Returns the number of teams and repos that failed, or 1 if the audit log could not be read.
+    ---
+    gh:github.Github = Client
+    org_name:str = GitHub Organization login
+    store:SnapshotStore = Database holding the last snapshot, with a snapshot begun for this run
+    cursor:AuditLogCursor = Where the last sync got to
+    output = Called with each structure discovered again, ie. discovery.py's output
+    discover_contributors, branch = As for discover_repository. Without discover_contributors the contributors
+        of the last snapshot are kept.
+    discover = Function used to discover a repo. Same signature as discover_repository, which is the default.
+    '''
+    org = gh.get_organization(org_name)
+    delta = AuditLogDelta()
+    try:
+        for event in read_audit_log(org._requester, org.url, cursor.phrase()):
+            if cursor.is_new(event):
+                delta.add(event)
+                cursor.advance(event)
+    except GithubException as err:
+        print(f'[WARNING] Could not read the audit log of Org: {org_name} - {type(err).__name__}: {err}. It needs the read:audit_log scope and GitHub Enterprise Cloud', file=sys.stderr)
+        return 1
+
+    # Work out from the last snapshot what the events imply but don't name
+    for login in delta.left:
+        delta.teams.update(store.teams_for_login(login, org=org_name))
+        delta.repos.update(store.collaborator_repos(login, org=org_name))
+    for slug in delta.destroyed_teams:
+        delta.repos.update(store.team_repos(slug, org=org_name))
+    print(f'[INFO] Audit log of Org: {org_name} Events: {delta.events} Teams: {len(delta.teams)} Repos: {len(delta.repos)} Org membership: {delta.org}', file=sys.stderr)
+
+    errors = 0
+    for slug in sorted(delta.teams):
+        try:
+            this_team = discover_team(org.get_team_by_slug(slug))
+        except UnknownObjectException:
+            store.remove('team', slug)
+            print(f'[CHANGED] Team: {slug} no longer exists', file=sys.stderr)
+            continue
+        except GithubException as err:
+            print(f'[WARNING] Discovery failed for Team: {slug} - {type(err).__name__}: {err}', file=sys.stderr)
+            errors += 1
+            continue
+        output(this_team.get_team_structure())
+
+    for name in sorted(delta.repos):
+        contributors = [] if discover_contributors else store.contributors(name, org=org_name) # No audit log event changes them
+        try:
+            repo = org.get_repo(name)
+            # A transferred repo redirects to its new owner
+            this_repo = discover(repo, discover_contributors, branch) if repo.full_name.split('/')[0] == org_name else None
+        except UnknownObjectException:
+            this_repo = None
+        except GithubException as err:
+            print(f'[WARNING] Discovery failed for Repo: {name} - {type(err).__name__}: {err}', file=sys.stderr)
+            errors += 1
+            continue
+        if this_repo is None:
+            store.remove('repo', name)
+            print(f'[CHANGED] Repo: {name} no longer exists', file=sys.stderr)
+            continue
+        if repo.name != name: # Renamed. GitHub redirects the old name to the repo
+            store.remove('repo', name)
+            print(f'[CHANGED] Repo: {name} renamed to {repo.name}', file=sys.stderr)
+        for login in contributors:
+            this_repo.add_contributor(login)
+        output(this_repo.get_repo_structure())
+
+    if delta.org:
+        output(discover_org(org).get_org_member_structure())
+    return errors
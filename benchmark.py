@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+import contextlib
+import multiprocessing
+import urllib.request
+
+from github import Github
+from github import Auth
+from common import *
+from transport import *
+from profiler import *
+from fake_github import *
+from async_discovery import *
+from snapshot_store import *
+from audit_log import *
+
+SCENARIOS = ['repos', 'repos-parallel', 'repos-async', 'contributors', 'contributors-async', 'teams', 'teams-async', 'org', 'team-sync', 'org-sync',
+             'audit-delta', 'model-roles', 'model-snapshot']
+DEFAULT_MEMORY_BUDGET_MB = 32 # RSS growth allowed for the model-snapshot scenario
+
+parser = argparse.ArgumentParser(
+                    prog=os.path.basename(sys.argv[0]),
+                    description='Time discovery and modify code paths against a local fake GitHub API serving a synthetic org',
+                    epilog='Every scenario runs in a fresh process against a freshly reset org. Nothing is sent to GitHub.')
+add_org_arguments(parser)
+parser.add_argument('-s','--scenario', action='append', choices=SCENARIOS, help=f'Scenario to run. Can be repeated. Default is all of: {", ".join(SCENARIOS)}')
+parser.add_argument('-w','--workers', type=int, default=4, help='Workers for the repos-parallel scenario. Default is 4')
+parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f'Requests in flight for the async scenarios. Default is {DEFAULT_CONCURRENCY}')
+parser.add_argument('--repeat', type=int, default=1, help='Runs of each scenario. The median is reported. Default is 1')
+parser.add_argument('--cache', action="store_true", help='Use the HTTP response cache. Each scenario gets an empty cache, warmed by one untimed run')
+parser.add_argument('--write-interval', type=float, default=0.0, help='Min seconds between write requests. GitHub recommends 1. Default is 0 so sync scenarios measure the client')
+parser.add_argument('--model-logins', type=int, default=10000, help='Collaborators and members of the repo and team built by the model-roles scenario. Default is 10000')
+parser.add_argument('--model-repos', type=int, default=5000, help='Repos in the org snapshot built by the model-snapshot scenario. Default is 5000')
+parser.add_argument('--memory-budget', type=float, default=DEFAULT_MEMORY_BUDGET_MB, help=f'Max RSS growth in MB for the model-snapshot scenario. Default is {DEFAULT_MEMORY_BUDGET_MB}')
+parser.add_argument('--profile', action="store_true", help='Print the API calls of each scenario per calling function and endpoint to stderr')
+parser.add_argument('--json', metavar='RESULTS_FILE', help='Also save the results to RESULTS_FILE as json')
+args = parser.parse_args()
+
+if args.repeat < 1 or args.workers < 1 or args.concurrency < 1:
+    print("Exiting: --repeat, --workers and --concurrency must be 1 or more")
+    exit()
+
+scenarios = args.scenario or SCENARIOS
+org_args = org_args_from(args)
+
+
+def serve(state:FakeGitHubState, port_queue)-> None:
+    server = make_server(state)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def server_call(base_url:str, path:str, data:dict = None)-> dict:
+    ''' Stats and reset endpoints of the fake API. Not counted as API calls. '''
+    body = None if data is None else json.dumps(data).encode()
+    with urllib.request.urlopen(urllib.request.Request(f'{base_url}{path}', data=body, method='POST' if body else 'GET')) as response:
+        return json.load(response)
+
+
+def new_client(base_url:str)-> Github:
+    client = Github(base_url=base_url, auth=Auth.Token('fake-token'), seconds_between_requests=None, seconds_between_writes=None)
+    client.per_page = 100 # Same as discovery.py and modify.py
+    return client
+
+
+def desired_team(team:dict)-> dict:
+    ''' Team membership for team-sync: first member removed, second promoted, one new member added '''
+    members = dict(team['members'])
+    logins = sorted(members)
+    if logins:
+        members.pop(logins[0])
+    if len(logins) > 1:
+        members[logins[1]] = 'maintainer'
+    members['new-member'] = 'member'
+    return {role: [login for login in sorted(members) if members[login] == role] for role in ('maintainer', 'member')}
+
+
+def desired_org(org:SyntheticOrg)-> dict:
+    ''' Org membership for org-sync: a tenth of the members become collaborators and ten new members are invited '''
+    members = sorted(org.members)
+    converted = members[::10]
+    return {org.name: {
+        'members': [login for login in members if login not in converted] + [f'new-member-{i}' for i in range(10)],
+        'collaborators': sorted(org.collaborators) + converted,
+    }}
+
+
+def build_large_roles(logins:int)-> None:
+    ''' model-roles: one repo and one team with logins collaborators and members, then exported '''
+    this_repo = RepoObject('large-repo')
+    this_team = TeamObject('large-team')
+    for i in range(logins):
+        login = f'user-{i}'
+        this_repo.add_direct_collabs(login, REPO_PERMISSIONS[i % len(REPO_PERMISSIONS)])
+        this_repo.add_outside_collabs(login, REPO_PERMISSIONS[i % len(REPO_PERMISSIONS)])
+        this_repo.add_contributor(login)
+        this_team.add_member(login, 'maintainer' if i % 10 == 0 else 'member')
+    this_repo.get_repo_structure()
+    this_team.get_team_structure()
+
+
+def build_snapshot(org:SyntheticOrg)-> list:
+    '''
+    model-snapshot: a RepoObject for every repo of org, all held at once like a discovery run with --db or --incremental.
+    Each repo is decoded from json first like an API payload, so logins are only shared between repos if the model shares them.
+    '''
+    snapshot = []
+    for name, repo in org.repos.items():
+        payload = json.loads(json.dumps({
+            'collaborators': repo['collaborators'],
+            'outside': sorted(repo['outside']),
+            'teams': repo['teams'],
+            'authors': [author for author, parent in repo['history'].values() if author],
+        }))
+        this_repo = RepoObject(name)
+        for login, role in payload['collaborators'].items():
+            if login in payload['outside']:
+                this_repo.add_outside_collabs(login, role)
+            else:
+                this_repo.add_direct_collabs(login, role)
+        for slug, role in payload['teams'].items():
+            this_repo.add_team(slug, role)
+        for login in payload['authors']:
+            this_repo.add_contributor(login)
+        snapshot.append(this_repo)
+    return snapshot
+
+
+def run_scenario(scenario:str, gh:Github, org:SyntheticOrg, base_url:str, transport:Transport)-> None:
+    if scenario == 'model-roles': # In memory only. No API calls
+        return build_large_roles(args.model_logins)
+    if scenario == 'model-snapshot':
+        return build_snapshot(org)
+    gh_org = gh.get_organization(org.name)
+    if scenario.endswith('-async'):
+        client = AsyncGitHubClient('fake-token', base_url, args.concurrency, transport.scheduler, transport.profiler, transport.cache)
+        engine = AsyncDiscoveryEngine(client, org.name)
+        if scenario == 'repos-async':
+            results = engine.discover_repositories()
+        elif scenario == 'contributors-async':
+            results = engine.discover_repositories(discover_contributors=True, branch='all')
+        else:
+            results = engine.discover_teams()
+        for name, this_object, err in results:
+            if err:
+                raise err
+        engine.close()
+    if scenario == 'repos':
+        for repo in gh_org.get_repos(type='all', sort='pushed'):
+            discover_repository(repo).get_repo_structure()
+    elif scenario == 'repos-parallel':
+        repos = list(gh_org.get_repos(type='all', sort='pushed'))
+        for name, this_repo, err in discover_repositories(repos, lambda: new_client(base_url), args.workers):
+            if err:
+                raise err
+            this_repo.get_repo_structure()
+    elif scenario == 'contributors':
+        for repo in gh_org.get_repos(type='all', sort='pushed'):
+            discover_repository(repo, discover_contributors=True, branch='all').get_repo_structure()
+    elif scenario == 'teams':
+        for team in gh_org.get_teams():
+            discover_team(team).get_team_structure()
+    elif scenario == 'org':
+        discover_org(gh_org).get_org_member_structure()
+    elif scenario == 'team-sync':
+        for team in gh_org.get_teams():
+            set_team_membership_from_yaml(gh, team, desired_team(org.teams[team.slug]))
+    elif scenario == 'org-sync':
+        set_org_membership_from_yaml(gh, gh_org, desired_org(org))
+    elif scenario == 'audit-delta': # What discovery.py --audit-log does for the --audit-events in the audit log
+        with tempfile.TemporaryDirectory(prefix='benchmark-audit-') as work_dir:
+            store = SnapshotStore(os.path.join(work_dir, 'snapshots.db'))
+            store.begin_snapshot(org.name)
+            cursor = AuditLogCursor(os.path.join(work_dir, 'cursor.json'), org.name)
+            cursor.start('1970-01-01T00:00:00Z')
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+                sync_from_audit_log(gh, org.name, store, cursor, store.add)
+            store.finish_snapshot()
+            store.close()
+
+
+def measure(scenario:str, base_url:str, results)-> None:
+    '''
+    Run one scenario in this process and put {'seconds', 'rss_mb', 'rss_growth_mb'} on results.
+    Peak RSS is read from the OS. The growth is the part allocated after the client was set up.
+    '''
+    cache_dir = tempfile.mkdtemp(prefix='benchmark-cache-') if args.cache else None
+    try:
+        profiler = ApiProfiler() if args.profile else None
+        transport = Transport(cache=ResponseCache(cache_dir) if cache_dir else None, scheduler=RateLimitScheduler(write_interval=args.write_interval), profiler=profiler)
+        transport.install()
+        gh = new_client(base_url)
+        # The same org the server made, used to build the desired state of the sync scenarios.
+        # model-snapshot builds its objects from a larger org of its own, made before the baseline is taken
+        org = SyntheticOrg(**dict(org_args, repos=args.model_repos) if scenario == 'model-snapshot' else org_args)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            if cache_dir and not scenario.startswith('model-'):
+                run_scenario(scenario, gh, org, base_url, transport)
+                server_call(base_url, '/_reset', {'seed': args.seed}) # Zero the counters, keep the cache
+                profiler = transport.profiler = ApiProfiler() if args.profile else None
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            run_scenario(scenario, gh, org, base_url, transport)
+            seconds = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux
+        if profiler:
+            print(f'[INFO] Scenario: {scenario}', file=sys.stderr)
+            profiler.report(top=10)
+        results.put({'seconds': seconds, 'rss_mb': peak / 1024, 'rss_growth_mb': (peak - baseline) / 1024})
+    except Exception as err:
+        results.put({'error': f'{type(err).__name__}: {err}'})
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+context = multiprocessing.get_context('fork')
+state = FakeGitHubState(org_args, args.rate_limit, args.latency)
+port_queue = context.Queue()
+server_process = context.Process(target=serve, args=(state, port_queue), daemon=True)
+server_process.start()
+base_url = f'http://127.0.0.1:{port_queue.get(timeout=60)}'
+print(f"[INFO] Fake org {args.org}: {args.repos} repos, {args.teams} teams, {args.members} members, {args.collaborators} collaborators, "
+      f"{args.branches + 1} branches and {args.commits} commits per repo. Latency {args.latency * 1000:.0f}ms", file=sys.stderr)
+
+report = []
+failed = [] # Scenarios that errored or went over --memory-budget
+try:
+    for scenario in scenarios:
+        runs = []
+        for n in range(args.repeat):
+            server_call(base_url, '/_reset', {'seed': args.seed})
+            results = context.Queue()
+            child = context.Process(target=measure, args=(scenario, base_url, results))
+            child.start()
+            result = results.get()
+            child.join()
+            if 'error' in result:
+                print(f"[WARNING] Scenario {scenario} failed: {result['error']}", file=sys.stderr)
+                failed.append(scenario)
+                break
+            result.update(server_call(base_url, '/_stats'))
+            runs.append(result)
+        if not runs:
+            continue
+        median = sorted(runs, key=lambda run: run['seconds'])[len(runs) // 2]
+        growth = max(run['rss_growth_mb'] for run in runs)
+        over_budget = scenario == 'model-snapshot' and growth > args.memory_budget
+        if over_budget:
+            print(f'[WARNING] Scenario {scenario} failed: RSS grew {growth:.1f}MB for {args.model_repos} repos. Budget is {args.memory_budget:.0f}MB', file=sys.stderr)
+            failed.append(scenario)
+        report.append({
+            'scenario': scenario,
+            'seconds': round(statistics.median(run['seconds'] for run in runs), 3),
+            'api_calls': median['requests'],
+            'not_modified': median['not_modified'],
+            'rss_mb': round(max(run['rss_mb'] for run in runs), 1),
+            'rss_growth_mb': round(growth, 1),
+            'failed': over_budget,
+            'routes': median['routes'],
+        })
+finally:
+    server_process.terminate()
+
+print(f"{'scenario':<16}{'seconds':>10}{'api calls':>11}{'304s':>8}{'peak rss MB':>13}{'growth MB':>11}")
+for row in report:
+    print(f"{row['scenario']:<16}{row['seconds']:>10.3f}{row['api_calls']:>11}{row['not_modified']:>8}{row['rss_mb']:>13.1f}{row['rss_growth_mb']:>11.1f}"
+          f"{'  FAILED' if row['failed'] else ''}")
+
+if args.json:
+    with open(args.json, 'w') as file:
+        json.dump({'org': org_args, 'workers': args.workers, 'latency': args.latency, 'cache': args.cache,
+                   'model_logins': args.model_logins, 'model_repos': args.model_repos, 'memory_budget_mb': args.memory_budget, 'results': report}, file, indent=2)
+
+if failed:
+    print(f"Exiting: Scenarios failed: {', '.join(failed)}")
+    exit(1)
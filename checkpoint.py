@@ -0,0 +1,135 @@
+import os
+import abc
+import json
+import threading
+
+DEFAULT_JOURNAL_FILE = 'discovery.journal'
+
+
+class JournalError(Exception):
+    pass
+
+
+class JsonLinesJournal(abc.ABC):
+    '''
+    Append only file of json records, one per line. Each record is flushed as soon as it is written,
+    so the journal survives a rate limit, a dropped connection or Ctrl-C up to the last record.
+    The first record holds the options of the run that wrote it. A line cut short by the process dying is dropped on load.
+    Subclasses keep what they need from each record in load_record.
+    ---
+    journal_file:str = File to write the journal to
+    options:dict = Options of the run. Resuming a journal written with other options raises JournalError.
+    resume:bool = Load the journal in journal_file and append to it. Otherwise any old journal is replaced.
+    '''
+    def __init__(self, journal_file:str, options:dict, resume:bool = False) -> None:
+        self.journal_file = journal_file
+        self.options = options
+        self.lock = threading.Lock()
+        if resume and os.path.exists(journal_file) and os.path.getsize(journal_file):
+            self._load()
+            self.file = open(journal_file, 'a')
+        else:
+            self.file = open(journal_file, 'w')
+            self._append({'run': options})
+
+    def _load(self) -> None:
+        good_bytes = 0
+        with open(self.journal_file, 'rb') as file:
+            for number, line in enumerate(file):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # Cut short when the last run died. Everything after it is dropped too.
+                if not line.endswith(b'\n'):
+                    break
+                if number == 0:
+                    if record.get('run') != self.options:
+                        raise JournalError(f'{self.journal_file} was written by a run with other options: {record.get("run")}')
+                else:
+                    self.load_record(record)
+                good_bytes += len(line)
+        if good_bytes == 0:
+            raise JournalError(f'{self.journal_file} is not a journal')
+        with open(self.journal_file, 'r+b') as file:
+            file.truncate(good_bytes)
+
+    @abc.abstractmethod
+    def load_record(self, record:dict) -> None:
+        ''' Keep what a resumed run needs from one record read back from the journal, after the run options '''
+
+    def _append(self, record:dict) -> None:
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def finish(self) -> None:
+        ''' The run completed. Nothing is left to resume so the journal is removed. '''
+        self.close()
+        os.remove(self.journal_file)
+
+
+class CheckpointJournal(JsonLinesJournal):
+    '''
+    Journal of a discovery run so a crawl that dies part way can be resumed.
+    Every discovered repo, team and org is written as soon as it is complete.
+        {"run": {options}}                                              First line. What the run discovers.
+        {"org": org, "type": "repo", "name": name, "structure": {...}}  A finished repo, team or org
+        {"org": org, "cursor": "repositories", "after": cursor}         A GraphQL listing is done up to cursor
+    ---
+    journal_file:str = File to write the journal to
+    options:dict = Options of the run that change what is discovered, ie. {'repo': 'all', 'contributors': False}.
+        Resuming a journal written with other options raises JournalError.
+    resume:bool = Load the journal in journal_file and append to it. Otherwise any old journal is replaced.
+
+    Example:
+    ```
+    journal = CheckpointJournal('discovery.journal', {'repo': 'all'}, resume=True)
+    for repo in org.get_repos(type='all', sort='pushed'):
+        if not journal.done('my-org', 'repo', repo.name):
+            journal.add('my-org', discover_repository(repo).get_repo_structure())
+    journal.finish() # Complete, the journal is removed
+    ```
+    '''
+    def __init__(self, journal_file:str, options:dict, resume:bool = False) -> None:
+        self.entities = {} # (org, type, name) -> structure
+        self.cursors = {} # (org, listing) -> cursor
+        super().__init__(journal_file, options, resume)
+
+    def load_record(self, record:dict) -> None:
+        if 'cursor' in record:
+            self.cursors[(record['org'], record['cursor'])] = record['after']
+        else:
+            self.entities[(record['org'], record['type'], record['name'])] = record['structure']
+
+    def done(self, org:str, entity_type:str, name:str) -> dict:
+        ''' The journaled structure of a repo, team or org, or None if it still has to be discovered '''
+        return self.entities.get((org, entity_type, name))
+
+    def names(self, org:str, entity_type:str) -> set:
+        ''' Names of the journaled repos or team slugs of an org '''
+        with self.lock:
+            return {name for (entity_org, kind, name) in self.entities if entity_org == org and kind == entity_type}
+
+    def structures(self, org:str) -> list:
+        ''' Every journaled structure of an org in the order it was discovered '''
+        with self.lock:
+            return [structure for (entity_org, kind, name), structure in self.entities.items() if entity_org == org]
+
+    def add(self, org:str, structure:dict) -> None:
+        ''' Journal a finished structure, ie. this_repo.get_repo_structure() '''
+        for name, data in structure.items():
+            with self.lock:
+                self.entities[(org, data['type'], name)] = structure
+            self._append({'org': org, 'type': data['type'], 'name': name, 'structure': structure})
+
+    def cursor(self, org:str, listing:str) -> str:
+        ''' Cursor the listing is done up to, or None to start from the first page '''
+        return self.cursors.get((org, listing))
+
+    def add_cursor(self, org:str, listing:str, after:str) -> None:
+        with self.lock:
+            self.cursors[(org, listing)] = after
+        self._append({'org': org, 'cursor': listing, 'after': after})
@@ -1,4 +1,13 @@
+import re
+import sys
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import github.GithubObject
+import github.NamedUser
 import github.Organization
+import github.Repository
 import github.Team
 import yaml
 import github
@@ -19,17 +28,218 @@ class IndentDumper(yaml.Dumper):
         return super(IndentDumper, self).increase_indent(flow, False)
 
 
+# libyaml backed dumper and loader. Much faster than the pure Python ones on multi-megabyte snapshots. Not always installed.
+FastDumper = getattr(yaml, 'CDumper', None)
+FastSafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+PRINTABLE_ASCII = re.compile(r'[\x20-\x7e]*')
+YAML_WIDTH = 80 # Column past which PyYAML wraps scalars at a space. Its default.
+SEQUENCE_ITEM = re.compile(r'( *)-( |$)')
+
+
+def is_printable_ascii(data)-> bool:
+    ''' True if every string in a nested structure of dicts, lists, str and int is printable ascii with no line breaks. Empty keys don't count. '''
+    if isinstance(data, str):
+        return PRINTABLE_ASCII.fullmatch(data) is not None
+    elif isinstance(data, dict):
+        return all(key != '' and is_printable_ascii(key) and is_printable_ascii(value) for key, value in data.items())
+    elif isinstance(data, (list, tuple)):
+        return all(is_printable_ascii(item) for item in data)
+    return True
+
+
+def indent_sequences(text:str)-> str:
+    '''
+    Apply the IndentDumper fix to yaml emitted by libyaml, which can't be subclassed the same way.
+    Indents sequence items that libyaml puts on the same level as their parent key.
+    Only safe for sequences of scalars with no line breaks, see dump_yaml.
+    '''
+    lines = text.splitlines(keepends=True)
+    parent_indent = None
+    for index, line in enumerate(lines):
+        item = SEQUENCE_ITEM.match(line)
+        if item:
+            if len(item.group(1)) == parent_indent:
+                lines[index] = '  ' + line
+        elif line.rstrip('\n').endswith(':'):
+            parent_indent = len(line) - len(line.lstrip(' '))
+        else:
+            parent_indent = None
+    return ''.join(lines)
+
+
+def dump_yaml(structure:dict)-> str:
+    '''
+    Returns structure as yaml. Same output as yaml.dump(structure, sort_keys=False, Dumper=IndentDumper)
+    for the structures the exporters produce, where sequences only hold scalars. See indent_sequences.
+    libyaml is used when it is installed and every string is printable ascii on one line, which covers logins, slugs and urls.
+    libyaml escapes other text slightly differently so anything else goes through IndentDumper.
+    libyaml would wrap long scalars before indent_sequences moves them, so it doesn't wrap at all here.
+    Output with a line past YAML_WIDTH, which IndentDumper would have wrapped, is made again with IndentDumper.
+    '''
+    if FastDumper and is_printable_ascii(structure):
+        text = indent_sequences(yaml.dump(structure, sort_keys=False, Dumper=FastDumper, width=-1)) # -1 is no limit
+        if all(len(line) <= YAML_WIDTH for line in text.splitlines()):
+            return text
+    return yaml.dump(structure, sort_keys=False, Dumper=IndentDumper)
+
+
+# Order roles are exported in. Repo roles first, then team roles. Unknown roles such as custom roles sort after these.
+ROLE_ORDER = ['admin', 'maintain', 'write', 'triage', 'read', 'maintainer', 'member']
+
+
+def sorted_logins(logins)-> list:
+    '''
+    Returns logins or team slugs as a sorted list so exported output is the same on every run
+    no matter which order GitHub listed them in or which backend discovered them.
+    '''
+    return sorted(logins, key=lambda login: str(login).lower())
+
+
+def sorted_roles(roles:dict)-> dict:
+    '''
+    Returns a copy of a role -> logins dict with roles in ROLE_ORDER and the logins of each role sorted.
+    '''
+    def rank(role):
+        return (ROLE_ORDER.index(role), '') if role in ROLE_ORDER else (len(ROLE_ORDER), str(role))
+    return {role: sorted_logins(roles[role]) for role in sorted(roles, key=rank)}
+
+
+# Built-in repo roles from least to most access. Asking for a role matches it and every role above it.
+REPO_ROLES = ['read', 'triage', 'write', 'maintain', 'admin']
+
+
+def roles_at_least(role:str)-> list:
+    ''' The repo roles that give at least the access of role. A custom role only matches itself. '''
+    if role in REPO_ROLES:
+        return REPO_ROLES[REPO_ROLES.index(role):]
+    return [role]
+
+
+def role_rank(role:str)-> tuple:
+    ''' Sort key of a repo role by access given. Built-in roles rank above custom roles. '''
+    return (REPO_ROLES.index(role) if role in REPO_ROLES else -1, role)
+
+
+def strongest_role(roles)-> str:
+    ''' The role giving the most access '''
+    return max(roles, key=role_rank)
+
+
+def by_role(access:dict)-> dict:
+    ''' {name: role} as role -> names in the same order as the discovery output '''
+    roles = {}
+    for name, role in access.items():
+        roles.setdefault(role, []).append(name)
+    return sorted_roles(roles)
+
+
+def index_roles(roles:dict)-> dict:
+    '''
+    Returns a role -> logins dict as login -> role, ie. {'write': ['DevDude76']} becomes {'DevDude76': 'write'}.
+    A login listed under more than one role keeps the last one, the same as GitHub where a login has one role.
+    '''
+    return {login: role for role, logins in (roles or {}).items() for login in logins or []}
+
+
+class RoleDiff:
+    '''
+    Difference between the current and desired role -> logins structures of a team's members,
+    a repo's collaborators or a repo's teams. Computed with set operations over login indexes.
+    Each result is a dict keyed by login so it can be walked in sorted_logins order.
+    ---
+    current:dict = role -> logins as it is in GitHub, ie. TeamObject.members
+    desired:dict = role -> logins loaded from an input file
+
+    Example:
+    ```
+    diff = RoleDiff({'maintainer': ['TeamLead'], 'member': ['Dev1']}, {'member': ['TeamLead', 'Dev2']})
+    diff.added    # {'Dev2': 'member'}
+    diff.removed  # {'Dev1': 'member'}
+    diff.changed  # {'TeamLead': ('maintainer', 'member')}
+    ```
+    '''
+    def __init__(self, current:dict, desired:dict) -> None:
+        self.current = index_roles(current)
+        self.desired = index_roles(desired)
+        current_logins = self.current.keys()
+        desired_logins = self.desired.keys()
+        self.added = {login: self.desired[login] for login in desired_logins - current_logins}
+        self.removed = {login: self.current[login] for login in current_logins - desired_logins}
+        self.changed = {login: (self.current[login], self.desired[login])
+                        for login in current_logins & desired_logins if self.current[login] != self.desired[login]}
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+class OrgMembershipDiff:
+    '''
+    Difference between the current org membership and the membership loaded from an input file.
+    Computed with set operations so it stays linear on orgs with tens of thousands of members.
+    - invite: Desired members who are not members yet and have no pending invite
+    - pending: Desired members who are not members yet but already have a pending invite. Nothing to do.
+    - convert: Current members listed only as collaborators. Converted to outside collaborators.
+    - remove: Current members not listed as members or collaborators
+    - remove_collab: Current outside collaborators not listed as members or collaborators
+    ---
+    current_members, current_collaborators, pending_invites = Logins as they are in GitHub, ie. from discover_org
+    desired_members, desired_collaborators = Logins loaded from an input file
+    '''
+    def __init__(self, current_members, current_collaborators, pending_invites, desired_members, desired_collaborators) -> None:
+        current_members = set(current_members or [])
+        current_collaborators = set(current_collaborators or [])
+        pending_invites = set(pending_invites or [])
+        desired_members = set(desired_members or [])
+        desired_collaborators = set(desired_collaborators or [])
+        desired = desired_members | desired_collaborators
+
+        new_members = desired_members - current_members
+        self.invite = new_members - pending_invites
+        self.pending = new_members & pending_invites
+        self.convert = (desired_collaborators & current_members) - desired_members
+        self.remove = current_members - desired
+        self.remove_collab = current_collaborators - desired
+
+    def __bool__(self) -> bool:
+        return bool(self.invite or self.convert or self.remove or self.remove_collab)
+
+
+def intern_login(login):
+    ''' The one shared copy of a login string. Logins repeat across every repo and team of an org. '''
+    return sys.intern(login) if type(login) is str else login
+
+
+def add_to_role(roles:dict, role:str, login:str)-> None:
+    '''
+    Add login to the set of role in a role -> logins dict. The set is added to in place so building a role is linear.
+    '''
+    logins = roles.get(role)
+    if logins is None:
+        logins = roles[role] = set()
+    logins.add(intern_login(login))
+
+
+def remove_from_roles(roles:dict, login:str)-> None:
+    ''' Remove login from every role of a role -> logins dict. Roles left empty are dropped. '''
+    for role in [role for role, logins in roles.items() if login in logins]:
+        roles[role].discard(login)
+        if not roles[role]:
+            del roles[role]
+
+
 class RepoObject:
     '''
     Class for representing a GitHub repo as yaml or as a python dict
+    Roles are kept as role -> set of logins and only turned into sorted lists by get_repo_structure().
         Obj Strcuture: 
              self.name: {
                 "description": str(self.description),
                 "html_url": str(self.html_url),
-                "direct_collabs": list(self.direct_collabs),
-                "outside_collabs": list(self.outside_collabs),
-                "teams": list(self.teams),
-                "contributors": list(self.contributors)
+                "direct_collabs": sorted_roles(self.direct_collabs),
+                "outside_collabs": sorted_roles(self.outside_collabs),
+                "teams": sorted_roles(self.teams),
+                "contributors": sorted_logins(self.contributors)
             }
 
     # Yaml Structure of a sample repo
@@ -53,16 +263,19 @@ class RepoObject:
         - ExpiredContractor # User who's made commits but may no longer be a collab or in a team.
     ```    
     '''  
+    # No __dict__ per object. An org snapshot holds one of these for every repo.
+    __slots__ = ('name', 'description', 'type', 'html_url', 'direct_collabs', 'outside_collabs', 'teams', 'contributors', 'api_calls_saved')
 
     def __init__(self, name) -> None:
         self.name: str = name
         self.description: str = None
         self.type: str = 'repo'
         self.html_url: str = None
-        self.direct_collabs: dict = {}
-        self.outside_collabs: dict = {}
-        self.teams: dict = {}
+        self.direct_collabs: dict = {} # role -> set of logins
+        self.outside_collabs: dict = {} # role -> set of logins
+        self.teams: dict = {} # role -> set of team slugs
         self.contributors: set = set()
+        self.api_calls_saved: int = 0 # Discovery stat only. Not exported.
 
     def add_contributor(self, login: str)-> None:
         ''' 
@@ -70,46 +283,49 @@ class RepoObject:
         This value is useful only as a discovery item. Meaning it is populated by checking commits made on a branch.
         Setting this here would be meaningless.
         '''
-        self.contributors.add(login)
+        self.contributors.add(intern_login(login))
 
     def add_direct_collabs(self, login: str, role: str)-> None:
         ''' Add github login to list of direct collaborators'''
-        if role in self.direct_collabs.keys():
-            current_direct_collabs = set(self.direct_collabs[role]) # convert list to set to avoid duplicates
-            current_direct_collabs.add(login)           
-            self.direct_collabs[role] = list(current_direct_collabs) # Convert set back to list for yaml export
-        else:
-            self.direct_collabs[role] = list() # Make empty list since the role set is empty so we don't need to worry about dupes
-            self.direct_collabs[role].append(login)
+        add_to_role(self.direct_collabs, role, login)
 
     def add_outside_collabs(self, login: str, role: str)-> None:
         ''' Add github login to list of outside collaborators'''
-        if role in self.outside_collabs.keys():
-            current_outside_collabs = set(self.outside_collabs[role]) # convert list to set to avoid duplicates
-            current_outside_collabs.add(login)           
-            self.outside_collabs[role] = list(current_outside_collabs) # Convert set back to list for yaml export
-        else:
-            self.outside_collabs[role] = list() # Make empty list since the role set is empty so we don't need to worry about dupes
-            self.outside_collabs[role].append(login)
+        add_to_role(self.outside_collabs, role, login)
 
     def add_team(self, team_slug: str, role: str)-> None:
         '''
         Add a team name expressed as a github slug and adds it to the list.
         '''
-        #self.teams.add(team_slug)
-        if role in self.teams.keys():
-            current_teams = set(self.teams[role]) # convert list to set to avoid duplicates
-            current_teams.add(team_slug)
-            self.teams[role] = list(current_teams) # Convert set back to list for yaml export
-        else:
-            self.teams[role] = list() # Make empty list since the role set is empty so we don't need to worry about dupes
-            self.teams[role].append(team_slug) 
+        add_to_role(self.teams, role, team_slug)
 
     def remove_team(self, team_slug: str)-> None:
         '''
         Remove a team name identified as a github slug from the team on this object.
         '''
-        self.teams.discard(team_slug) 
+        remove_from_roles(self.teams, team_slug)
+
+    @classmethod
+    def from_structure(cls, structure:dict):
+        '''
+        Build a RepoObject back from the output of get_repo_structure(), ie. a repo loaded from a previous snapshot.
+        '''
+        name, data = next(iter(structure.items()))
+        this_repo = cls(name)
+        this_repo.description = data.get('description')
+        this_repo.html_url = data.get('html_url')
+        for role, logins in (data.get('direct_collabs') or {}).items():
+            for login in logins:
+                this_repo.add_direct_collabs(login, role)
+        for role, logins in (data.get('outside_collabs') or {}).items():
+            for login in logins:
+                this_repo.add_outside_collabs(login, role)
+        for role, team_slugs in (data.get('teams') or {}).items():
+            for team_slug in team_slugs:
+                this_repo.add_team(team_slug, role)
+        for login in data.get('contributors') or []:
+            this_repo.add_contributor(login)
+        return this_repo
 
     def get_repo_structure(self) -> dict:
         '''
@@ -122,10 +338,10 @@ class RepoObject:
                 "description": str(self.description),
                 "html_url": str(self.html_url),
                 "type": str(self.type),
-                "direct_collabs": self.direct_collabs,
-                "outside_collabs": self.outside_collabs,
-                "teams": self.teams,
-                "contributors": list(self.contributors)
+                "direct_collabs": sorted_roles(self.direct_collabs),
+                "outside_collabs": sorted_roles(self.outside_collabs),
+                "teams": sorted_roles(self.teams),
+                "contributors": sorted_logins(self.contributors)
             }
         }
 
@@ -133,12 +349,13 @@ class RepoObject:
         '''
         Returns repo object as a yaml formated string.      
         '''
-        return yaml.dump(self.get_repo_structure(), sort_keys=False, Dumper=IndentDumper)
+        return dump_yaml(self.get_repo_structure())
 
 
 class TeamObject:
     '''
     Class for representing a GitHub Team membership as yaml.     
+    Members are kept as role -> set of logins and only turned into sorted lists by get_team_structure().
         TeamObj Structure {
             team.slug: {
                 "name": str(self.name),
@@ -147,11 +364,12 @@ class TeamObject:
                 "id": int(self.id),
                 "parent_id": str(self.parent.id),
                 "parent_name": str(self.parent.name),                               
-                "members": list(self.members)
+                "members": sorted_roles(self.members)
             }
         }    
     '''
-    
+    __slots__ = ('slug', 'name', 'type', 'id', 'html_url', 'description', 'parent_id', 'parent_name', 'members')
+
     def __init__(self, slug) -> None:
         self.slug:str = slug
         self.name:str = None
@@ -161,21 +379,32 @@ class TeamObject:
         self.description:str = None
         self.parent_id:int = 0
         self.parent_name:str = None
-        self.members:dict = {}
+        self.members:dict = {} # role -> set of logins
 
 
     def add_member(self, login: str, role: str = 'member')-> None:
-#        self.members.add(login)
-        if role in self.members.keys():
-            current_members = set(self.members[role]) # convert list to set to avoid duplicates
-            current_members.add(login)
-            self.members[role] = list(current_members) # Convert set back to list for yaml export
-        else:
-            self.members[role] = list()   
-            self.members[role].append(login)
+        add_to_role(self.members, role, login)
 
     def remove_member(self, login)-> None:
-        self.members.difference(login)
+        remove_from_roles(self.members, login)
+
+    @classmethod
+    def from_structure(cls, structure:dict):
+        '''
+        Build a TeamObject back from the output of get_team_structure(), ie. a team loaded from a previous snapshot.
+        '''
+        slug, data = next(iter(structure.items()))
+        this_team = cls(slug)
+        this_team.name = data.get('name')
+        this_team.description = data.get('description')
+        this_team.html_url = data.get('html_url')
+        this_team.id = data.get('id') or 0
+        this_team.parent_id = data.get('parent_id') or 0
+        this_team.parent_name = data.get('parent_name')
+        for role, logins in (data.get('members') or {}).items():
+            for login in logins:
+                this_team.add_member(login, role)
+        return this_team
 
     def get_team_structure(self) -> dict:
         '''
@@ -192,20 +421,22 @@ class TeamObject:
                 "id": int(self.id),
                 "parent_id": int(self.parent_id),
                 "parent_name": str(self.parent_name),                               
-                "members": self.members
+                "members": sorted_roles(self.members)
             }
         }
     def get_team_as_yaml(self) -> str:
         '''
         Returns team object as a yaml formated string.      
         '''
-        return yaml.dump(self.get_team_structure(), sort_keys=False, Dumper=IndentDumper)
+        return dump_yaml(self.get_team_structure())
 
 
 class OrgObject:
     '''
     Class for representing a GitHub Org membership as Yaml
     '''
+    __slots__ = ('login', 'name', 'description', 'members_list', 'outside_collaborators', 'invitations', 'type')
+
     def __init__(self, login) -> None:
         self.login = login
         self.name: str = None
@@ -216,19 +447,39 @@ class OrgObject:
         self.type: str = 'org'
 
     def add_member(self, login)-> None:
-        self.members_list.add(login)
+        self.members_list.add(intern_login(login))
 
     def remove_member(self, login)-> None:
         self.members_list.discard(login)
 
     def add_collab(self, login)-> None:
-        self.outside_collaborators.add(login)
+        self.outside_collaborators.add(intern_login(login))
 
     def remove_collab(self, login)-> None:
         self.outside_collaborators.discard(login)
 
     def add_invited_user(self, login)-> None: # This is pulled from GH and not something we intend to set here.
-        self.invitations.add(login)
+        self.invitations.add(intern_login(login))
+
+    def remove_invited_user(self, login)-> None:
+        self.invitations.discard(login)
+
+    @classmethod
+    def from_structure(cls, structure:dict):
+        '''
+        Build an OrgObject back from the output of get_org_member_structure(), ie. an org loaded from a previous snapshot.
+        '''
+        login, data = next(iter(structure.items()))
+        this_org = cls(login)
+        this_org.name = data.get('name')
+        this_org.description = data.get('description')
+        for member in data.get('members') or []:
+            this_org.add_member(member)
+        for collab in data.get('collaborators') or []:
+            this_org.add_collab(collab)
+        for invited in data.get('pending_invites') or []:
+            this_org.add_invited_user(invited)
+        return this_org
 
     def get_org_member_structure(self) -> dict:
         '''
@@ -246,9 +497,9 @@ class OrgObject:
                 "name": str(self.name),
                 "description": str(self.description),
                 "type": str(self.type),
-                "members": list(self.members_list),
-                "collaborators": list(self.outside_collaborators),
-                "pending_invites": list(self.invitations)
+                "members": sorted_logins(self.members_list),
+                "collaborators": sorted_logins(self.outside_collaborators),
+                "pending_invites": sorted_logins(self.invitations)
             }
         }
 
@@ -256,9 +507,90 @@ class OrgObject:
         '''
         Returns Org Membership object as a yaml formated string.      
         '''
-        return yaml.dump(self.get_org_member_structure(), sort_keys=False, Dumper=IndentDumper)
+        return dump_yaml(self.get_org_member_structure())
+
+
+OUTPUT_FORMATS = ['yaml', 'json', 'ndjson']
 
 
+class OutputWriter:
+    '''
+    Writes each discovered document to stdout and optionally to a file as soon as it is ready.
+    Both are flushed after every document, so if a long crawl dies part way everything discovered so far is on disk.
+    Each document is serialized once in one of the OUTPUT_FORMATS
+        yaml: yaml documents. When writing to a file the output starts with the yaml doc string --- and the file is appended to.
+        json: One json object holding every document. Closed by close(). The file is overwritten.
+        ndjson: One json document per line. The file is appended to.
+    ---
+    output_file:str = File to write to or None for stdout only
+    output_format:str = yaml (default), json or ndjson
+    stdout = Stream for the console copy. Default is sys.stdout. None writes to the file only
+    '''
+    def __init__(self, output_file:str = None, output_format:str = 'yaml', stdout = sys.stdout) -> None:
+        self.stdout = stdout
+        self.output_format = output_format
+        self.documents = 0
+        self.file = None
+        if output_file:
+            self.file = open(output_file, "w" if output_format == 'json' else "a")
+            if output_format == 'yaml':
+                self._write("---\n")
+
+    def _write(self, text:str) -> None:
+        '''
+        Written as is with no extra newline because Yaml linters get fussy about newlines.
+        They want a file to end with exactly 1 and the yaml.dump already has one
+        '''
+        if self.stdout:
+            self.stdout.write(text)
+            self.stdout.flush()
+        if self.file:
+            self.file.write(text)
+            self.file.flush()
+
+    def write(self, structure:dict) -> None:
+        ''' Write one document ie. this_repo.get_repo_structure() '''
+        if self.output_format == 'json':
+            # Documents are {name: {...}} so each becomes one member of the json object
+            members = json.dumps(structure, indent=2)[1:-1].strip('\n')
+            self._write(("{\n" if self.documents == 0 else ",\n") + members)
+        elif self.output_format == 'ndjson':
+            self._write(json.dumps(structure) + "\n")
+        else:
+            self._write(dump_yaml(structure))
+        self.documents += 1
+
+    def close(self) -> None:
+        if self.output_format == 'json':
+            self._write("\n}\n" if self.documents else "{}\n")
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def load_documents(file_name:str, input_format:str = None)-> dict:
+    '''
+    Load a file written by discovery.py into one dict of {name: structure}.
+    input_format is yaml, json or ndjson. If not set it is worked out from the file extension and defaults to yaml.
+    Yaml files holding several documents, ie. from appending runs to the same file, are merged.
+    '''
+    if not input_format:
+        extension = file_name.rsplit('.', 1)[-1].lower()
+        input_format = {'json': 'json', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension, 'yaml')
+    documents = {}
+    with open(file_name, 'r') as file:
+        if input_format == 'json':
+            documents.update(json.load(file))
+        elif input_format == 'ndjson':
+            for line in file:
+                if line.strip():
+                    documents.update(json.loads(line))
+        else:
+            for document in yaml.load_all(file, Loader=FastSafeLoader):
+                if document:
+                    documents.update(document)
+    return documents
+
 def discover_org(org:github.Organization.Organization)-> OrgObject:
     this_org = OrgObject(org.login)
     this_org.name = org.name
@@ -306,56 +638,309 @@ def discover_team(team:github.Team.Team)-> TeamObject:
     return this_team
 
 
-def discover_repository(repo:github.Repository.Repository, discover_contributors:bool = False, branch:str=None) ->RepoObject:
+def get_listing_field(gh_obj:github.GithubObject.GithubObject, field:str):
+    '''
+    Read a field straight from the payload a PyGithub object was built from.
+    Objects returned by a listing are not 'complete', so reading a missing attribute
+    like collab.permissions makes PyGithub fetch the whole object. This never calls the API and returns None instead.
+    '''
+    return gh_obj._rawData.get(field)
+
+
+def collaborator_permission_from_listing(collab:github.NamedUser.NamedUser)-> str:
+    '''
+    Returns the same value as repo.get_collaborator_permission(collab) ie. admin, write or read
+    using the permissions returned with each user by the repo collaborators listing.
+    GitHub reports maintain as write and triage as read here, so existing output does not change.
+    Returns None if the listing did not include permissions for this user.
+    '''
+    return collaborator_permission_from_payload(collab._rawData)
+
+
+def collaborator_permission_from_payload(collab:dict)-> str:
+    ''' collaborator_permission_from_listing for one user of the collaborators listing as a raw dict '''
+    permissions = collab.get('permissions')
+    if permissions:
+        if permissions.get('admin'):
+            return 'admin'
+        elif permissions.get('push'):
+            return 'write'
+        elif permissions.get('pull'):
+            return 'read'
+    role_name = collab.get('role_name')
+    if role_name == 'admin':
+        return 'admin'
+    elif role_name in ('maintain', 'write'):
+        return 'write'
+    elif role_name in ('triage', 'read'):
+        return 'read'
+    return None
+
+
+# Maps the permission field of the repo teams listing to the role names used in the yaml
+TEAM_PERMISSION_ROLES = {
+    'admin': 'admin',
+    'maintain': 'maintain',
+    'push': 'write',
+    'triage': 'triage',
+    'pull': 'read',
+}
+
+
+def team_permission_from_listing(team:github.Team.Team)-> str:
+    '''
+    Returns the team role on a repo ie. admin, maintain, write, triage or read
+    using the permission field returned with each team by repo.get_teams().
+    This gives the same result as working it out from team.get_repo_permission(repo) without the extra API call.
+    Returns None if the listing has no permission or a value we don't know, such as a custom role.
+    '''
+    return TEAM_PERMISSION_ROLES.get(get_listing_field(team, 'permission'))
+
+
+def team_role_from_permissions(permissions)-> str:
+    '''
+    Strongest repo role in a permissions dict or github.Permissions.Permissions, ie. from team.get_repo_permission(repo).
+    Returns None if no permission is set.
+    '''
+    if isinstance(permissions, dict):
+        permissions = github.Permissions.Permissions(None, {}, permissions, completed=True)
+    # Example of custom type <class 'github.Permissions.Permissions'>
+    # The following is considered 'Write' permission in the GitHub UI
+    # Permissions(triage=True, push=True, pull=True, maintain=False, admin=False)
+    if permissions.admin == True:
+        return 'admin'
+    elif permissions.maintain == True:
+        return 'maintain'
+    elif permissions.push == True:
+        return 'write'
+    elif permissions.triage == True:
+        return 'triage'
+    elif permissions.pull == True:
+        return 'read'
+    return None
+
+
+class CommitWalk:
+    '''
+    Walk of one branch from its head over the commits listing, newest first, skipping history scanned before.
+    The listing is in date order, so a side branch merged later can be listed after a commit already scanned.
+    The walk keeps the parents it has yet to reach and only stops once none are left, rather than at the first
+    commit already scanned. Commits behind an already scanned commit are passed over without counting as new.
+    ---
+    head:str = sha of the branch head
+    seen:set = sha of every commit scanned so far, this run or as a branch head of an earlier run. Updated in place.
+
+    Example:
+    ```
+    walk = CommitWalk(branch.commit.sha, seen)
+    for commit in repo.get_commits(sha=branch.commit.sha):
+        if walk.visit(commit.sha, [parent.sha for parent in commit.parents]) and commit.author:
+            authors.add(commit.author.login)
+        if walk.done:
+            break
+    ```
+    '''
+    def __init__(self, head:str, seen:set) -> None:
+        self.seen = seen
+        self.pending = {head} # Reachable from the head and not reached yet
+        self.known = set() # Behind a commit already scanned
+
+    def visit(self, sha:str, parents:list)-> bool:
+        ''' Returns True if the commit has not been scanned before '''
+        self.pending.discard(sha)
+        if sha in self.seen or sha in self.known:
+            self.known.update(parents)
+            return False
+        self.seen.add(sha)
+        self.pending.update(parent for parent in parents if parent not in self.seen and parent not in self.known)
+        return True
+
+    @property
+    def done(self)-> bool:
+        return not self.pending
+
+
+def discover_commit_authors(repo:github.Repository.Repository, branches, watermark:dict = None)-> tuple:
+    '''
+    Returns (authors:set, watermark:dict) with the logins of everyone who authored a commit on the given branches.
+    Each commit is only counted once. A branch is walked from its head with CommitWalk until every commit behind it
+    has been reached or was scanned already, on another branch or behind a branch head saved in watermark by an earlier run.
+    Merged side branches older than the scanned history are still walked.
+    Authors saved in watermark are always kept, so the result is the authors of earlier runs plus those of the new history.
+    Authors of commits no longer on any branch, ie. after a force push or a deleted branch, stay until the watermark is dropped.
+    Branches whose head has not moved cost no API calls at all.
+    Commits whose author is not linked to a GitHub account have no login and are skipped.
+    ---
+    repo = github.Repository.Repository
+    branches = Iterable of github.Branch.Branch ie. repo.get_branches()
+    watermark:dict = Returned by the last run or None to scan everything
+        {"branches": {branch name: head sha}, "authors": [logins]}
+    '''
+    previous_heads = watermark['branches'] if watermark else {}
+    authors = set(watermark['authors']) if watermark else set()
+    seen = set(previous_heads.values())
+    heads = {}
+    for branch in branches:
+        head = branch.commit.sha
+        heads[branch.name] = head
+        if head in seen:
+            continue
+        walk = CommitWalk(head, seen)
+        for commit in repo.get_commits(sha=head):
+            if walk.visit(commit.sha, [parent.sha for parent in commit.parents]) and commit.author:
+                authors.add(commit.author.login)
+            if walk.done:
+                break # Everything from here back has already been scanned
+    return authors, {'branches': heads, 'authors': sorted(authors)}
+
+
+def discover_repository(repo:github.Repository.Repository, discover_contributors:bool = False, branch:str=None, contributor_watermarks:dict=None) ->RepoObject:
+    '''
+    Discover a repo's collaborators, team access and optionally who has commited to it.
+    ---
+    repo = github.Repository.Repository
+    discover_contributors:bool = Also discover contributors. Default branch only unless branch is set
+    branch:str = Branch name or 'all' to discover commit authors on every branch
+    contributor_watermarks:dict = Optional. Branch heads and authors saved by discover_commit_authors on an earlier run,
+        keyed by '<repo full name>@<branch>'. Updated in place so the caller can save it for the next run.
+    '''
     this_repo = RepoObject(name=repo.name)
     this_repo.html_url = repo.html_url
     # Add list of direct collaborators and their role
+    # Roles are read from the collaborators listing. Only ask GitHub per user if the listing lacks them.
     for collab in repo.get_collaborators(affiliation='direct'):
-        role = repo.get_collaborator_permission(collab)
+        role = collaborator_permission_from_listing(collab)
+        if role:
+            this_repo.api_calls_saved += 1
+        else:
+            role = repo.get_collaborator_permission(collab)
         this_repo.add_direct_collabs(login=collab.login, role=role)    
     # Add list of outside collaborators and their role
     for collab in repo.get_collaborators(affiliation='outside'):
-        role = repo.get_collaborator_permission(collab)
+        role = collaborator_permission_from_listing(collab)
+        if role:
+            this_repo.api_calls_saved += 1
+        else:
+            role = repo.get_collaborator_permission(collab)
         this_repo.add_outside_collabs(login=collab.login, role=role)
 
     for team in repo.get_teams():
-        perm = team.get_repo_permission(repo)
-        # Example of custom type <class 'github.Permissions.Permissions'>
-        # The following is considered 'Write' permission in the GitHub UI
-        # Permissions(triage=True, push=True, pull=True, maintain=False, admin=False)
-        if perm.admin == True:
-            this_repo.add_team(team.slug, 'admin')
-        elif perm.maintain == True:
-            this_repo.add_team(team.slug, 'maintain')
-        elif perm.push == True:
-            this_repo.add_team(team.slug, 'write') # Permissions(triage=True, push=True, pull=True, maintain=False, admin=False)
-        elif perm.triage == True:
-            this_repo.add_team(team.slug, 'triage')
-        elif perm.pull == True:
-            this_repo.add_team(team.slug, 'read')
+        role = team_permission_from_listing(team)
+        if role:
+            this_repo.api_calls_saved += 1
+            this_repo.add_team(team.slug, role)
+            continue
+        role = team_role_from_permissions(team.get_repo_permission(repo))
+        if role:
+            this_repo.add_team(team.slug, role)
 
     if discover_contributors: # Complete discovery was requested
-        authors = set()
         if not branch:
             #branches = [repo.get_branch(repo.default_branch)]
             contribs = repo.get_contributors() # Save a few hundred API calls by using builtin get_contributors method if default branch requested
             for author in contribs:
                 this_repo.add_contributor(str(author.login)) 
         else:    
-            if branch == 'all': # Get all branches and commits. API rate limit can be hit here. Improvement required
+            if branch == 'all': # Get all branches and commits. Commits shared by branches are only fetched once
                 branches = repo.get_branches()           
             elif branch:
                 branches = [repo.get_branch(branch)]    
-            
-            for branch in branches:
-                commits = repo.get_commits(sha=branch.name)
-                for commit in commits:
-                    authors.add(commit.author.login)
+
+            watermark = None
+            if contributor_watermarks is not None:
+                watermark_key = f'{repo.full_name}@{branch}'
+                watermark = contributor_watermarks.get(watermark_key)
+            authors, watermark = discover_commit_authors(repo, branches, watermark)
+            if contributor_watermarks is not None:
+                contributor_watermarks[watermark_key] = watermark
             for user in authors:
                 #print(f"{user.name},{user.login}")
                 this_repo.add_contributor(str(user))            
     return this_repo
 
+def discover_repositories(repos, client_factory, workers:int = 4, discover_contributors:bool = False, branch:str=None, discover=discover_repository):
+    '''
+    Run discover_repository for many repos at once over a bounded pool of worker threads.
+    Yields a tuple of (repo_name, RepoObject, error) for every repo in the same order the repos were given,
+    so output stays deterministic. error is None on success, otherwise the exception raised for that repo
+    and RepoObject is None. One failed repo does not stop the crawl.
+    ---
+    repos = iterable of github.Repository.Repository, ie. org.get_repos(type='all', sort='pushed')
+    client_factory = callable returning a new authenticated github.Github instance.
+        PyGithub shares one connection object per client and it is not safe to use from many threads,
+        so every worker thread gets a client of its own.
+    workers:int = Max number of repos discovered at the same time.
+    discover = Function called for each repo. Same signature as discover_repository, which is the default.
+    '''
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def discover_one(raw_repo:dict) -> RepoObject:
+        if not hasattr(local, 'gh'):
+            local.gh = client_factory()
+            with clients_lock:
+                clients.append(local.gh)
+        # Rebuild the repo on this thread's client from the listing payload. No extra API call is made.
+        repo = local.gh.create_from_raw_data(github.Repository.Repository, raw_repo)
+        return discover(repo, discover_contributors, branch)
+
+    def result(name:str, future):
+        try:
+            return name, future.result(), None
+        except Exception as err:
+            return name, None, err
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for repo in repos:
+                pending.append((repo.name, executor.submit(discover_one, repo._rawData)))
+                if len(pending) >= workers * 2: # Bound the number of queued repos so memory does not grow with org size
+                    yield result(*pending.popleft())
+            while pending:
+                yield result(*pending.popleft())
+    finally:
+        for client in clients:
+            client.close()
+
+
+class OrgContext:
+    '''
+    Per run cache of an org and its teams.
+    Teams are listed once, the first time they are needed, and indexed by slug so later lookups are answered from memory.
+    Call invalidate_teams after teams are created or deleted outside of this class so the next lookup lists them again.
+    ---
+    gh =  a GitHub class instance authenticated and connected to GitHub
+    org_name:str = login of the GitHub Organization
+
+    Example:
+    ```
+    context = OrgContext(gh, ORG_NAME)
+    team = context.get_team('team-awesome')
+    team = context.get_team('team-other') # No API call
+    ```
+    '''
+    def __init__(self, gh:github.Github, org_name:str) -> None:
+        self.gh = gh
+        self.org = gh.get_organization(org_name)
+        self.teams_by_slug: dict = None
+        self.lock = threading.RLock()
+
+    def _load_teams(self) -> None:
+        with self.lock:
+            if self.teams_by_slug is None:
+                self.teams_by_slug = {team.slug: team for team in self.org.get_teams()}
+
+    def get_team(self, team_slug:str)-> github.Team.Team:
+        ''' Team by slug or None if the org has no such team '''
+        self._load_teams()
+        return self.teams_by_slug.get(team_slug)
+
+    def invalidate_teams(self)-> None:
+        with self.lock:
+            self.teams_by_slug = None
+
 
 def github_team_exists(org:github.Organization, team_slug:str)-> bool:
     try:
@@ -390,7 +975,29 @@ def create_github_team(org:github.Organization, team_name:str, description:str =
         return None
     
 
-def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, action:str, role:str = 'member')-> bool:
+def lazy_user(gh:github.Github, login:str)-> github.NamedUser.NamedUser:
+    '''
+    A NamedUser for a login without calling the API. Enough for calls that only need the login in the url,
+    ie. team.add_membership. Only login is set, every other attribute is None.
+    '''
+    return gh.create_from_raw_data(github.NamedUser.NamedUser, {'login': login})
+
+
+def journaled_change(journal, action:dict, change)-> bool:
+    '''
+    Make a change through an ApplyJournal when there is one, see ApplyJournal.apply. Otherwise just make it.
+    Returns True if the change was made, None if an earlier run made it and False if it was not made.
+    ---
+    journal = ApplyJournal or None
+    action:dict = The change as a plan action, ie. {'op': 'org_invite', 'login': 'DevDude76'}
+    change = Callable making the change. Returns True when it was made.
+    '''
+    if journal:
+        return journal.apply(action, change)
+    return change()
+
+
+def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, action:str, role:str = 'member', current_members:dict = None, journal = None)-> bool:
     '''
     Add or remove a login from a GitHub team or change roles ie. member or maintainer.
     ---
@@ -399,6 +1006,10 @@ def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, a
     login:str = <GitHubLogin>  The github login to operate with.
     action:str = [add | del]  Add or remove member from team
     role:str = [member(default) | maintainer]  Github roles
+    current_members:dict = Optional. Known membership of the team as {login: role}, ie. from discover_team.
+        When given the user, membership and role lookups are skipped and only the change itself is sent.
+    journal = Optional ApplyJournal. The change is journaled, and skipped without calling GitHub if an earlier run made it.
+        None is returned for a skipped change.
 
     Example:
     ```
@@ -407,12 +1018,26 @@ def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, a
     ```
 
     '''
-    try: 
-        gh_user_obj = gh.get_user(login)
-    except github.GithubException as err:
-        print(err) 
-        print(f"Error: GitHub login not found: {login}")           
-        return False
+    if journal:
+        if action == 'add':
+            change = {'op': 'team_add', 'team': team.slug, 'login': login, 'role': role}
+        else:
+            change = {'op': 'team_remove', 'team': team.slug, 'login': login}
+        return journal.apply(change, lambda: update_team_membership(gh, team, login, action, role, current_members))
+
+    if current_members is not None:
+        if action == 'add' and current_members.get(login) == role:
+            return True
+        if action == 'del' and login not in current_members:
+            return True
+        gh_user_obj = lazy_user(gh, login) # A bad login fails on the change below instead
+    else:
+        try: 
+            gh_user_obj = gh.get_user(login)
+        except github.GithubException as err:
+            print(err) 
+            print(f"Error: GitHub login not found: {login}")           
+            return False
     
     if not gh_user_obj: # Something else happend that returned 'None' for user but did not throw an exception
         print(f"Warning: GitHub login not found: {login}")           
@@ -420,7 +1045,7 @@ def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, a
     
     if action == 'add':
         try: 
-            if team.has_in_members(gh_user_obj) and ( team.get_team_membership(gh_user_obj) ).role == role:
+            if current_members is None and team.has_in_members(gh_user_obj) and ( team.get_team_membership(gh_user_obj) ).role == role:
                 #print(f"Debug: {gh_user_obj.login} has role {role} in team {team.name}")
                 return True
             else:
@@ -442,7 +1067,7 @@ def update_team_membership(gh:github.Github, team:github.Team.Team, login:str, a
         return True
 
 
-def set_team_membership_from_yaml(gh:github.Github, gh_team:github.Team.Team, input_team_membership:dict)->None:
+def set_team_membership_from_yaml(gh:github.Github, gh_team:github.Team.Team, input_team_membership:dict, journal = None)->None:
     '''
     Modify a GitHub Team membership based on a structure loaded from a YAML input file.
     The GitHub team object is an input to this function so it is assumed to exist in GitHub.
@@ -451,6 +1076,7 @@ def set_team_membership_from_yaml(gh:github.Github, gh_team:github.Team.Team, in
     team = team object of type github.Team.Team
     gh_team = team object of type github.Team.Team 
     input_team_membership = Team membership structure loaded from an input file
+    journal = Optional ApplyJournal every change is made through
     
     Example of a GitHug team object
     gh_team = gh.get_organization(ORG_NAME).get_team_by_slug(team-awesome)
@@ -481,100 +1107,91 @@ def set_team_membership_from_yaml(gh:github.Github, gh_team:github.Team.Team, in
     team_slug = gh_team.slug
     team_struct = discover_team(gh_team) # Get current team into TeamObject structure
     current_team_membership = team_struct.get_team_structure()[team_slug]['members'] # Get the membership structure
-    for role in current_team_membership.keys(): # Check
-        for login in current_team_membership[role]:
-            if role not in input_team_membership or login not in input_team_membership[role]: # If Role empty or member does not have that role 
-                #print( f"must remove {login}")
-                if update_team_membership(gh, gh_team, login, 'del'):
-                    print (f'[CHANGED] Login: {login} removed from Team: {gh_team.slug}')
-                else:
-                    print (f'[WARNING] Something prevented removing Login: {login} from Team: {gh_team.slug}')
-    for role in input_team_membership.keys():
-        for login in input_team_membership[role]:
-            if role not in current_team_membership or login not in current_team_membership[role]: # If Role empty or member does not have that role
-                #print(f'must add {login}')
-                if update_team_membership(gh, gh_team, login, 'add', role=role):
-                    print (f'[CHANGED] Login: {login} added to Team: {gh_team.slug} with Role: {role}')
-                else:
-                    print (f'[WARNING] Something prevented adding Login: {login} to Team: {gh_team.slug} with Role: {role}')                        
-
-
-def set_org_membership_from_yaml(gh:github.Github, org:github.Organization, input_org:dict)->None:
+    diff = RoleDiff(current_team_membership, input_team_membership)
+    # The membership we just discovered is passed to update_team_membership so it only sends the changes.
+    # A login that only changes role is updated by the add below, no need to remove it first.
+    for login in sorted_logins(diff.removed):
+        #print( f"must remove {login}")
+        changed = update_team_membership(gh, gh_team, login, 'del', current_members=diff.current, journal=journal)
+        if changed:
+            print (f'[CHANGED] Login: {login} removed from Team: {gh_team.slug}')
+        elif changed is False:
+            print (f'[WARNING] Something prevented removing Login: {login} from Team: {gh_team.slug}')
+    changes = dict(diff.added, **{login: roles[1] for login, roles in diff.changed.items()})
+    for login in sorted_logins(changes):
+        role = changes[login]
+        #print(f'must add {login}')
+        changed = update_team_membership(gh, gh_team, login, 'add', role=role, current_members=diff.current, journal=journal)
+        if changed:
+            print (f'[CHANGED] Login: {login} added to Team: {gh_team.slug} with Role: {role}')
+        elif changed is False:
+            print (f'[WARNING] Something prevented adding Login: {login} to Team: {gh_team.slug} with Role: {role}')                        
+
+
+def set_org_membership_from_yaml(gh:github.Github, org:github.Organization, input_org:dict, journal = None)->None:
     '''
     Modify a Github Organizaiton membership based on dict input.
+    journal = Optional ApplyJournal every change is made through
     '''
     # Poll github and compare current membership with desired membership loaded from yaml file.
     ## Current Org Obj is what is currently configured in GitHub
     current_org_obj = discover_org(org).get_org_member_structure()[org.login]
-    current_org_members:list = current_org_obj['members']
-    current_org_collabs:list = current_org_obj['collaborators']
-    current_org_pending_invites:list = current_org_obj['pending_invites']
 
     ## Imported Org Obj is what is imported from Yaml
     imported_org_obj = input_org[org.login]
-    imported_org_members:list = imported_org_obj['members']
-    imported_org_collaborators:list = imported_org_obj['collaborators']
-
-    ## Ensure imported member is in either current members list or pending_invites.
-    for org_member in imported_org_members:
-        # If imported org member is not current a member but is already invited skip them and advise user.
-        if org_member not in current_org_members and org_member in current_org_pending_invites:
-            print(f'[UNCHANGED] Login: {org_member} has pending invite to GitHub Org: {org.login}') 
-            continue
-        # If imported org member is not yet an org member and has no pending invite, 
-        if org_member not in current_org_members and org_member not in current_org_pending_invites:
-            # invite the member to the org
-            try:
-                user_obj = gh.get_user(login=org_member) # Get the NamedUser obj
-                org.add_to_members(member=user_obj, role='member')
+
+    diff = OrgMembershipDiff(current_org_obj['members'], current_org_obj['collaborators'], current_org_obj['pending_invites'],
+                             imported_org_obj['members'], imported_org_obj['collaborators'])
+    # Users are built locally from the login. A login that does not exist fails on the change itself with UnknownObjectException.
+
+    # If imported org member is not current a member but is already invited skip them and advise user.
+    for org_member in sorted_logins(diff.pending):
+        print(f'[UNCHANGED] Login: {org_member} has pending invite to GitHub Org: {org.login}') 
+
+    ## Invite imported members who are not yet org members and have no pending invite
+    for org_member in sorted_logins(diff.invite):
+        try:
+            if journaled_change(journal, {'op': 'org_invite', 'login': org_member},
+                                lambda: org.add_to_members(member=lazy_user(gh, org_member), role='member') or True):
                 print(f'[CHANGED] Login: {org_member} was invited to GitHub Org: {org.login}')
-            except UnknownObjectException as ex:
-                print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found in GitHub')
-                continue    
-            
-
-    ## Check imported collaborators list against current org membership
-    for collab in imported_org_collaborators:
-        # if collab is in current collab list and not in org members, they're good, skip them
-        if collab in current_org_collabs and collab not in current_org_members:
-            continue
-        # if imported collaborator is currently an org member, convert to outside collaborator
-        if collab in current_org_members and collab not in imported_org_members:
-            try:
-                user_obj = gh.get_user(login=collab) # Get the NamedUser obj
-                org.convert_to_outside_collaborator(user_obj)
+        except UnknownObjectException as ex:
+            print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found in GitHub')
+            continue    
+
+    ## If imported collaborator is currently an org member, convert to outside collaborator
+    for collab in sorted_logins(diff.convert):
+        try:
+            if journaled_change(journal, {'op': 'org_convert', 'login': collab},
+                                lambda: org.convert_to_outside_collaborator(lazy_user(gh, collab)) or True):
                 print(f'[CHANGED] Login: {collab} was converted to outside collaborator for GitHub Org: {org.login}')
-            except UnknownObjectException as ex:
-                print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found')
-                continue
+        except UnknownObjectException as ex:
+            print(f'[UNCHANGED] GitHub reports the provided login: {collab} was not found')
+            continue
         # If the collab is not in the current collaborators warn the user.
         # if collab not in current_org_collabs and collab not in imported_org_members :
         #     print(f'[WARNING] Login: {collab} is listed in import data but not found in Org collaborators. Is your import data up-to-date and correct?')
 
     ## Check current org membership and remove from org those missing in the import.
-    for org_member in current_org_members:
-        # If a current org member is not in the list of imported org members, remove them from the org
-        if org_member not in imported_org_members and org_member not in imported_org_collaborators :
-            try:
-                user_obj = gh.get_user(login=org_member) # Get the NamedUser obj
-                #TESTING# org.remove_from_membership(user_obj)
-                print(f'[CHANGED] Login: {org_member} was removed from GitHub Org: {org.login}')    
-            except UnknownObjectException as ex: # Handle case where user account been deleted or is no longer an Org Member
-                # Debugging code here: This may serve as feeding a loging function later.
-                # template = "A GitHub exception of type {0} occurred. Arguments:\n{1!r}"
-                # message = template.format(type(ex).__name__, ex.args)
-                # print (message)
-                print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found in GitHub or in Org')
-                continue    
+    for org_member in sorted_logins(diff.remove):
+        try:
+            user_obj = lazy_user(gh, org_member)
+            #TESTING# org.remove_from_membership(user_obj)
+            # Not journaled while the removal itself is turned off
+            print(f'[CHANGED] Login: {org_member} was removed from GitHub Org: {org.login}')    
+        except UnknownObjectException as ex: # Handle case where user account been deleted or is no longer an Org Member
+            # Debugging code here: This may serve as feeding a loging function later.
+            # template = "A GitHub exception of type {0} occurred. Arguments:\n{1!r}"
+            # message = template.format(type(ex).__name__, ex.args)
+            # print (message)
+            print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found in GitHub or in Org')
+            continue    
     # Check current collaborators and remove those missing from import
-    for collab in current_org_collabs:
-        # remove outside collaborators no longer listed in import as org members or collabs.
-        # Removing a user from this list will remove them from all the organization's repositories.
-        if collab not in imported_org_collaborators and collab not in imported_org_members:
-            try:
-                user_obj = gh.get_user(login=collab) # Get the NamedUser obj
-                org.remove_outside_collaborator(user_obj)
-                print(f'[CHANGED] Login: {collab} was removed as Outside Collaborator from GitHub Org: {org.login}') 
-            except UnknownObjectException as ex:  
-                print(f'[UNCHANGED] GitHub reports the provided login: {org_member} was not found in GitHub')
-                continue
\ No newline at end of file
+    # Removing a user from this list will remove them from all the organization's repositories.
+    for collab in sorted_logins(diff.remove_collab):
+        try:
+            if journaled_change(journal, {'op': 'org_remove_collab', 'login': collab},
+                                lambda: org.remove_outside_collaborator(lazy_user(gh, collab)) or True):
+                print(f'[CHANGED] Login: {collab} was removed as Outside Collaborator from GitHub Org: {org.login}')
+        except UnknownObjectException as ex:  
+            print(f'[UNCHANGED] GitHub reports the provided login: {collab} was not found in GitHub')
+            continue
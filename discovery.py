@@ -2,10 +2,23 @@ import os
 import sys
 import yaml
 import argparse
+import atexit
+import json
+import functools
+import threading
+import concurrent.futures
 
 from github import Github
 from github import Auth
 from common import *
+from transport import *
+from profiler import *
+from incremental import *
+from graphql_discovery import *
+from async_discovery import *
+from snapshot_store import *
+from checkpoint import *
+from audit_log import *
 
 ACCESS_TOKEN = os.getenv("GITHUB_PRIVATE_TOKEN") # Read GitHub Personal Access Token (PAT) as an ENV Var
 '''
@@ -24,13 +37,32 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument('-r','--repo', help='Name of repository to inspect. Use "--repo all" for all repos. Warning: All crawls entire ORG tree')
 parser.add_argument('-t','--teamslug', help='Name slug of GitHub Team to inspect. Use "--team all" for all teams.')
-parser.add_argument('-o','--org', help='Name of GitHub Organization. Can be read from ENV var GITHUB_ORG_NAME')
-parser.add_argument('-f','--file', nargs='?', const='stdout.yml', help='File name to write yaml output')
+parser.add_argument('-o','--org', action='append', help='Name of GitHub Organization. Repeat or comma separate to discover several orgs in one run. Can be read from ENV var GITHUB_ORG_NAME')
+parser.add_argument('--org-file', metavar='ORG_FILE', help='File of GitHub Organization names to discover, one per line. Lines starting with # are skipped')
+parser.add_argument('--org-workers', type=int, default=4, help='Used with several orgs. Number of orgs to discover at the same time. They share one connection pool and rate limit budget. Default is 4')
+parser.add_argument('-f','--file', nargs='?', const='stdout.yml', help='File name to write output. With several orgs put {org} in the name for a file per org, otherwise all orgs go to one file')
+parser.add_argument('--format', choices=OUTPUT_FORMATS, default='yaml', help='Output format. yaml, json or ndjson (one json document per line). Default is yaml')
 parser.add_argument('-c','--contributors', action="store_true",help='Complete. \
                     Used with --repo. Check who has commited to default branch or -b to specify branch')
 parser.add_argument('-b','--branch', help='Used with --repo and --contributors. \
                     Crawl commits to discover who has commited to repo on a certain branch. Use "all" for all branches')
+parser.add_argument('--contributors-state', metavar='STATE_FILE', help='Used with --contributors and --branch. Save the branch heads scanned in STATE_FILE so the next run only scans new commits. Authors found by earlier runs are kept, even if their commits are no longer on any branch')
 parser.add_argument('-m','--members', action="store_true",help='output list of Organization Members. Only org members can belong to a team')
+parser.add_argument('-v','--verbose', action="store_true", help='Print discovery stats such as API calls saved per repo to stderr')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory for the HTTP response cache. Unchanged responses are served from here with conditional requests. Can be read from ENV var GITHUB_CACHE_DIR')
+parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, help=f'Max size of the HTTP response cache in MB. Default is {DEFAULT_CACHE_SIZE_MB}')
+parser.add_argument('--no-cache', action="store_true", help='Do not use the HTTP response cache')
+parser.add_argument('--profile', nargs='?', const='stderr', metavar='PROFILE_FILE', help='Count API calls, bytes, latency and rate limit cost per endpoint and calling function. Prints a summary to stderr on exit, or saves it as json to PROFILE_FILE')
+parser.add_argument('--backend', choices=['rest', 'graphql'], default='rest', help='API used for discovery. graphql fetches repos, teams and members in large batches. Default is rest')
+parser.add_argument('--graphql-url', default=os.getenv("GITHUB_GRAPHQL_URL", GRAPHQL_URL), help='GraphQL endpoint used with "--backend graphql". Can be read from ENV var GITHUB_GRAPHQL_URL')
+parser.add_argument('-i','--incremental', metavar='STATE_FILE', help='Used with "--repo all". Only discover repos changed since the last run and reuse the rest from STATE_FILE. The file is created on the first run. With several orgs STATE_FILE must contain {org}')
+parser.add_argument('--db', nargs='?', const=DEFAULT_DB_FILE, metavar='DB_FILE', help=f'Also save the output to a SQLite snapshot database for query.py. Default file is {DEFAULT_DB_FILE}. With several orgs DB_FILE must contain {{org}}')
+parser.add_argument('--engine', choices=['sync', 'async'], default='sync', help='Used with "--backend rest". async discovers many repos and teams at once on one thread with asyncio. Default is sync')
+parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f'Used with "--engine async". Max API requests in flight. Default is {DEFAULT_CONCURRENCY}')
+parser.add_argument('--journal', nargs='?', const=DEFAULT_JOURNAL_FILE, metavar='JOURNAL_FILE', help=f'Journal every discovered repo, team and org so a failed run can be carried on with --resume. Removed when the run completes. Default file is {DEFAULT_JOURNAL_FILE}')
+parser.add_argument('--resume', action="store_true", help='Carry on from the journal of a failed run. Journaled repos, teams and orgs are output again from the journal and only the rest are discovered. Implies --journal')
+parser.add_argument('--audit-log', nargs='?', const=DEFAULT_AUDIT_CURSOR_FILE, metavar='CURSOR_FILE', help=f'Used with --db. Discover again only the teams, repos and org membership the org audit log says changed since the last run, and patch the snapshot with them. Where the audit log was read to is saved in CURSOR_FILE. Needs the read:audit_log scope and GitHub Enterprise Cloud. Default file is {DEFAULT_AUDIT_CURSOR_FILE}. With several orgs CURSOR_FILE must contain {{org}}')
+parser.add_argument('-w','--workers', type=int, default=1, help='Used with "--repo all". Number of repos to discover at the same time. Default is 1')
 args = parser.parse_args()
 
 ### Setup Vars from Args
@@ -39,91 +71,376 @@ team_slug = args.teamslug
 discover_contributors = args.contributors
 discover_members = args.members
 branch = args.branch
-print_yaml_doc = False # Default option is print to stdout only.  --file will allow write to file.
+workers = args.workers
+verbose = args.verbose
+backend = args.backend
+engine = args.engine
+output_file = args.file # Default option is print to stdout only.  --file will also write to file. Default file is stdout.yml
 
-if args.file: # We have set file output to true with --file
-    print_yaml_doc = True
-    output_file = args.file
-
-if args.org: # --org ORG_NAME was set on cli
-    ORG_NAME =  args.org
-else: 
-    ORG_NAME = os.getenv("GITHUB_ORG_NAME") # Read GitHub Org Name ENV Var GITHUB_ORG_NAME
+org_names = []
+if args.org: # --org ORG_NAME was set on cli. Can be repeated or comma separated
+    org_names = args.org
+elif not args.org_file:
+    org_names = [os.getenv("GITHUB_ORG_NAME") or ''] # Read GitHub Org Name ENV Var GITHUB_ORG_NAME
+if args.org_file: # --org-file ORG_FILE One org per line
+    if not os.path.exists(args.org_file):
+        print(f"Exiting: Org file {args.org_file} not found")
+        exit()
+    with open(args.org_file, 'r') as f:
+        org_names = org_names + [line for line in f if not line.strip().startswith('#')]
+# Duplicates are dropped, keeping the order the orgs were given in
+ORG_NAMES = list(dict.fromkeys(name.strip() for names in org_names for name in names.split(',') if name.strip()))
+multi_org = len(ORG_NAMES) > 1
+per_org_files = bool(output_file) and '{org}' in output_file
 
 if not ACCESS_TOKEN: # Exit if no token set
     print("Exiting: GITHUB_PRIVATE_TOKEN empty or not defined. Set as ENV var GITHUB_PRIVATE_TOKEN")
     exit()
 
-if not ORG_NAME: # Assert ORG_NAME is set
+if not ORG_NAMES: # Assert at least one org is set
     print("Exiting: GitHub Orgnaization Name not set. Set as ENV var GITHUB_ORG_NAME or use arg --org <GH-ORG-NAME>")
     exit()
+
+if backend == 'graphql' and discover_contributors:
+    print("Exiting: --contributors is not supported with --backend graphql")
+    exit()
+
+if args.incremental and backend == 'graphql':
+    print("Exiting: --incremental is not supported with --backend graphql")
+    exit()
+
+if engine == 'async' and backend == 'graphql':
+    print("Exiting: --engine async is not supported with --backend graphql")
+    exit()
+
+if engine == 'async' and args.incremental:
+    print("Exiting: --incremental is not supported with --engine async")
+    exit()
+
+if args.concurrency < 1:
+    print("Exiting: --concurrency must be 1 or more")
+    exit()
+
+if workers < 1 or args.org_workers < 1:
+    print("Exiting: --workers and --org-workers must be 1 or more")
+    exit()
+
+# Orgs must not overwrite each others repo state or snapshots
+if multi_org and args.incremental and '{org}' not in args.incremental:
+    print("Exiting: --incremental STATE_FILE must contain {org} when discovering several orgs, ie. --incremental state-{org}.json")
+    exit()
+
+if multi_org and args.db and '{org}' not in args.db:
+    print("Exiting: --db DB_FILE must contain {org} when discovering several orgs, ie. --db snapshots-{org}.db")
+    exit()
+
+if args.audit_log and not args.db:
+    print("Exiting: --audit-log patches a snapshot database. Use it with --db after a full discovery with --db")
+    exit()
+
+if args.audit_log and (repo_name or team_slug or discover_members):
+    print("Exiting: --audit-log works out what to discover from the audit log. Don't use it with --repo, --teamslug or --members")
+    exit()
+
+if args.audit_log and (backend == 'graphql' or engine == 'async' or args.incremental or args.journal or args.resume):
+    print("Exiting: --audit-log is not supported with --backend graphql, --engine async, --incremental or --journal")
+    exit()
+
+if multi_org and args.audit_log and '{org}' not in args.audit_log:
+    print("Exiting: --audit-log CURSOR_FILE must contain {org} when discovering several orgs, ie. --audit-log audit-{org}.json")
+    exit()
+
+journal = None
+if args.journal or args.resume: # --journal Checkpoint each discovered entity. --resume Carry on from the last one
+    journal_file = args.journal or DEFAULT_JOURNAL_FILE
+    # Resuming only makes sense for a run that discovers the same things
+    journal_options = {'repo': repo_name, 'teamslug': team_slug, 'members': discover_members,
+                       'contributors': discover_contributors, 'branch': branch, 'backend': backend}
+    try:
+        journal = CheckpointJournal(journal_file, journal_options, resume=args.resume)
+    except JournalError as err:
+        print(f"Exiting: Can not resume. {err}")
+        exit()
+    if args.resume:
+        print(f'[INFO] Resuming from {journal_file}: {len(journal.entities)} repos, teams and orgs already discovered', file=sys.stderr)
 ### End Var setup
 
 # Set GitHub access token
 auth = Auth.Token(ACCESS_TOKEN)
 
-# Create GitHub Instance with Auth Token
-gh = Github(auth=auth)
-# Set github pagination setting.
-gh.per_page = 100 # Default is 30 results per page. 100 Saves API calls by about a 2/3 (in testing 316 vs 120)
+# Send every request through the shared transport. It paces requests against the rate limit for all workers
+# and serves unchanged responses from the cache as 304s
+scheduler = RateLimitScheduler()
+cache = None if args.no_cache else ResponseCache(args.cache_dir, args.cache_size * 1024 * 1024)
+profiler = None
+if args.profile:
+    profiler = ApiProfiler()
+    # Registered with atexit so the profile is still reported when the run exits early or is interrupted
+    atexit.register(lambda: profiler.report() if args.profile == 'stderr' else profiler.save(args.profile))
+transport = Transport(cache=cache, scheduler=scheduler, profiler=profiler)
+transport.install()
+
+def new_github_client()-> Github:
+    '''
+    Create GitHub Instance with Auth Token.
+    Used for the client of each org and for each worker thread when --workers is set.
+    '''
+    # The scheduler paces requests for all clients so PyGithub's fixed per client delay is turned off.
+    # Every client shares the transport's connection pool, sized here for all org and repo workers at once
+    client = Github(auth=auth, seconds_between_requests=None, seconds_between_writes=None,
+                    pool_size=max(min(args.org_workers, len(ORG_NAMES)) * workers, 10))
+    # Set github pagination setting.
+    client.per_page = 100 # Default is 30 results per page. 100 Saves API calls by about a 2/3 (in testing 316 vs 120)
+    return client
+
+contributor_watermarks = None # Keyed by repo full name so one file serves every org
+if args.contributors_state:
+    contributor_watermarks = {}
+    if os.path.exists(args.contributors_state):
+        with open(args.contributors_state, 'r') as f:
+            contributor_watermarks = json.load(f)
+
+if backend == 'graphql':
+    graphql_client = GraphQLClient(ACCESS_TOKEN, url=args.graphql_url, scheduler=scheduler, profiler=profiler)
+
+if engine == 'async':
+    # One event loop thread and one client for every org, so all orgs share the connection pool and --concurrency
+    async_loop = start_event_loop()
+    async_client = AsyncGitHubClient(ACCESS_TOKEN, concurrency=args.concurrency, scheduler=scheduler, profiler=profiler, cache=cache)
+
+
+def report_repo_stats(this_repo:RepoObject)-> None:
+    if verbose: # stderr so the yaml on stdout stays valid
+        print(f'[INFO] Repo: {this_repo.name} API calls saved: {this_repo.api_calls_saved}', file=sys.stderr)
+
+
 #rate = gh.get_rate_limit()
 
 # Start Output gathering.
-if print_yaml_doc: # If we are dumping to a file prepend with the yaml doc string ---
-    file_output = "---\n"
-    print(file_output, end='')
-
-if repo_name and repo_name == 'all': # arg --repo all
-    for repo in gh.get_organization(ORG_NAME).get_repos(type='all', sort='pushed'):
-        this_repo = discover_repository(repo, discover_contributors)
-        repo_as_yaml = this_repo.get_repo_as_yaml()
-        if print_yaml_doc:
-            file_output += repo_as_yaml           
-        print(this_repo.get_repo_as_yaml(), end='') # end = '' because Yaml linters get fussy about newlines. 
-        # They want a file to end with exactly 1 and the yaml.dump already has one
-elif repo_name: # arg --repo RepoName
-    repo = gh.get_organization(ORG_NAME).get_repo(name=repo_name)
-    if repo:
-        this_repo = discover_repository(repo, discover_contributors, branch)
-        repo_as_yaml = this_repo.get_repo_as_yaml()
-        if print_yaml_doc:
-            file_output += repo_as_yaml                
-        print(repo_as_yaml, end='')
-
-if team_slug and team_slug == 'all': # arg --team all
-    for team in gh.get_organization(ORG_NAME).get_teams():
-        this_team = discover_team(team)
-        team_as_yaml = this_team.get_team_as_yaml()
-        if print_yaml_doc:
-            file_output += team_as_yaml
-        print(team_as_yaml, end='')
-
-elif team_slug: # arg --team teamslug
-    team = gh.get_organization(ORG_NAME).get_team_by_slug(slug=team_slug)
-    if team:
-        this_team = discover_team(team)
-        team_as_yaml = this_team.get_team_as_yaml()
-        if print_yaml_doc:
-            file_output += team_as_yaml
-        print(team_as_yaml, end='')
-
-if discover_members: # arg -m was called. Get Og Membership Structure.
-    org = gh.get_organization(ORG_NAME)
-    if org:
-        this_org = discover_org(org)
-        org_yaml = this_org.get_org_members_as_yaml()
-        if print_yaml_doc:
-            file_output += org_yaml
-        print(org_yaml, end='')
-        
-
-if print_yaml_doc:
-    f = open(output_file, "a") # default file is stdout.yml. Override with --file
-    f.write(file_output)
-    f.close()
+# Each document is written to stdout and the file as soon as it is discovered so a failed run still leaves usable output.
+# With several orgs each document is written whole under the lock, and documents from different orgs interleave
+writer = OutputWriter(None if per_org_files else output_file, args.format)
+writer_lock = threading.Lock()
+
+
+def discover_org_tree(org_name:str)-> int:
+    '''
+    Discover the repos, teams and members of one org as set on the command line and output them.
+    Runs on a thread of its own for each org when several orgs are given.
+    Returns the number of repos and teams that failed.
+    ---
+    org_name:str = GitHub Organization login
+    '''
+    gh = new_github_client()
+    repo_errors = 0
+    team_errors = 0
+
+    repo_discovery = discover_repository
+    if contributor_watermarks is not None:
+        repo_discovery = functools.partial(discover_repository, contributor_watermarks=contributor_watermarks)
+
+    incremental_state = None
+    if args.incremental:
+        incremental_state = IncrementalState(args.incremental.replace('{org}', org_name), discover=repo_discovery)
+        repo_discovery = incremental_state.discover
+
+    if backend == 'graphql':
+        graphql = GraphQLDiscovery(graphql_client, org_name)
+
+    if engine == 'async':
+        async_engine = AsyncDiscoveryEngine(async_client, org_name, async_loop)
+
+    org_writer = None
+    if per_org_files: # --file name-{org}.yml One file per org
+        org_writer = OutputWriter(output_file.replace('{org}', org_name), args.format, stdout=None)
+    store = None
+    if args.db: # --db Save a snapshot of this run for query.py
+        store = SnapshotStore(args.db.replace('{org}', org_name))
+        store.begin_snapshot(org_name)
+
+    def output(structure:dict, journaled:bool = False)-> None:
+        with writer_lock:
+            if multi_org: # Say which org each document of the combined output came from
+                writer.write({name: dict(data, org=org_name) for name, data in structure.items()})
+            else:
+                writer.write(structure)
+        if org_writer:
+            org_writer.write(structure)
+        if store:
+            store.add(structure)
+        if journal and not journaled:
+            journal.add(org_name, structure)
+
+    done_repos = done_teams = done_orgs = set()
+    repo_cursor = team_cursor = None
+    if journal: # --resume Output what the failed run discovered again, then discover only the rest
+        for structure in journal.structures(org_name):
+            output(structure, journaled=True)
+        done_repos = journal.names(org_name, 'repo')
+        done_teams = journal.names(org_name, 'team')
+        done_orgs = journal.names(org_name, 'org')
+        # GraphQL listings carry on after the last page that was done. REST listings are read again,
+        # which costs little as unchanged pages are 304s from the cache, and journaled names are skipped
+        repo_cursor = functools.partial(journal.add_cursor, org_name, 'repositories')
+        team_cursor = functools.partial(journal.add_cursor, org_name, 'teams')
+
+    if args.audit_log: # arg --audit-log Discover again only what changed since the last run
+        cursor = AuditLogCursor(args.audit_log.replace('{org}', org_name), org_name)
+        start = audit_log_start(store.snapshots(), org_name)
+        if not cursor.created and not start:
+            print(f'[WARNING] No full snapshot of Org: {org_name} to patch. Run discovery.py -r all -t all -m --db first', file=sys.stderr)
+            repo_errors += 1
+        else:
+            cursor.start(start)
+            audit_errors = sync_from_audit_log(gh, org_name, store, cursor, output, discover_contributors, branch, repo_discovery)
+            if not audit_errors: # Otherwise the next run reads the same events and tries the failed ones again
+                cursor.save()
+            repo_errors += audit_errors
+
+    if repo_name and repo_name == 'all' and backend == 'graphql': # arg --repo all --backend graphql
+        after = journal.cursor(org_name, 'repositories') if journal else None
+        for this_repo in graphql.discover_repositories(after, repo_cursor, done_repos):
+            output(this_repo.get_repo_structure())
+    elif repo_name and backend == 'graphql': # arg --repo RepoName --backend graphql
+        this_repo = None if repo_name in done_repos else graphql.discover_repository(repo_name)
+        if this_repo:
+            output(this_repo.get_repo_structure())
+    elif repo_name and repo_name == 'all' and engine == 'async': # arg --repo all --engine async
+        for name, this_repo, err in async_engine.discover_repositories(discover_contributors, branch, contributor_watermarks, done_repos):
+            if err:
+                print(f'[WARNING] Discovery failed for Repo: {name} - {type(err).__name__}: {err}', file=sys.stderr)
+                repo_errors += 1
+                continue
+            report_repo_stats(this_repo)
+            output(this_repo.get_repo_structure())
+    elif repo_name and engine == 'async': # arg --repo RepoName --engine async
+        this_repo = None if repo_name in done_repos else async_engine.discover_repository(repo_name, discover_contributors, branch, contributor_watermarks)
+        if this_repo:
+            report_repo_stats(this_repo)
+            output(this_repo.get_repo_structure())
+    elif repo_name and repo_name == 'all' and workers > 1: # arg --repo all --workers N
+        repos = (repo for repo in gh.get_organization(org_name).get_repos(type='all', sort='pushed') if repo.name not in done_repos)
+        for name, this_repo, err in discover_repositories(repos, new_github_client, workers, discover_contributors, branch, discover=repo_discovery):
+            if err:
+                print(f'[WARNING] Discovery failed for Repo: {name} - {type(err).__name__}: {err}', file=sys.stderr)
+                repo_errors += 1
+                continue
+            report_repo_stats(this_repo)
+            output(this_repo.get_repo_structure())
+    elif repo_name and repo_name == 'all': # arg --repo all
+        for repo in gh.get_organization(org_name).get_repos(type='all', sort='pushed'):
+            if repo.name in done_repos:
+                continue
+            this_repo = repo_discovery(repo, discover_contributors, branch)
+            report_repo_stats(this_repo)
+            output(this_repo.get_repo_structure())
+    elif repo_name and repo_name not in done_repos: # arg --repo RepoName
+        repo = gh.get_organization(org_name).get_repo(name=repo_name)
+        if repo:
+            this_repo = repo_discovery(repo, discover_contributors, branch)
+            report_repo_stats(this_repo)
+            output(this_repo.get_repo_structure())
+
+    if incremental_state and repo_name == 'all':
+        incremental_state.keep(done_repos) # Output from the journal. Without this the next run discovers them all again.
+        incremental_state.save()
+        if verbose:
+            print(f'[INFO] Incremental discovery of Org: {org_name} Repos discovered: {incremental_state.discovered} Repos reused: {incremental_state.reused}', file=sys.stderr)
+
+    if team_slug and team_slug == 'all' and backend == 'graphql': # arg --team all --backend graphql
+        after = journal.cursor(org_name, 'teams') if journal else None
+        for this_team in graphql.discover_teams(after, team_cursor, done_teams):
+            output(this_team.get_team_structure())
+
+    elif team_slug and backend == 'graphql': # arg --team teamslug --backend graphql
+        this_team = None if team_slug in done_teams else graphql.discover_team(team_slug)
+        if this_team:
+            output(this_team.get_team_structure())
+
+    elif team_slug and team_slug == 'all' and engine == 'async': # arg --team all --engine async
+        for slug, this_team, err in async_engine.discover_teams(done_teams):
+            if err:
+                print(f'[WARNING] Discovery failed for Team: {slug} - {type(err).__name__}: {err}', file=sys.stderr)
+                team_errors += 1
+                continue
+            output(this_team.get_team_structure())
+
+    elif team_slug and engine == 'async': # arg --team teamslug --engine async
+        this_team = None if team_slug in done_teams else async_engine.discover_team(team_slug)
+        if this_team:
+            output(this_team.get_team_structure())
+
+    elif team_slug and team_slug == 'all': # arg --team all
+        for team in gh.get_organization(org_name).get_teams():
+            if team.slug in done_teams:
+                continue
+            this_team = discover_team(team)
+            output(this_team.get_team_structure())
+
+    elif team_slug and team_slug not in done_teams: # arg --team teamslug
+        team = gh.get_organization(org_name).get_team_by_slug(slug=team_slug)
+        if team:
+            this_team = discover_team(team)
+            output(this_team.get_team_structure())
+
+    if discover_members and not done_orgs: # arg -m was called. Get Og Membership Structure.
+        org = gh.get_organization(org_name)
+        if engine == 'async':
+            this_org = async_engine.discover_org()
+            output(this_org.get_org_member_structure())
+        elif org and backend == 'graphql':
+            # Outside collaborators and invitations are only available from REST
+            this_org = graphql.discover_org(outside_collaborators=[collab.login for collab in org.get_outside_collaborators()],
+                                            invitations=[invited.login for invited in org.invitations()])
+            output(this_org.get_org_member_structure())
+        elif org:
+            this_org = discover_org(org)
+            output(this_org.get_org_member_structure())
+
+    if org_writer:
+        org_writer.close()
+    if store: # A complete crawl of all repos or teams replaces earlier snapshots in queries
+        store.finish_snapshot(all_repos=repo_name == 'all' and not repo_errors, all_teams=team_slug == 'all' and not team_errors)
+        store.close()
+    if engine == 'async':
+        async_engine.close()
+    gh.close()
+    return repo_errors + team_errors
+
+
+errors = 0 # Failed repos, teams and orgs
+if not multi_org:
+    errors = discover_org_tree(ORG_NAMES[0])
+else: # --org a --org b Discover several orgs at once. One failed org does not stop the others
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.org_workers) as executor:
+        futures = {executor.submit(discover_org_tree, org_name): org_name for org_name in ORG_NAMES}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                errors += future.result()
+            except Exception as err:
+                print(f'[WARNING] Discovery failed for Org: {futures[future]} - {type(err).__name__}: {err}', file=sys.stderr)
+                errors += 1
+
+if contributor_watermarks is not None and (repo_name or args.audit_log):
+    with open(args.contributors_state, 'w') as f:
+        json.dump(contributor_watermarks, f)
+
+writer.close()
+if journal and errors: # Failed repos and teams were not journaled so --resume tries them again
+    journal.close()
+    print(f'[INFO] {errors} failed. Journal kept in {journal_file}. Run again with --resume to discover the rest', file=sys.stderr)
+elif journal:
+    journal.finish()
 
 # rate = gh.get_rate_limit()
 # print(rate)
 
 # To close connections after use
-gh.close()
\ No newline at end of file
+if backend == 'graphql':
+    graphql_client.close()
+if engine == 'async':
+    stop_event_loop(async_loop, async_client)
+transport.close()
+
+if errors: # So cron jobs and scripts can tell a partial crawl from a complete one
+    sys.exit(1)
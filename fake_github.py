@@ -0,0 +1,666 @@
+import os
+import re
+import sys
+import json
+import time
+import calendar
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_PORT = 8765
+DEFAULT_RATE_LIMIT = 100000 # Higher than GitHub's 5000 so big benchmarks aren't paced. Use --rate-limit 5000 to test pacing.
+MAX_PAGE_SIZE = 100
+DEFAULT_PAGE_SIZE = 30
+REPO_PERMISSIONS = ['pull', 'triage', 'push', 'maintain', 'admin']
+REPO_ROLE_NAMES = {'pull': 'read', 'triage': 'triage', 'push': 'write', 'maintain': 'maintain', 'admin': 'admin'}
+GRAPHQL_PERMISSIONS = {'pull': 'READ', 'triage': 'TRIAGE', 'push': 'WRITE', 'maintain': 'MAINTAIN', 'admin': 'ADMIN'}
+
+
+def sha(*parts)-> str:
+    return hashlib.sha1('/'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+class SyntheticOrg:
+    '''
+    A made up GitHub org for the fake API. The same arguments always make the same org.
+    Team members, collaborators, team grants and commit authors are picked at random from the org members.
+    ---
+    name:str = Org login
+    repos, teams, members, collaborators:int = How many of each to make
+    branches:int = Branches per repo besides main
+    commits:int = Commits on main per repo. Each other branch adds a few commits on top of a random commit of main.
+    audit_events:int = Team, repo and org membership events already in the audit log. Changes made through the API add more.
+    seed:int = Random seed
+    '''
+    def __init__(self, name:str = 'fake-org', repos:int = 50, teams:int = 10, members:int = 100, collaborators:int = 10,
+                 branches:int = 2, commits:int = 20, audit_events:int = 10, seed:int = 1) -> None:
+        rand = random.Random(seed)
+        self.name = name
+        self.members = {f'member-{i}' for i in range(members)}
+        self.collaborators = {f'collab-{i}' for i in range(collaborators)}
+        self.invitations = {f'invitee-{i}' for i in range(max(1, members // 50))}
+        member_list = sorted(self.members)
+        collab_list = sorted(self.collaborators)
+
+        self.teams = {}
+        for i in range(teams):
+            slug = f'team-{i}'
+            # Roughly a third of teams are nested under an earlier team
+            parent = f'team-{rand.randrange(i)}' if i > 0 and rand.random() < 0.3 else None
+            team_members = rand.sample(member_list, min(len(member_list), rand.randint(1, 25)))
+            self.teams[slug] = {
+                'id': 1000 + i,
+                'name': f'Team {i}',
+                'description': f'Synthetic team {i}',
+                'parent': parent,
+                'members': {login: 'maintainer' if n == 0 else 'member' for n, login in enumerate(team_members)},
+            }
+
+        self.repos = {}
+        team_slugs = sorted(self.teams)
+        for i in range(repos):
+            name = f'repo-{i}'
+            collabs = {login: rand.choice(REPO_PERMISSIONS) for login in rand.sample(member_list, min(len(member_list), rand.randint(0, 8)))}
+            outside = {login: rand.choice(REPO_PERMISSIONS) for login in rand.sample(collab_list, min(len(collab_list), rand.randint(0, 2)))}
+            collabs.update(outside)
+            repo_teams = {slug: rand.choice(REPO_PERMISSIONS) for slug in rand.sample(team_slugs, min(len(team_slugs), rand.randint(0, 4)))}
+            # Commit history. Each commit is sha -> (author login or None, parent sha)
+            history = {}
+            heads = {}
+            parent = None
+            main = []
+            for n in range(commits):
+                commit = sha(name, 'main', n)
+                author = rand.choice(member_list) if member_list and rand.random() > 0.05 else None # Some commits have no linked account
+                history[commit] = (author, parent)
+                main.append(commit)
+                parent = commit
+            heads['main'] = parent
+            for b in range(branches):
+                parent = rand.choice(main) if main else None
+                for n in range(rand.randint(1, 5)):
+                    commit = sha(name, f'branch-{b}', n)
+                    history[commit] = (rand.choice(member_list) if member_list else None, parent)
+                    parent = commit
+                heads[f'branch-{b}'] = parent
+            self.repos[name] = {
+                'id': 100000 + i,
+                'collaborators': collabs,
+                'outside': set(outside),
+                'teams': repo_teams,
+                'history': history,
+                'heads': heads,
+                'pushed_at': f'2024-01-{1 + i % 28:02d}T00:00:00Z',
+            }
+
+        # Drawn last so the rest of the org is the same whatever the number of events
+        self.audit_log = []
+        repo_names = sorted(self.repos)
+        for i in range(audit_events):
+            timestamp = 1706745600000 + i * 1000 # From 2024-02-01
+            if i % 3 == 0 and team_slugs and member_list:
+                self.audit('team.add_member', timestamp, team=f'{name}/{rand.choice(team_slugs)}', user=rand.choice(member_list))
+            elif i % 3 == 1 and repo_names and member_list:
+                self.audit('repo.add_member', timestamp, repo=f'{name}/{rand.choice(repo_names)}', user=rand.choice(member_list))
+            elif member_list:
+                self.audit('org.add_member', timestamp, user=rand.choice(member_list))
+
+    def audit(self, action:str, timestamp:int = None, **fields)-> None:
+        ''' Add an event to the audit log. timestamp is in milliseconds and defaults to now. '''
+        timestamp = timestamp or int(time.time() * 1000)
+        self.audit_log.append(dict(fields, action=action, actor='fake-admin', org=self.name, created_at=timestamp,
+                                   **{'@timestamp': timestamp, '_document_id': sha(self.name, 'audit', len(self.audit_log))}))
+
+    def commits_from(self, repo:str, head:str)-> list:
+        ''' Commit shas from head back to the first commit '''
+        history = self.repos[repo]['history']
+        commits = []
+        while head:
+            commits.append(head)
+            head = history[head][1]
+        return commits
+
+
+class FakeGitHubState:
+    '''
+    Org data, rate limit and request counters of a running fake API. Shared by the handler threads.
+    graphql_page_size caps the page size of every GraphQL connection, so small orgs can be used to test pagination.
+    '''
+    def __init__(self, org_args:dict, rate_limit:int = DEFAULT_RATE_LIMIT, latency:float = 0.0, graphql_page_size:int = MAX_PAGE_SIZE) -> None:
+        self.org_args = org_args
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.graphql_page_size = graphql_page_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **org_args)-> None:
+        ''' Make the org again from its arguments, refill the rate limit and zero the counters '''
+        with self.lock:
+            self.org_args.update(org_args)
+            self.org = SyntheticOrg(**self.org_args)
+            self.remaining = self.rate_limit
+            self.reset_at = int(time.time()) + 3600
+            self.requests = 0
+            self.not_modified = 0
+            self.rate_limited = 0
+            self.routes = Counter()
+
+    def stats(self)-> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'not_modified': self.not_modified,
+                'rate_limited': self.rate_limited,
+                'rate_limit_remaining': self.remaining,
+                'routes': dict(self.routes),
+            }
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    '''
+    Answers the GitHub REST calls made by discovery.py and modify.py from a SyntheticOrg.
+    Pages listings with per_page/page and Link headers, sends X-RateLimit-* headers and ETags,
+    answers If-None-Match with 304 Not Modified without using up the rate limit, and fails with 403 once it runs out.
+    POST /graphql answers the queries of graphql_discovery.py. Queries are told apart by their operation name,
+    not parsed, so any other query gets an error.
+    '''
+    protocol_version = 'HTTP/1.1' # Keep alive, like api.github.com
+    disable_nagle_algorithm = True # Otherwise small responses on a kept alive connection wait for delayed ACKs
+    state: FakeGitHubState = None
+
+    ROUTES = []
+
+    def log_message(self, format, *args):
+        pass
+
+    ### Plumbing
+
+    @property
+    def base(self)-> str:
+        return f'http://{self.headers["Host"]}'
+
+    def body(self)-> dict:
+        return self.request_body
+
+    def send(self, status:int, payload=None, headers:dict = None)-> None:
+        data = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def rate_limit_headers(self, resource:str = 'core')-> dict:
+        state = self.state
+        return {
+            'X-RateLimit-Limit': str(state.rate_limit),
+            'X-RateLimit-Remaining': str(max(state.remaining, 0)),
+            'X-RateLimit-Reset': str(state.reset_at),
+            'X-RateLimit-Used': str(state.rate_limit - max(state.remaining, 0)),
+            'X-RateLimit-Resource': resource,
+        }
+
+    def handle_verb(self, verb:str)-> None:
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        # Always read the body so it isn't left on a kept alive connection
+        length = int(self.headers.get('Content-Length') or 0)
+        self.request_body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        if url.path == '/_stats':
+            return self.send(200, self.state.stats())
+        if url.path == '/_reset':
+            self.state.reset(**self.body())
+            return self.send(200, self.state.stats())
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        for route_verb, path, pattern, method in self.ROUTES:
+            match = pattern.fullmatch(url.path)
+            if match and route_verb == verb:
+                break
+        else:
+            return self.respond(verb, f'{verb} unknown', 404, {'message': 'Not Found'}, query)
+        with self.state.lock:
+            result = method(self, query, *match.groups())
+        status, payload, headers = result if len(result) == 3 else (*result, {})
+        self.respond(verb, f'{verb} {path}', status, payload, query, headers)
+
+    def respond(self, verb:str, route:str, status:int, payload, query:dict, headers:dict = None)-> None:
+        headers = dict(headers or {})
+        state = self.state
+        with state.lock:
+            state.requests += 1
+            state.routes[route] += 1
+            etag = f'W/"{sha(json.dumps(payload, sort_keys=True))}"' if verb == 'GET' and status == 200 else None
+            if etag and self.headers.get('If-None-Match') == etag:
+                state.not_modified += 1 # GitHub doesn't count 304s against the rate limit
+                status, payload = 304, None
+            elif state.remaining <= 0:
+                state.rate_limited += 1
+                status, payload = 403, {'message': 'API rate limit exceeded for user.', 'documentation_url': 'https://docs.github.com/rest/overview/rate-limits-for-the-rest-api'}
+                etag = None
+            else:
+                state.remaining -= 1
+            headers.update(self.rate_limit_headers('graphql' if route == 'POST /graphql' else 'core'))
+        if etag:
+            headers['ETag'] = etag
+        self.send(status, payload, headers)
+
+    def do_GET(self):
+        self.handle_verb('GET')
+
+    def do_POST(self):
+        self.handle_verb('POST')
+
+    def do_PUT(self):
+        self.handle_verb('PUT')
+
+    def do_PATCH(self):
+        self.handle_verb('PATCH')
+
+    def do_DELETE(self):
+        self.handle_verb('DELETE')
+
+    def page(self, items:list, query:dict):
+        ''' One page of a listing with the Link header GitHub sends '''
+        per_page = min(int(query.get('per_page', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = max(int(query.get('page', 1)), 1)
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        links = []
+        path = urlparse(self.path).path
+        def link(number, rel):
+            return f'<{self.base}{path}?{urlencode(dict(query, page=number, per_page=per_page))}>; rel="{rel}"'
+        if page < last:
+            links += [link(page + 1, 'next'), link(last, 'last')]
+        if page > 1:
+            links += [link(1, 'first'), link(page - 1, 'prev')]
+        headers = {'Link': ', '.join(links)} if links else {}
+        return 200, items[(page - 1) * per_page: page * per_page], headers
+
+    ### Payloads
+
+    def user(self, login:str)-> dict:
+        return {'login': login, 'id': int(sha(login)[:8], 16), 'type': 'User', 'url': f'{self.base}/users/{login}', 'html_url': f'https://github.com/{login}'}
+
+    def org_json(self)-> dict:
+        org = self.state.org
+        return {'login': org.name, 'id': 1, 'name': org.name, 'description': 'Synthetic org', 'url': f'{self.base}/orgs/{org.name}'}
+
+    def team_json(self, slug:str, permission:str = None)-> dict:
+        team = self.state.org.teams[slug]
+        data = {
+            'id': team['id'], 'slug': slug, 'name': team['name'], 'description': team['description'], 'privacy': 'closed',
+            'url': f'{self.base}/organizations/1/team/{team["id"]}', 'html_url': f'https://github.com/orgs/{self.state.org.name}/teams/{slug}',
+            'parent': self.team_json(team['parent']) if team['parent'] else None,
+        }
+        if permission:
+            data['permission'] = permission
+        return data
+
+    def repo_json(self, name:str)-> dict:
+        org = self.state.org
+        repo = org.repos[name]
+        return {
+            'id': repo['id'], 'name': name, 'full_name': f'{org.name}/{name}', 'private': True,
+            'owner': {'login': org.name, 'id': 1, 'type': 'Organization', 'url': f'{self.base}/orgs/{org.name}'},
+            'url': f'{self.base}/repos/{org.name}/{name}', 'html_url': f'https://github.com/{org.name}/{name}',
+            'default_branch': 'main', 'pushed_at': repo['pushed_at'], 'updated_at': repo['pushed_at'],
+        }
+
+    def collaborator_json(self, login:str, permission:str)-> dict:
+        rank = REPO_PERMISSIONS.index(permission)
+        return dict(self.user(login), role_name=REPO_ROLE_NAMES[permission],
+                    permissions={name: REPO_PERMISSIONS.index(name) <= rank for name in REPO_PERMISSIONS})
+
+    def commit_json(self, repo:str, commit:str)-> dict:
+        author, parent = self.state.org.repos[repo]['history'][commit]
+        return {'sha': commit, 'url': f'{self.base}/repos/{self.state.org.name}/{repo}/commits/{commit}',
+                'author': self.user(author) if author else None,
+                'commit': {'message': f'Commit {commit[:7]}'},
+                'parents': [{'sha': parent}] if parent else []}
+
+    def team_by_id(self, team_id:str)-> str:
+        for slug, team in self.state.org.teams.items():
+            if team['id'] == int(team_id):
+                return slug
+        return None
+
+    ### Org
+
+    def get_org(self, query, org):
+        return (200, self.org_json()) if org == self.state.org.name else (404, {'message': 'Not Found'})
+
+    def get_org_members(self, query, org):
+        return self.page([self.user(login) for login in sorted(self.state.org.members)], query)
+
+    def get_outside_collaborators(self, query, org):
+        return self.page([self.user(login) for login in sorted(self.state.org.collaborators)], query)
+
+    def get_invitations(self, query, org):
+        return self.page([dict(self.user(login), role='direct_member') for login in sorted(self.state.org.invitations)], query)
+
+    def get_audit_log(self, query, org):
+        ''' Only the created:>= qualifier of the search phrase is supported '''
+        created = re.search(r'created:>=(\S+)', query.get('phrase', ''))
+        events = self.state.org.audit_log
+        if created:
+            since = calendar.timegm(time.strptime(created.group(1), '%Y-%m-%dT%H:%M:%SZ'))
+            events = [event for event in events if event['@timestamp'] >= since * 1000]
+        if query.get('order', 'desc') == 'desc':
+            events = events[::-1]
+        return self.page(events, query)
+
+    def put_org_membership(self, query, org, login):
+        if login not in self.state.org.members:
+            self.state.org.invitations.add(login)
+            self.state.org.audit('org.invite_member', user=login)
+        return 200, {'state': 'active' if login in self.state.org.members else 'pending', 'role': 'member', 'url': self.path}
+
+    def delete_org_membership(self, query, org, login):
+        if login in self.state.org.members:
+            self.state.org.audit('org.remove_member', user=login)
+        self.state.org.members.discard(login)
+        self.state.org.invitations.discard(login)
+        for team in self.state.org.teams.values():
+            team['members'].pop(login, None)
+        for repo in self.state.org.repos.values():
+            repo['collaborators'].pop(login, None)
+        return 204, None
+
+    def put_outside_collaborator(self, query, org, login):
+        self.state.org.members.discard(login)
+        self.state.org.collaborators.add(login)
+        self.state.org.audit('org.add_outside_collaborator', user=login)
+        return 204, None
+
+    def delete_outside_collaborator(self, query, org, login):
+        self.state.org.collaborators.discard(login)
+        self.state.org.audit('org.remove_outside_collaborator', user=login)
+        return 204, None
+
+    def get_user(self, query, login):
+        return 200, self.user(login)
+
+    ### Teams
+
+    def get_teams(self, query, org):
+        return self.page([self.team_json(slug) for slug in self.state.org.teams], query)
+
+    def get_team_by_slug(self, query, org, slug):
+        return (200, self.team_json(slug)) if slug in self.state.org.teams else (404, {'message': 'Not Found'})
+
+    def patch_team(self, query, org_id, team_id):
+        slug = self.team_by_id(team_id)
+        team = self.state.org.teams[slug]
+        body = self.body()
+        team['name'] = body.get('name', team['name'])
+        team['description'] = body.get('description', team['description'])
+        return 200, self.team_json(slug)
+
+    def get_team_members(self, query, org_id, team_id):
+        members = self.state.org.teams[self.team_by_id(team_id)]['members']
+        role = query.get('role', 'all')
+        return self.page([self.user(login) for login in sorted(members) if role in ('all', members[login])], query)
+
+    def get_team_member(self, query, org_id, team_id, login):
+        return (204, None) if login in self.state.org.teams[self.team_by_id(team_id)]['members'] else (404, {'message': 'Not Found'})
+
+    def get_team_membership(self, query, org_id, team_id, login):
+        members = self.state.org.teams[self.team_by_id(team_id)]['members']
+        if login not in members:
+            return 404, {'message': 'Not Found'}
+        return 200, {'role': members[login], 'state': 'active', 'url': self.path}
+
+    def put_team_membership(self, query, org_id, team_id, login):
+        slug = self.team_by_id(team_id)
+        members = self.state.org.teams[slug]['members']
+        role = self.body().get('role', 'member')
+        if members.get(login) != role:
+            action = 'team.add_member' if login not in members else 'team.promote_maintainer' if role == 'maintainer' else 'team.demote_maintainer'
+            self.state.org.audit(action, team=f'{self.state.org.name}/{slug}', user=login)
+        members[login] = role
+        return 200, {'role': members[login], 'state': 'active', 'url': self.path}
+
+    def delete_team_membership(self, query, org_id, team_id, login):
+        slug = self.team_by_id(team_id)
+        if self.state.org.teams[slug]['members'].pop(login, None):
+            self.state.org.audit('team.remove_member', team=f'{self.state.org.name}/{slug}', user=login)
+        return 204, None
+
+    ### Repos
+
+    def pushed_order(self)-> list:
+        ''' Repo names most recently pushed first '''
+        repos = self.state.org.repos
+        return sorted(repos, key=lambda name: repos[name]['pushed_at'], reverse=True)
+
+    def get_repos(self, query, org):
+        names = self.pushed_order() if query.get('sort') == 'pushed' else sorted(self.state.org.repos)
+        return self.page([self.repo_json(name) for name in names], query)
+
+    def get_repo(self, query, org, name):
+        return (200, self.repo_json(name)) if name in self.state.org.repos else (404, {'message': 'Not Found'})
+
+    def get_collaborators(self, query, org, name):
+        repo = self.state.org.repos[name]
+        logins = sorted(repo['outside'] if query.get('affiliation') == 'outside' else repo['collaborators'])
+        return self.page([self.collaborator_json(login, repo['collaborators'][login]) for login in logins], query)
+
+    def get_collaborator_permission(self, query, org, name, login):
+        permission = self.state.org.repos[name]['collaborators'].get(login)
+        if not permission:
+            return 404, {'message': 'Not Found'}
+        return 200, {'permission': REPO_ROLE_NAMES[permission].replace('maintain', 'write').replace('triage', 'read'),
+                     'role_name': REPO_ROLE_NAMES[permission], 'user': self.user(login)}
+
+    def get_repo_teams(self, query, org, name):
+        teams = self.state.org.repos[name]['teams']
+        return self.page([self.team_json(slug, permission) for slug, permission in sorted(teams.items())], query)
+
+    def get_contributors(self, query, org, name):
+        counts = Counter(author for author, parent in self.state.org.repos[name]['history'].values() if author)
+        return self.page([dict(self.user(login), contributions=count) for login, count in counts.most_common()], query)
+
+    def get_branches(self, query, org, name):
+        heads = self.state.org.repos[name]['heads']
+        return self.page([{'name': branch, 'commit': {'sha': head, 'url': ''}, 'protected': False} for branch, head in heads.items()], query)
+
+    def get_branch(self, query, org, name, branch):
+        head = self.state.org.repos[name]['heads'].get(branch)
+        if not head:
+            return 404, {'message': 'Branch not found'}
+        return 200, {'name': branch, 'commit': self.commit_json(name, head), 'protected': False}
+
+    def get_commits(self, query, org, name):
+        repo = self.state.org.repos[name]
+        head = query.get('sha', repo['heads']['main'])
+        head = repo['heads'].get(head, head)
+        if head not in repo['history']:
+            return 404, {'message': 'Not Found'}
+        return self.page([self.commit_json(name, commit) for commit in self.state.org.commits_from(name, head)], query)
+
+    def get_rate_limit(self, query):
+        core = {'limit': self.state.rate_limit, 'remaining': self.state.remaining, 'reset': self.state.reset_at, 'used': self.state.rate_limit - self.state.remaining}
+        return 200, {'resources': {'core': core}, 'rate': core}
+
+    ### GraphQL
+
+    def graphql_connection(self, items:list, query:str, field:str, after:str = None, key:str = 'nodes')-> dict:
+        '''
+        One page of a GraphQL connection. The page size is first: N of field in the query, capped by the state.
+        Cursors are the offset of the next item.
+        '''
+        first = re.search(rf'{field}\(first: (\d+)', query)
+        size = min(int(first.group(1)) if first else MAX_PAGE_SIZE, self.state.graphql_page_size)
+        start = int(after or 0)
+        end = min(start + size, len(items))
+        return {'pageInfo': {'hasNextPage': end < len(items), 'endCursor': str(end) if end > start else None}, key: items[start:end]}
+
+    def team_member_edges(self, slug:str)-> list:
+        members = self.state.org.teams[slug]['members']
+        return [{'role': members[login].upper(), 'node': {'login': login}} for login in sorted(members)]
+
+    def team_repository_edges(self, slug:str)-> list:
+        repos = self.state.org.repos
+        return [{'permission': GRAPHQL_PERMISSIONS[repos[name]['teams'][slug]], 'node': {'name': name}}
+                for name in sorted(repos) if slug in repos[name]['teams']]
+
+    def collaborator_edges(self, name:str, affiliation:str)-> list:
+        repo = self.state.org.repos[name]
+        logins = sorted(repo['outside'] if affiliation == 'OUTSIDE' else repo['collaborators'])
+        return [{'permission': GRAPHQL_PERMISSIONS[repo['collaborators'][login]], 'node': {'login': login}} for login in logins]
+
+    def team_node(self, slug:str, query:str, with_members:bool)-> dict:
+        team = self.state.org.teams[slug]
+        parent = self.state.org.teams[team['parent']] if team['parent'] else None
+        node = {
+            'slug': slug, 'name': team['name'], 'description': team['description'], 'databaseId': team['id'],
+            'url': f'https://github.com/orgs/{self.state.org.name}/teams/{slug}',
+            'parentTeam': {'databaseId': parent['id'], 'name': parent['name']} if parent else None,
+            'repositories': self.graphql_connection(self.team_repository_edges(slug), query, 'repositories', key='edges'),
+        }
+        if with_members:
+            node['members'] = self.graphql_connection(self.team_member_edges(slug), query, 'members', key='edges')
+        return node
+
+    def repo_node(self, name:str, query:str)-> dict:
+        return {
+            'name': name, 'url': f'https://github.com/{self.state.org.name}/{name}',
+            'direct': self.graphql_connection(self.collaborator_edges(name, 'DIRECT'), query, 'collaborators', key='edges'),
+            'outside': self.graphql_connection(self.collaborator_edges(name, 'OUTSIDE'), query, 'collaborators', key='edges'),
+        }
+
+    def post_graphql(self, query):
+        body = self.body()
+        text = body.get('query', '')
+        variables = body.get('variables') or {}
+        operation = re.search(r'query (\w+)', text)
+        operation = operation.group(1) if operation else None
+        org = self.state.org
+        cursor = variables.get('cursor')
+        if variables.get('org') != org.name:
+            return 200, {'data': {'repository' if operation in ('Repository', 'RepoCollaborators') else 'organization': None}}
+        slug = variables.get('slug')
+        team = slug if slug in org.teams else None
+        name = variables.get('repo') if variables.get('repo') in org.repos else None
+
+        if operation == 'OrgMembers':
+            organization = {'login': org.name, 'name': org.name, 'description': 'Synthetic org',
+                            'membersWithRole': self.graphql_connection([{'login': login} for login in sorted(org.members)], text, 'membersWithRole', cursor)}
+        elif operation == 'OrgTeams':
+            teams = [self.team_node(slug, text, variables.get('withMembers')) for slug in org.teams]
+            organization = {'teams': self.graphql_connection(teams, text, 'teams', cursor)}
+        elif operation == 'Team':
+            organization = {'team': self.team_node(team, text, variables.get('withMembers')) if team else None}
+        elif operation == 'TeamMembers':
+            organization = {'team': {'members': self.graphql_connection(self.team_member_edges(team), text, 'members', cursor, 'edges')} if team else None}
+        elif operation == 'TeamRepositories':
+            organization = {'team': {'repositories': self.graphql_connection(self.team_repository_edges(team), text, 'repositories', cursor, 'edges')} if team else None}
+        elif operation == 'OrgRepositories':
+            repos = [self.repo_node(name, text) for name in self.pushed_order()]
+            organization = {'repositories': self.graphql_connection(repos, text, 'repositories', cursor)}
+        elif operation == 'Repository':
+            return 200, {'data': {'repository': self.repo_node(name, text) if name else None}}
+        elif operation == 'RepoCollaborators':
+            collaborators = self.graphql_connection(self.collaborator_edges(name, variables.get('affiliation')), text, 'collaborators', cursor, 'edges') if name else None
+            return 200, {'data': {'repository': {'collaborators': collaborators} if name else None}}
+        else:
+            return 200, {'data': None, 'errors': [{'message': f'Query {operation} is not supported by the fake API'}]}
+        return 200, {'data': {'organization': organization}}
+
+
+def route(verb:str, path:str, method)-> tuple:
+    ''' Routing table entry. {name} in path matches one path segment and is passed to method '''
+    return verb, path, re.compile(re.sub(r'\{\w+\}', '([^/]+)', path)), method
+
+FakeGitHubHandler.ROUTES = [
+    route('GET', '/rate_limit', FakeGitHubHandler.get_rate_limit),
+    route('GET', '/orgs/{org}', FakeGitHubHandler.get_org),
+    route('GET', '/orgs/{org}/members', FakeGitHubHandler.get_org_members),
+    route('GET', '/orgs/{org}/audit-log', FakeGitHubHandler.get_audit_log),
+    route('GET', '/orgs/{org}/outside_collaborators', FakeGitHubHandler.get_outside_collaborators),
+    route('GET', '/orgs/{org}/invitations', FakeGitHubHandler.get_invitations),
+    route('PUT', '/orgs/{org}/memberships/{login}', FakeGitHubHandler.put_org_membership),
+    route('DELETE', '/orgs/{org}/memberships/{login}', FakeGitHubHandler.delete_org_membership),
+    route('DELETE', '/orgs/{org}/members/{login}', FakeGitHubHandler.delete_org_membership),
+    route('PUT', '/orgs/{org}/outside_collaborators/{login}', FakeGitHubHandler.put_outside_collaborator),
+    route('DELETE', '/orgs/{org}/outside_collaborators/{login}', FakeGitHubHandler.delete_outside_collaborator),
+    route('GET', '/users/{login}', FakeGitHubHandler.get_user),
+    route('GET', '/orgs/{org}/teams', FakeGitHubHandler.get_teams),
+    route('GET', '/orgs/{org}/teams/{slug}', FakeGitHubHandler.get_team_by_slug),
+    route('PATCH', '/organizations/{org_id}/team/{team_id}', FakeGitHubHandler.patch_team),
+    route('GET', '/organizations/{org_id}/team/{team_id}/members', FakeGitHubHandler.get_team_members),
+    route('GET', '/organizations/{org_id}/team/{team_id}/members/{login}', FakeGitHubHandler.get_team_member),
+    route('GET', '/organizations/{org_id}/team/{team_id}/memberships/{login}', FakeGitHubHandler.get_team_membership),
+    route('PUT', '/organizations/{org_id}/team/{team_id}/memberships/{login}', FakeGitHubHandler.put_team_membership),
+    route('DELETE', '/organizations/{org_id}/team/{team_id}/memberships/{login}', FakeGitHubHandler.delete_team_membership),
+    route('GET', '/orgs/{org}/repos', FakeGitHubHandler.get_repos),
+    route('GET', '/repos/{owner}/{repo}', FakeGitHubHandler.get_repo),
+    route('GET', '/repos/{owner}/{repo}/collaborators', FakeGitHubHandler.get_collaborators),
+    route('GET', '/repos/{owner}/{repo}/collaborators/{login}/permission', FakeGitHubHandler.get_collaborator_permission),
+    route('GET', '/repos/{owner}/{repo}/teams', FakeGitHubHandler.get_repo_teams),
+    route('GET', '/repos/{owner}/{repo}/contributors', FakeGitHubHandler.get_contributors),
+    route('GET', '/repos/{owner}/{repo}/branches', FakeGitHubHandler.get_branches),
+    route('GET', '/repos/{owner}/{repo}/branches/{branch}', FakeGitHubHandler.get_branch),
+    route('GET', '/repos/{owner}/{repo}/commits', FakeGitHubHandler.get_commits),
+    route('POST', '/graphql', FakeGitHubHandler.post_graphql),
+]
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    request_queue_size = 256 # Default of 5 drops connections when many clients connect at once
+    daemon_threads = True
+
+
+def make_server(state:FakeGitHubState, host:str = '127.0.0.1', port:int = 0)-> ThreadingHTTPServer:
+    '''
+    HTTP server for the fake API bound to state. Port 0 picks a free port, see server.server_port.
+    Call serve_forever() to run it.
+    '''
+    handler = type('FakeGitHubHandler', (FakeGitHubHandler,), {'state': state})
+    return FakeGitHubServer((host, port), handler)
+
+
+def add_org_arguments(parser:argparse.ArgumentParser)-> None:
+    ''' Arguments describing the synthetic org. Shared with benchmark.py '''
+    parser.add_argument('--org', default='fake-org', help='Login of the synthetic org. Default is fake-org')
+    parser.add_argument('--repos', type=int, default=50, help='Number of repos. Default is 50')
+    parser.add_argument('--teams', type=int, default=10, help='Number of teams. Default is 10')
+    parser.add_argument('--members', type=int, default=100, help='Number of org members. Default is 100')
+    parser.add_argument('--collaborators', type=int, default=10, help='Number of outside collaborators. Default is 10')
+    parser.add_argument('--branches', type=int, default=2, help='Branches per repo besides main. Default is 2')
+    parser.add_argument('--commits', type=int, default=20, help='Commits on main per repo. Default is 20')
+    parser.add_argument('--audit-events', type=int, default=10, help='Events already in the org audit log. Default is 10')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. The same seed always makes the same org')
+    parser.add_argument('--rate-limit', type=int, default=DEFAULT_RATE_LIMIT, help=f'Requests allowed per hour. Default is {DEFAULT_RATE_LIMIT}')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response to simulate the network. Default is 0')
+
+
+def org_args_from(args)-> dict:
+    return {'name': args.org, 'repos': args.repos, 'teams': args.teams, 'members': args.members,
+            'collaborators': args.collaborators, 'branches': args.branches, 'commits': args.commits, 'audit_events': args.audit_events, 'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                        prog=os.path.basename(sys.argv[0]),
+                        description='Local stand-in for the GitHub REST and GraphQL API serving a synthetic org. Used by benchmark.py',
+                        epilog='GET /_stats returns request counters. POST /_reset makes the org again and zeroes them.')
+    add_org_arguments(parser)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on. Default is {DEFAULT_PORT}')
+    parser.add_argument('--graphql-page-size', type=int, default=MAX_PAGE_SIZE, help=f'Max items per page of a GraphQL connection. Default is {MAX_PAGE_SIZE}')
+    args = parser.parse_args()
+    server = make_server(FakeGitHubState(org_args_from(args), args.rate_limit, args.latency, args.graphql_page_size), port=args.port)
+    print(f'[INFO] Fake GitHub API for org {args.org} on http://127.0.0.1:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
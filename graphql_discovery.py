@@ -0,0 +1,389 @@
+import sys
+import time
+import requests
+from common import *
+from ratelimit import *
+
+GRAPHQL_URL = 'https://api.github.com/graphql' # Override for GitHub Enterprise Server or a local fake endpoint
+
+PAGE_INFO = 'pageInfo { hasNextPage endCursor }'
+
+ORG_MEMBERS_QUERY = '''
+query OrgMembers($org: String!, $cursor: String) {
+  organization(login: $org) {
+    login
+    name
+    description
+    membersWithRole(first: 100, after: $cursor) {
+      %s
+      nodes { login }
+    }
+  }
+}
+''' % PAGE_INFO
+
+# Team fields shared by the teams listing and the single team query.
+# Members are skipped with $withMembers=false when we only need team access to repos.
+TEAM_FIELDS = '''
+slug
+name
+description
+databaseId
+url
+parentTeam { databaseId name }
+members(first: 100, membership: ALL) @include(if: $withMembers) {
+  %s
+  edges { role node { login } }
+}
+repositories(first: 100) {
+  %s
+  edges { permission node { name } }
+}
+''' % (PAGE_INFO, PAGE_INFO)
+
+ORG_TEAMS_QUERY = '''
+query OrgTeams($org: String!, $cursor: String, $withMembers: Boolean!) {
+  organization(login: $org) {
+    teams(first: 25, after: $cursor) {
+      %s
+      nodes { %s }
+    }
+  }
+}
+''' % (PAGE_INFO, TEAM_FIELDS)
+
+TEAM_QUERY = '''
+query Team($org: String!, $slug: String!, $withMembers: Boolean!) {
+  organization(login: $org) {
+    team(slug: $slug) { %s }
+  }
+}
+''' % TEAM_FIELDS
+
+TEAM_MEMBERS_QUERY = '''
+query TeamMembers($org: String!, $slug: String!, $cursor: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      members(first: 100, after: $cursor, membership: ALL) {
+        %s
+        edges { role node { login } }
+      }
+    }
+  }
+}
+''' % PAGE_INFO
+
+TEAM_REPOSITORIES_QUERY = '''
+query TeamRepositories($org: String!, $slug: String!, $cursor: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      repositories(first: 100, after: $cursor) {
+        %s
+        edges { permission node { name } }
+      }
+    }
+  }
+}
+''' % PAGE_INFO
+
+REPO_FIELDS = '''
+name
+url
+direct: collaborators(first: 100, affiliation: DIRECT) {
+  %s
+  edges { permission node { login } }
+}
+outside: collaborators(first: 100, affiliation: OUTSIDE) {
+  %s
+  edges { permission node { login } }
+}
+''' % (PAGE_INFO, PAGE_INFO)
+
+# Same order as REST org.get_repos(type='all', sort='pushed')
+ORG_REPOSITORIES_QUERY = '''
+query OrgRepositories($org: String!, $cursor: String) {
+  organization(login: $org) {
+    repositories(first: 50, after: $cursor, orderBy: {field: PUSHED_AT, direction: DESC}) {
+      %s
+      nodes { %s }
+    }
+  }
+}
+''' % (PAGE_INFO, REPO_FIELDS)
+
+REPOSITORY_QUERY = '''
+query Repository($org: String!, $repo: String!) {
+  repository(owner: $org, name: $repo) { %s }
+}
+''' % REPO_FIELDS
+
+REPO_COLLABORATORS_QUERY = '''
+query RepoCollaborators($org: String!, $repo: String!, $affiliation: CollaboratorAffiliation!, $cursor: String) {
+  repository(owner: $org, name: $repo) {
+    collaborators(first: 100, after: $cursor, affiliation: $affiliation) {
+      %s
+      edges { permission node { login } }
+    }
+  }
+}
+''' % PAGE_INFO
+
+# GraphQL repository permissions mapped to the legacy values returned by repo.get_collaborator_permission()
+COLLABORATOR_PERMISSION_ROLES = {
+    'ADMIN': 'admin',
+    'MAINTAIN': 'write',
+    'WRITE': 'write',
+    'TRIAGE': 'read',
+    'READ': 'read',
+}
+
+# GraphQL repository permissions mapped to the team roles used by discover_repository
+TEAM_REPOSITORY_PERMISSION_ROLES = {
+    'ADMIN': 'admin',
+    'MAINTAIN': 'maintain',
+    'WRITE': 'write',
+    'TRIAGE': 'triage',
+    'READ': 'read',
+}
+
+# GraphQL team member roles mapped to the REST role filter used by discover_team
+TEAM_MEMBER_ROLES = {
+    'MAINTAINER': 'maintainer',
+    'MEMBER': 'member',
+}
+
+
+class GraphQLError(Exception):
+    '''
+    Raised when the GraphQL endpoint returns an HTTP error or a response with no data.
+    '''
+
+
+class GraphQLClient:
+    '''
+    Minimal client for the GitHub GraphQL API.
+    ---
+    token:str = GitHub Personal Access Token
+    url:str = GraphQL endpoint. Point this at a local fake endpoint for testing.
+    scheduler = RateLimitScheduler shared with the REST client or None
+    profiler = ApiProfiler shared with the REST client or None
+    '''
+    def __init__(self, token:str, url:str = GRAPHQL_URL, timeout:int = 60, scheduler:RateLimitScheduler = None, profiler = None) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.profiler = profiler
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'bearer {token}',
+            'Accept': 'application/json',
+        })
+
+    def query(self, query:str, variables:dict) -> dict:
+        '''
+        Run one query and return its data.
+        Partial errors, such as a repo whose collaborators we are not allowed to see, are printed as warnings.
+        '''
+        for attempt in range(5):
+            start = time.perf_counter()
+            if self.scheduler:
+                self.scheduler.acquire('graphql')
+            sent = time.perf_counter()
+            response = self.session.post(self.url, json={'query': query, 'variables': variables}, timeout=self.timeout)
+            if self.profiler:
+                self.profiler.record('POST', self.url, response.status_code, response.headers, len(response.request.body or b''),
+                                     len(response.content), time.perf_counter() - sent, sent - start)
+            if not self.scheduler or self.scheduler.update('graphql', response.status_code, response.headers, response.text) is None:
+                break
+        if response.status_code != 200:
+            raise GraphQLError(f'GraphQL request failed with HTTP {response.status_code}: {response.text}')
+        result = response.json()
+        errors = result.get('errors')
+        if not result.get('data'):
+            raise GraphQLError(f'GraphQL query returned no data: {errors}')
+        for error in errors or []:
+            print(f"[WARNING] GraphQL: {error.get('message')}", file=sys.stderr)
+        return result['data']
+
+    def paginate(self, query:str, variables:dict, path:list, after:str = None):
+        '''
+        Generator that yields the data of every page of the connection found at path in the result.
+        ie. path = ['organization', 'repositories']
+        after:str = endCursor of a page from an earlier run to carry on after. Default is the first page.
+        '''
+        cursor = after
+        while True:
+            data = self.query(query, dict(variables, cursor=cursor))
+            connection = get_path(data, path)
+            if connection is None:
+                return
+            yield connection
+            if not connection['pageInfo']['hasNextPage']:
+                return
+            cursor = connection['pageInfo']['endCursor']
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def get_path(data:dict, path:list):
+    ''' Walk a list of keys into a nested dict. Returns None if any key is missing or null '''
+    for key in path:
+        if data is None:
+            return None
+        data = data.get(key)
+    return data
+
+
+class GraphQLDiscovery:
+    '''
+    Builds the same OrgObject, TeamObject and RepoObject structures as discover_org, discover_team
+    and discover_repository from batched GraphQL queries instead of one REST call per object.
+
+    GraphQL has no reverse lookup from a repo to the teams that can access it,
+    so team access is collected from each team's repositories the first time a repo is discovered.
+    ---
+    client = GraphQLClient
+    org_login:str = GitHub Organization login
+    '''
+    def __init__(self, client:GraphQLClient, org_login:str) -> None:
+        self.client = client
+        self.org_login = org_login
+        self.repo_teams = None # repo name -> {team slug: role}. Loaded on first use.
+
+    def discover_org(self, outside_collaborators:list, invitations:list) -> OrgObject:
+        '''
+        Org members come from GraphQL. Outside collaborators and pending invitations have no GraphQL org
+        equivalent that matches the REST output, so their logins are passed in from the REST listings.
+        '''
+        this_org = None
+        cursor = None
+        while True:
+            organization = self.client.query(ORG_MEMBERS_QUERY, {'org': self.org_login, 'cursor': cursor})['organization']
+            if this_org is None:
+                this_org = OrgObject(organization['login'])
+                this_org.name = organization['name']
+                this_org.description = organization['description']
+            members = organization['membersWithRole']
+            for node in members['nodes']:
+                this_org.add_member(node['login'])
+            if not members['pageInfo']['hasNextPage']:
+                break
+            cursor = members['pageInfo']['endCursor']
+
+        for login in outside_collaborators:
+            this_org.add_collab(login)
+        for login in invitations:
+            this_org.add_invited_user(login)
+        return this_org
+
+    def _team_from_node(self, node:dict) -> TeamObject:
+        this_team = TeamObject(slug=node['slug'])
+        this_team.name = node['name']
+        this_team.description = node['description']
+        this_team.id = node['databaseId']
+        this_team.html_url = node['url']
+        if node['parentTeam']:
+            this_team.parent_id = node['parentTeam']['databaseId']
+            this_team.parent_name = node['parentTeam']['name']
+        members = node.get('members')
+        if members:
+            for edge in self._all_edges(members, TEAM_MEMBERS_QUERY, {'org': self.org_login, 'slug': node['slug']}, ['organization', 'team', 'members']):
+                this_team.add_member(edge['node']['login'], role=TEAM_MEMBER_ROLES[edge['role']])
+        return this_team
+
+    def _all_edges(self, connection:dict, query:str, variables:dict, path:list):
+        '''
+        Yields the edges of a nested connection. The first page came with the parent query,
+        any further pages are fetched with query starting after the first page's cursor.
+        '''
+        yield from connection['edges']
+        cursor = connection['pageInfo']['endCursor']
+        while connection['pageInfo']['hasNextPage']:
+            connection = get_path(self.client.query(query, dict(variables, cursor=cursor)), path)
+            if connection is None:
+                return
+            yield from connection['edges']
+            cursor = connection['pageInfo']['endCursor']
+
+    def _add_team_repositories(self, node:dict) -> None:
+        for edge in self._all_edges(node['repositories'], TEAM_REPOSITORIES_QUERY, {'org': self.org_login, 'slug': node['slug']}, ['organization', 'team', 'repositories']):
+            role = TEAM_REPOSITORY_PERMISSION_ROLES.get(edge['permission'])
+            if role:
+                self.repo_teams.setdefault(edge['node']['name'], {})[node['slug']] = role
+
+    def discover_teams(self, after:str = None, on_page = None, skip = ()):
+        '''
+        Generator yielding a TeamObject for every team in the org, 25 teams with their members per query.
+        Team access to repos is collected on the way so a later repo crawl does not need to list teams again.
+        ---
+        after:str = Cursor to resume the listing after, see on_page
+        on_page = Called with the endCursor of each page once all its teams have been yielded
+        skip = Team slugs not to yield, ie. teams an earlier run already discovered
+        '''
+        collect_repo_teams = self.repo_teams is None and after is None # A resumed listing would only see some of the teams
+        if collect_repo_teams:
+            self.repo_teams = {}
+        for page in self.client.paginate(ORG_TEAMS_QUERY, {'org': self.org_login, 'withMembers': True}, ['organization', 'teams'], after):
+            for node in page['nodes']:
+                if collect_repo_teams:
+                    self._add_team_repositories(node)
+                if node['slug'] not in skip:
+                    yield self._team_from_node(node)
+            if on_page:
+                on_page(page['pageInfo']['endCursor'])
+
+    def discover_team(self, team_slug:str) -> TeamObject:
+        ''' Returns the TeamObject for one team or None if the team was not found '''
+        node = get_path(self.client.query(TEAM_QUERY, {'org': self.org_login, 'slug': team_slug, 'withMembers': True}), ['organization', 'team'])
+        if node is None:
+            return None
+        return self._team_from_node(node)
+
+    def _load_repo_teams(self) -> None:
+        if self.repo_teams is not None:
+            return
+        self.repo_teams = {}
+        for page in self.client.paginate(ORG_TEAMS_QUERY, {'org': self.org_login, 'withMembers': False}, ['organization', 'teams']):
+            for node in page['nodes']:
+                self._add_team_repositories(node)
+
+    def _repo_from_node(self, node:dict) -> RepoObject:
+        this_repo = RepoObject(name=node['name'])
+        this_repo.html_url = node['url']
+        variables = {'org': self.org_login, 'repo': node['name']}
+        path = ['repository', 'collaborators']
+        if node['direct']:
+            for edge in self._all_edges(node['direct'], REPO_COLLABORATORS_QUERY, dict(variables, affiliation='DIRECT'), path):
+                this_repo.add_direct_collabs(login=edge['node']['login'], role=COLLABORATOR_PERMISSION_ROLES[edge['permission']])
+        if node['outside']:
+            for edge in self._all_edges(node['outside'], REPO_COLLABORATORS_QUERY, dict(variables, affiliation='OUTSIDE'), path):
+                this_repo.add_outside_collabs(login=edge['node']['login'], role=COLLABORATOR_PERMISSION_ROLES[edge['permission']])
+        for team_slug, role in self.repo_teams.get(node['name'], {}).items():
+            this_repo.add_team(team_slug, role)
+        return this_repo
+
+    def discover_repositories(self, after:str = None, on_page = None, skip = ()):
+        '''
+        Generator yielding a RepoObject for every repo in the org, most recently pushed first
+        like org.get_repos(type='all', sort='pushed'). 50 repos and their collaborators per query.
+        ---
+        after:str = Cursor to resume the listing after, see on_page
+        on_page = Called with the endCursor of each page once all its repos have been yielded
+        skip = Repo names not to yield, ie. repos an earlier run already discovered
+        '''
+        self._load_repo_teams()
+        for page in self.client.paginate(ORG_REPOSITORIES_QUERY, {'org': self.org_login}, ['organization', 'repositories'], after):
+            for node in page['nodes']:
+                if node['name'] not in skip:
+                    yield self._repo_from_node(node)
+            if on_page:
+                on_page(page['pageInfo']['endCursor'])
+
+    def discover_repository(self, repo_name:str) -> RepoObject:
+        ''' Returns the RepoObject for one repo or None if the repo was not found '''
+        node = self.client.query(REPOSITORY_QUERY, {'org': self.org_login, 'repo': repo_name})['repository']
+        if node is None:
+            return None
+        self._load_repo_teams()
+        return self._repo_from_node(node)
@@ -0,0 +1,141 @@
+import os
+import json
+import threading
+from common import *
+
+LISTING_PAGE_SIZE = 100
+
+
+def check_listing(requester, url:str, parameters:dict, previous:dict) -> tuple:
+    '''
+    Revalidate every page of a listing with the ETags saved by the last run.
+    Unchanged pages come back as 304 Not Modified which does not count against the rate limit.
+    Returns (changed:bool, listing:dict) where listing holds the ETags to save for the next run.
+    ---
+    requester = PyGithub requester of the repo, ie. repo._requester
+    url:str = API url of the listing, ie. f'{repo.url}/collaborators'
+    parameters:dict = Query parameters, ie. {'affiliation': 'direct'}
+    previous:dict = listing returned by the last run or None
+        {"etags": [etag of each page], "last_count": number of items on the last page}
+    '''
+    previous_etags = previous['etags'] if previous else []
+    etags = []
+    changed = not previous
+    page = 1
+    while True:
+        previous_etag = previous_etags[page - 1] if page <= len(previous_etags) else None
+        headers = {'If-None-Match': previous_etag} if previous_etag else None
+        status, response_headers, output = requester.requestJson('GET', url, dict(parameters, per_page=LISTING_PAGE_SIZE, page=page), headers)
+        if status == 304:
+            etags.append(previous_etag)
+            # Pages before the last one were full when they were saved
+            count = previous['last_count'] if page == len(previous_etags) else LISTING_PAGE_SIZE
+        elif status == 200:
+            changed = True
+            etags.append(response_headers.get('etag'))
+            count = len(json.loads(output))
+        else: # ie. 403 or 404. Let discover_repository deal with it.
+            return True, None
+        if count < LISTING_PAGE_SIZE:
+            break
+        page += 1
+    if len(etags) != len(previous_etags):
+        changed = True
+    return changed, {'etags': etags, 'last_count': count}
+
+
+def repo_listings(repo:github.Repository.Repository) -> dict:
+    ''' The listings discover_repository reads for a repo as {name: (url, parameters)} '''
+    return {
+        'direct_collabs': (f'{repo.url}/collaborators', {'affiliation': 'direct'}),
+        'outside_collabs': (f'{repo.url}/collaborators', {'affiliation': 'outside'}),
+        'teams': (f'{repo.url}/teams', {}),
+    }
+
+
+class IncrementalState:
+    '''
+    Incremental repo discovery.
+    Keeps the RepoObject structure of every repo from the last run together with its pushed_at/updated_at
+    timestamps and the ETags of its collaborator and team listings.
+    A repo is only discovered again if a timestamp moved or one of its listings changed,
+    otherwise the saved RepoObject is reused.
+    ---
+    state_file:str = JSON file the state is loaded from and saved to. Created on the first run.
+    discover = Function used to discover changed repos. Same signature as discover_repository, which is the default.
+
+    Example:
+    ```
+    state = IncrementalState('repos.state.json')
+    for repo in org.get_repos(type='all', sort='pushed'):
+        this_repo = state.discover(repo)
+    state.save()
+    ```
+    '''
+    def __init__(self, state_file:str, discover=discover_repository) -> None:
+        self.state_file = state_file
+        self.discover_changed = discover
+        self.previous = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as file:
+                self.previous = json.load(file).get('repos', {})
+        self.current = {}
+        self.reused = 0
+        self.discovered = 0
+        self.lock = threading.Lock()
+
+    def discover(self, repo:github.Repository.Repository, discover_contributors:bool = False, branch:str=None) -> RepoObject:
+        ''' Same signature as discover_repository so it can be passed to discover_repositories '''
+        previous = self.previous.get(repo.name)
+        watermark = {
+            'pushed_at': get_listing_field(repo, 'pushed_at'),
+            'updated_at': get_listing_field(repo, 'updated_at'),
+        }
+        changed = (previous is None
+                   or previous['watermark'] != watermark
+                   or previous.get('contributors') != discover_contributors
+                   or previous.get('branch') != branch)
+        # Listings are always checked, even for repos we already know changed,
+        # because the ETags are needed next run. Checking before discovery means a change made
+        # while we are discovering is picked up next time rather than missed.
+        listings = {}
+        for name, (url, parameters) in repo_listings(repo).items():
+            previous_listing = previous['listings'].get(name) if previous else None
+            listing_changed, listings[name] = check_listing(repo._requester, url, parameters, previous_listing)
+            changed = changed or listing_changed
+
+        if changed:
+            this_repo = self.discover_changed(repo, discover_contributors, branch)
+        else:
+            this_repo = RepoObject.from_structure(previous['repo'])
+
+        with self.lock:
+            if changed:
+                self.discovered += 1
+            else:
+                self.reused += 1
+            self.current[repo.name] = {
+                'watermark': watermark,
+                'contributors': discover_contributors,
+                'branch': branch,
+                'listings': listings,
+                'repo': this_repo.get_repo_structure(),
+            }
+        return this_repo
+
+    def keep(self, names) -> None:
+        '''
+        Carry the saved state of repos over to this run without discovering them, ie. repos discovery.py --resume
+        outputs from its journal. Their watermarks and ETags stay as the last run saved them.
+        '''
+        with self.lock:
+            for name in names:
+                if name in self.previous and name not in self.current:
+                    self.current[name] = self.previous[name]
+
+    def save(self) -> None:
+        ''' Save the state of this run. Repos no longer in the org are dropped. '''
+        tmp_file = f'{self.state_file}.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'repos': self.current}, file)
+        os.replace(tmp_file, self.state_file)
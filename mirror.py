@@ -0,0 +1,324 @@
+import hmac
+import json
+import hashlib
+import threading
+from common import *
+
+# Webhook events that change what discovery.py reports. Anything else is ignored.
+MIRROR_EVENTS = ['organization', 'membership', 'team', 'team_add', 'member', 'repository']
+
+
+def verify_signature(secret:str, body:bytes, signature:str)-> bool:
+    '''
+    Check the X-Hub-Signature-256 header GitHub sends with each delivery when the webhook has a secret.
+    ---
+    secret:str = Secret set on the webhook
+    body:bytes = Raw request body
+    signature:str = Value of the X-Hub-Signature-256 header, ie. sha256=6c2f...
+    '''
+    if not signature:
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def read_deliveries(file_name:str):
+    '''
+    Yields (event, payload, delivery id) for each delivery recorded by "webhook.py serve --record", one json document per line
+        {"event": "membership", "delivery": "72d3162e-...", "payload": {...}}
+    '''
+    with open(file_name, 'r') as file:
+        for line in file:
+            if line.strip():
+                delivery = json.loads(line)
+                yield delivery['event'], delivery['payload'], delivery.get('delivery')
+
+
+def collaborator_role_from_change(change:dict)-> str:
+    ''' Role of a repo collaborator from the changes of a member event, ie. {"permission": {"to": "write"}} '''
+    for field in ('role_name', 'permission'):
+        role = (change.get(field) or {}).get('to')
+        if role:
+            return collaborator_permission_from_payload({'role_name': role})
+    return None
+
+
+def team_repo_role(team:dict, repository:dict)-> str:
+    '''
+    Role a team has on a repo from a team or team_add payload.
+    The team carries the permission it was given, ie. push, and the repository may carry the team's permissions dict.
+    '''
+    role = TEAM_PERMISSION_ROLES.get(team.get('permission'))
+    if not role and repository.get('permissions'):
+        role = team_role_from_permissions(repository['permissions'])
+    return role or 'read'
+
+
+class OrgMirror:
+    '''
+    Live copy of the org, team and repo structures discovery.py outputs, kept up to date from webhook payloads.
+    Start it from a discovery output file or snapshot database and apply each delivery as it arrives.
+    Applying a payload never calls the GitHub API, so the mirror only costs API calls when it is reloaded
+    from a fresh full discovery, which also puts right anything a missed delivery left out.
+
+    What each event changes:
+        organization member_added, member_removed, member_invited, renamed
+        membership added, removed (team members)
+        team created, deleted, edited, added_to_repository, removed_from_repository
+        team_add (a team was given access to a repo)
+        member added, edited, removed (repo collaborators)
+        repository created, deleted, transferred, renamed, edited
+    Webhook payloads don't say whether a team member is a maintainer, so members added by a delivery are members
+    and a maintainer only shows up after the next reload. Contributors are never changed.
+    ---
+    structures = Iterable of structures from get_repo_structure, get_team_structure and get_org_member_structure,
+        ie. SnapshotStore.structures() or load_documents('org.yml') split into single documents
+    org_login:str = Login of the org. Taken from the org structure if not set. Payloads for any other org are ignored.
+
+    Example:
+    ```
+    mirror = OrgMirror(SnapshotStore('snapshots.db').structures())
+    for event, payload, delivery in read_deliveries('deliveries.ndjson'):
+        mirror.apply(event, payload)
+    for structure in mirror.structures():
+        print(dump_yaml(structure), end='')
+    ```
+    '''
+    def __init__(self, structures = (), org_login:str = None) -> None:
+        self.lock = threading.RLock()
+        self.org_login = org_login
+        self.load(structures)
+
+    def load(self, structures)-> None:
+        ''' Replace the mirrored state with structures from a full discovery. Counters start again. '''
+        repos, teams, org = {}, {}, None
+        for structure in structures:
+            name, data = next(iter(structure.items()))
+            if self.org_login and data.get('org', self.org_login) != self.org_login:
+                continue # Multi org output, see discovery.py --org
+            if data.get('type') == 'repo':
+                repos[name] = RepoObject.from_structure(structure)
+            elif data.get('type') == 'team':
+                teams[name] = TeamObject.from_structure(structure)
+            elif data.get('type') == 'org' and (not self.org_login or name == self.org_login):
+                org = OrgObject.from_structure(structure)
+        with self.lock:
+            self.repos = repos
+            self.teams = teams
+            self.org = org
+            if org:
+                self.org_login = org.login
+            self.applied = 0
+            self.ignored = 0
+
+    ### Lookups
+
+    def team(self, team:dict)-> TeamObject:
+        ''' The mirrored team for a team payload. Added if it is not known yet. '''
+        this_team = self.teams.get(team['slug']) or self.team_by_id(team.get('id'))
+        if this_team is None:
+            this_team = self.teams[team['slug']] = TeamObject(team['slug'])
+            self.update_team(this_team, team)
+        return this_team
+
+    def team_by_id(self, team_id:int)-> TeamObject:
+        for this_team in self.teams.values():
+            if team_id and this_team.id == team_id:
+                return this_team
+        return None
+
+    def repo(self, repository:dict)-> RepoObject:
+        ''' The mirrored repo for a repository payload. Added if it is not known yet. '''
+        this_repo = self.repos.get(repository['name'])
+        if this_repo is None:
+            this_repo = self.repos[repository['name']] = RepoObject(repository['name'])
+            self.update_repo(this_repo, repository)
+        return this_repo
+
+    def update_team(self, this_team:TeamObject, team:dict)-> None:
+        ''' Fields missing from a payload keep their mirrored value '''
+        this_team.name = team.get('name', this_team.name)
+        this_team.description = team.get('description', this_team.description)
+        this_team.html_url = team.get('html_url', this_team.html_url)
+        this_team.id = team.get('id') or this_team.id
+        if 'parent' in team:
+            parent = team['parent'] or {}
+            this_team.parent_id = parent.get('id') or 0
+            this_team.parent_name = parent.get('name')
+
+    def update_repo(self, this_repo:RepoObject, repository:dict)-> None:
+        ''' Only html_url, the description is not part of what discovery outputs for a repo '''
+        this_repo.html_url = repository.get('html_url', this_repo.html_url)
+
+    def is_member(self, login:str)-> bool:
+        return self.org is not None and login in self.org.members_list
+
+    ### Events
+
+    def apply(self, event:str, payload:dict)-> bool:
+        '''
+        Apply one webhook delivery. Returns True if it changed the mirror.
+        ---
+        event:str = X-GitHub-Event header of the delivery, ie. membership
+        payload:dict = Body of the delivery
+        '''
+        action = payload.get('action')
+        org_login = (payload.get('organization') or {}).get('login')
+        handler = getattr(self, f'on_{event}', None) if event in MIRROR_EVENTS else None
+        with self.lock:
+            if handler is None or (self.org_login and org_login and org_login != self.org_login):
+                self.ignored += 1
+                return False
+            changed = handler(action, payload) is not False
+            if changed:
+                self.applied += 1
+            else:
+                self.ignored += 1
+            return changed
+
+    def on_organization(self, action:str, payload:dict):
+        if self.org is None:
+            if action not in ('member_added', 'member_removed', 'member_invited'):
+                return False
+            self.org = OrgObject(payload['organization']['login'])
+            self.org_login = self.org.login
+        if action == 'member_added':
+            login = payload['membership']['user']['login']
+            self.org.add_member(login)
+            self.org.remove_invited_user(login)
+            self.org.remove_collab(login) # An outside collaborator who joins is a member now
+            for this_repo in self.repos.values():
+                remove_from_roles(this_repo.outside_collabs, login)
+        elif action == 'member_removed':
+            login = payload['membership']['user']['login']
+            # Leaving the org takes away team memberships and repo access. GitHub only sends this one event.
+            self.org.remove_member(login)
+            for this_team in self.teams.values():
+                this_team.remove_member(login)
+            for this_repo in self.repos.values():
+                remove_from_roles(this_repo.direct_collabs, login)
+        elif action == 'member_invited':
+            login = (payload.get('invitation') or {}).get('login')
+            if not login: # Invited by email
+                return False
+            self.org.add_invited_user(login)
+        elif action == 'renamed':
+            self.org.login = self.org_login = payload['organization']['login']
+        else:
+            return False
+
+    def on_membership(self, action:str, payload:dict):
+        if payload.get('scope') != 'team' or not payload.get('team'):
+            return False
+        this_team = self.team(payload['team'])
+        login = payload['member']['login']
+        if action == 'added':
+            if not any(login in logins for logins in this_team.members.values()):
+                this_team.add_member(login, 'member')
+        elif action == 'removed':
+            this_team.remove_member(login)
+        else:
+            return False
+
+    def on_team(self, action:str, payload:dict):
+        team = payload['team']
+        if action == 'created':
+            self.team(team)
+        elif action == 'deleted':
+            this_team = self.teams.get(team['slug']) or self.team_by_id(team.get('id'))
+            if this_team:
+                del self.teams[this_team.slug]
+            for this_repo in self.repos.values():
+                this_repo.remove_team(team['slug'])
+        elif action == 'edited':
+            this_team = self.team(team)
+            if this_team.slug != team['slug']: # Renamed, so the slug changed too
+                old_slug = this_team.slug
+                del self.teams[old_slug]
+                this_team.slug = team['slug']
+                self.teams[this_team.slug] = this_team
+                for this_repo in self.repos.values():
+                    for role, team_slugs in this_repo.teams.items():
+                        if old_slug in team_slugs:
+                            team_slugs.discard(old_slug)
+                            team_slugs.add(intern_login(this_team.slug))
+            self.update_team(this_team, team)
+            for child_team in self.teams.values():
+                if this_team.id and child_team.parent_id == this_team.id:
+                    child_team.parent_name = this_team.name
+            if 'repository' in (payload.get('changes') or {}) and payload.get('repository'):
+                this_repo = self.repo(payload['repository'])
+                this_repo.remove_team(team['slug'])
+                this_repo.add_team(team['slug'], team_repo_role(team, payload['repository']))
+        elif action == 'added_to_repository':
+            self.team(team)
+            this_repo = self.repo(payload['repository'])
+            this_repo.remove_team(team['slug'])
+            this_repo.add_team(team['slug'], team_repo_role(team, payload['repository']))
+        elif action == 'removed_from_repository':
+            this_repo = self.repos.get(payload['repository']['name'])
+            if this_repo is None:
+                return False
+            this_repo.remove_team(team['slug'])
+        else:
+            return False
+
+    def on_team_add(self, action:str, payload:dict):
+        team = payload['team']
+        self.team(team)
+        this_repo = self.repo(payload['repository'])
+        this_repo.remove_team(team['slug'])
+        this_repo.add_team(team['slug'], team_repo_role(team, payload['repository']))
+
+    def on_member(self, action:str, payload:dict):
+        login = payload['member']['login']
+        this_repo = self.repo(payload['repository'])
+        if action in ('added', 'edited'):
+            role = collaborator_role_from_change(payload.get('changes') or {})
+            if role is None:
+                current = [role for role, logins in this_repo.direct_collabs.items() if login in logins]
+                role = current[0] if current else 'write' # write is what GitHub gives a new collaborator
+            remove_from_roles(this_repo.direct_collabs, login)
+            remove_from_roles(this_repo.outside_collabs, login)
+            this_repo.add_direct_collabs(login, role)
+            if self.org is not None and not self.is_member(login):
+                this_repo.add_outside_collabs(login, role)
+                self.org.add_collab(login)
+        elif action == 'removed':
+            remove_from_roles(this_repo.direct_collabs, login)
+            remove_from_roles(this_repo.outside_collabs, login)
+            if self.org is not None and not any(login in logins for repo in self.repos.values() for logins in repo.outside_collabs.values()):
+                self.org.remove_collab(login)
+        else:
+            return False
+
+    def on_repository(self, action:str, payload:dict):
+        repository = payload['repository']
+        if action == 'created':
+            self.repo(repository)
+        elif action in ('deleted', 'transferred'):
+            if self.repos.pop(repository['name'], None) is None:
+                return False
+        elif action == 'renamed':
+            old_name = payload['changes']['repository']['name']['from']
+            this_repo = self.repos.pop(old_name, None)
+            if this_repo is None:
+                this_repo = self.repo(repository)
+            this_repo.name = repository['name']
+            self.repos[this_repo.name] = this_repo
+            self.update_repo(this_repo, repository)
+        elif action == 'edited':
+            self.update_repo(self.repo(repository), repository)
+        else:
+            return False
+
+    ### Output
+
+    def structures(self)-> list:
+        ''' Every mirrored structure in the order discovery.py writes them: repos, teams then the org membership '''
+        with self.lock:
+            structures = [self.repos[name].get_repo_structure() for name in sorted(self.repos)]
+            structures += [self.teams[slug].get_team_structure() for slug in sorted(self.teams)]
+            if self.org is not None:
+                structures.append(self.org.get_org_member_structure())
+            return structures
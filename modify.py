@@ -2,11 +2,15 @@ import os
 import sys
 import yaml
 import argparse
+import atexit
 
 from github import Github
 from github import Auth
 from github.GithubException import *
 from common import *
+from transport import *
+from profiler import *
+from plan import *
 
 ACCESS_TOKEN = os.getenv("GITHUB_PRIVATE_TOKEN") # Read GitHub Personal Access Token (PAT) as an ENV Var
 '''
@@ -19,12 +23,23 @@ export GITHUB_PRIVATE_TOKEN
 parser = argparse.ArgumentParser(
                     prog=os.path.basename(sys.argv[0]),
                     description='Modify a GitHub Organization membership, team memberships and repository permisisons using yaml input files',
-                    epilog='')
+                    epilog='Use "plan" to write the changes to a plan file for review without changing anything, then "apply" to make them.\
+                        With no command changes are made as they are found.')
 
+parser.add_argument('command', nargs='?', choices=['plan', 'apply'], help='plan: Write the changes needed to match the input file to --plan-file. apply: Make the changes in --plan-file')
 parser.add_argument('-o','--org', help='Name of GitHub Organization. Can be read from ENV var GITHUB_ORG_NAME')
 parser.add_argument('-f','--file', help='Input yaml file for operation')
+parser.add_argument('--format', choices=OUTPUT_FORMATS, help='Format of the input file. yaml, json or ndjson. Default is picked from the file extension, .json, .ndjson or .jsonl, otherwise yaml')
 parser.add_argument('-t','--teamslug', help='Name slug of GitHub Team to modify. Use "--team all" for all teams.')
 parser.add_argument('-m','--members', action="store_true", help='Set Org memership based on yaml input file')
+parser.add_argument('-p','--plan-file', default=DEFAULT_PLAN_FILE, help=f'Plan file written by plan and read by apply. Default is {DEFAULT_PLAN_FILE}')
+parser.add_argument('-w','--workers', type=int, default=4, help='Used with apply. Number of changes to make at the same time. Default is 4')
+parser.add_argument('--journal', nargs='?', const=DEFAULT_APPLY_JOURNAL_FILE, metavar='JOURNAL_FILE', help=f'Journal every change before it is made and once GitHub confirms it, so a run that stops part way can be carried on with --resume. Removed when every change is made. Default file is {DEFAULT_APPLY_JOURNAL_FILE}')
+parser.add_argument('--resume', action="store_true", help='Carry on from the journal of a stopped run. Changes and teams it has as done are skipped without calling GitHub. Implies --journal')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory for the HTTP response cache. Unchanged responses are served from here with conditional requests. Can be read from ENV var GITHUB_CACHE_DIR')
+parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, help=f'Max size of the HTTP response cache in MB. Default is {DEFAULT_CACHE_SIZE_MB}')
+parser.add_argument('--no-cache', action="store_true", help='Do not use the HTTP response cache')
+parser.add_argument('--profile', nargs='?', const='stderr', metavar='PROFILE_FILE', help='Count API calls, bytes, latency and rate limit cost per endpoint and calling function. Prints a summary to stderr on exit, or saves it as json to PROFILE_FILE')
 args = parser.parse_args()
 
 ### Setup Vars from Args
@@ -38,32 +53,79 @@ if not ACCESS_TOKEN: # Exit if no token set
     print("Exiting: GITHUB_PRIVATE_TOKEN empty or not defined. Set as ENV var GITHUB_PRIVATE_TOKEN")
     exit()
 
-if not ORG_NAME: # Assert ORG_NAME is set
+if not ORG_NAME and args.command != 'apply': # Assert ORG_NAME is set. apply reads it from the plan file.
     print("Exiting: GitHub Orgnaization Name not set. Set as ENV var GITHUB_ORG_NAME or use arg --org <GH-ORG-NAME>")
     exit()
 
 input_file = args.file
 team_slug = args.teamslug
 org_members = args.members
+command = args.command
+plan_file = args.plan_file
+workers = args.workers
+
+if command == 'plan' and not (input_file and (team_slug or org_members)):
+    print("Exiting: plan needs an input file --file and --teamslug and/or --members")
+    exit()
+
+if workers < 1:
+    print("Exiting: --workers must be 1 or more")
+    exit()
+
+journal_file = args.journal or DEFAULT_APPLY_JOURNAL_FILE
+if command == 'plan' and (args.journal or args.resume):
+    print("Exiting: --journal and --resume are used when changes are made, not with plan")
+    exit()
 
 ### End Var setup
 
 # Set GitHub access token
 auth = Auth.Token(ACCESS_TOKEN)
 
-# Create GitHub Instance with Auth Token
-gh = Github(auth=auth)
+# Send every request through the shared transport. It paces requests against the rate limit for all workers
+# and serves unchanged responses from the cache as 304s
+scheduler = RateLimitScheduler()
+cache = None if args.no_cache else ResponseCache(args.cache_dir, args.cache_size * 1024 * 1024)
+profiler = None
+if args.profile:
+    profiler = ApiProfiler()
+    # Registered with atexit so the profile is still reported when the run exits early or is interrupted
+    atexit.register(lambda: profiler.report() if args.profile == 'stderr' else profiler.save(args.profile))
+transport = Transport(cache=cache, scheduler=scheduler, profiler=profiler)
+transport.install()
+
+def new_github_client()-> Github:
+    '''
+    Create GitHub Instance with Auth Token.
+    Used for the main client and for each worker thread of apply.
+    '''
+    # The scheduler paces requests and spaces out writes so PyGithub's fixed delays are turned off
+    return Github(auth=auth, seconds_between_requests=None, seconds_between_writes=None)
 
+gh = new_github_client()
+journal = None
 
-def get_yaml_from_file(file_name)->dict:
-    with open(file_name, 'r') as file:
-        input_data = yaml.safe_load(file)
-    return input_data
+
+def start_journal(options:dict)-> ApplyJournal:
+    '''
+    Open the journal when --journal or --resume is set, otherwise returns None.
+    options are what this run changes. A journal of a run with other options can not be resumed.
+    '''
+    if not (args.journal or args.resume):
+        return None
+    try:
+        started = ApplyJournal(journal_file, options, resume=args.resume)
+    except JournalError as err:
+        print(f"Exiting: Can not resume. {err}")
+        exit()
+    if args.resume:
+        print(f'[INFO] Resuming from {journal_file}: {len(started.done)} changes already done')
+    return started
 
 
 if input_file:
     try:
-        input_data = get_yaml_from_file(input_file)
+        input_data = load_documents(input_file, args.format)
     except Exception as err:
         print(err)
         exit()
@@ -76,8 +138,11 @@ def process_team_memberships(input_data:dict, team_slug:str)->None:
         exit()
     # Validate team data that we're loading from yaml
     if 'type' in input_data[team_slug].keys() and input_data[team_slug]['type'] == 'team':     
-        gh_team = gh.get_organization(ORG_NAME).get_team_by_slug(slug=team_slug)
-        set_team_membership_from_yaml(gh, gh_team, input_team_membership)
+        gh_team = org_context.get_team(team_slug)
+        if not gh_team:
+            print(f"[WARNING] Team Slug '{team_slug}' not found in GitHub Org: {ORG_NAME}")
+            return
+        set_team_membership_from_yaml(gh, gh_team, input_team_membership, journal)
     else: 
         print(f"Fatal Error: Team loaded '{team_slug}' does not have type=team in yaml input file '{input_file}'" )
         print("Verify input data is a valid team structure." )
@@ -85,20 +150,18 @@ def process_team_memberships(input_data:dict, team_slug:str)->None:
 
 
 def update_team_description(input_data:dict, team_slug:str)->None:
-    try:
-        gh_team = gh.get_organization(ORG_NAME).get_team_by_slug(slug=team_slug)
-    except github.GithubException as ex:
-        template = "An GitHub exception of type {0} occurred. Arguments:\n{1!r}"
-        message = template.format(type(ex).__name__, ex.args)
-        print (message)
+    gh_team = org_context.get_team(team_slug)
+    if not gh_team:
+        print(f"[WARNING] Team Slug '{team_slug}' not found in GitHub Org: {ORG_NAME}")
         return
 
     try:
         new_description = input_data[team_slug]['description']
         old_description = gh_team.description
         if old_description != new_description:
-            gh_team.edit(name= gh_team.name, description=new_description)
-            print(f'[CHANGED] Updated team description Team: {gh_team.slug}')
+            if journaled_change(journal, {'op': 'team_description', 'team': gh_team.slug, 'name': gh_team.name, 'description': new_description},
+                                lambda: gh_team.edit(name= gh_team.name, description=new_description) or True):
+                print(f'[CHANGED] Updated team description Team: {gh_team.slug}')
 
     except KeyError:
         print("[UNCHANGED][WARNING] Team Description field not found in imported team structure.")
@@ -111,32 +174,88 @@ def update_team_description(input_data:dict, team_slug:str)->None:
         return
 
 
-def process_org_memberships(gh:github.Github, input_data:dict, org_name:str=ORG_NAME):
+def process_team(input_data:dict, team_slug:str)->None:
+    '''
+    Update the description and members of a team.
+    With --resume a team whose changes were all made by an earlier run is skipped without looking it up again.
+    '''
+    scope = f'team:{team_slug}'
+    if journal and journal.is_complete(scope):
+        print(f'[UNCHANGED] Team: {team_slug} was done by an earlier run')
+        return
+    failed = journal.failed if journal else 0
+    update_team_description(input_data, team_slug)
+    process_team_memberships(input_data, team_slug)
+    if journal and journal.failed == failed:
+        journal.complete(scope)
+
+
+def process_org_memberships(gh:github.Github, input_data:dict, context:OrgContext):
+    scope = f'org:{context.org.login}'
+    if journal and journal.is_complete(scope):
+        print(f'[UNCHANGED] Membership of GitHub Org: {context.org.login} was done by an earlier run')
+        return
+    failed = journal.failed if journal else 0
+    set_org_membership_from_yaml(gh, context.org, input_data, journal)
+    if journal and journal.failed == failed:
+        journal.complete(scope)
+
+
+# The org and its teams are looked up once for the whole run.
+# apply makes its own for each worker.
+org_context = None
+if command != 'apply':
     try:
-        org = gh.get_organization(org_name)
+        org_context = OrgContext(gh, ORG_NAME)
     except UnknownObjectException as ex:
         template = "A GitHub exception of type {0} occurred. Arguments:\n{1!r}"
         message = template.format(type(ex).__name__, ex.args)
         print (message)
-        return False        
-    else:
-        set_org_membership_from_yaml(gh, org, input_data)   
+        exit()
 
+if not command and (team_slug or org_members): # Changes are made as they are found
+    journal = start_journal({'command': None, 'org': ORG_NAME, 'file': input_file, 'teamslug': team_slug, 'members': org_members})
+
+if command == 'plan': # Discover once and write every change to the plan file. Nothing is changed in GitHub.
+    plan = build_plan(org_context, input_data, team_slug, org_members, input_file)
+    for action in plan['actions']:
+        print(f'[PLAN] {describe_action(action)}')
+    save_plan(plan, plan_file)
+    print(f"[INFO] {len(plan['actions'])} changes planned for GitHub Org: {plan['org']}. Written to plan file: {plan_file}")
+
+elif command == 'apply': # Make the changes from the plan file
+    try:
+        plan = load_plan(plan_file)
+    except Exception as err:
+        print(err)
+        exit()
+    if ORG_NAME and ORG_NAME != plan['org']:
+        print(f"Exiting: Plan file '{plan_file}' is for GitHub Org: {plan['org']} not {ORG_NAME}")
+        exit()
+    journal = start_journal({'command': 'apply', 'org': plan['org'], 'plan_created_at': plan['created_at']})
+    results = apply_plan(plan, new_github_client, workers, journal)
+    skipped = f" Already done: {results['skipped']}" if journal else ''
+    print(f"[INFO] Changes made: {results['changed']} Failed: {results['failed']}{skipped} in GitHub Org: {plan['org']}")
 
 #Process Teams 
-if team_slug and team_slug == 'all': # arg --team all
+elif team_slug and team_slug == 'all': # arg --team all
    for team_slug, team_data in input_data.items():
-        update_team_description(input_data, team_slug)
-        process_team_memberships(input_data, team_slug)
+        process_team(input_data, team_slug)
         
 elif team_slug: # arg --team teamslug
-    update_team_description(input_data, team_slug)
-    process_team_memberships(input_data, team_slug)
+    process_team(input_data, team_slug)
 
 # Process Org Memberships
-if org_members: # arg -m or --members
-   process_org_memberships(gh, input_data, ORG_NAME)
+if org_members and not command: # arg -m or --members
+   process_org_memberships(gh, input_data, org_context)
+
+if journal and journal.failed: # --resume tries the failed changes again
+    journal.close()
+    print(f'[INFO] {journal.failed} changes failed. Journal kept in {journal_file}. Run again with --resume to retry them')
+elif journal:
+    journal.finish()
    
     
 # Close github connections after use
-gh.close()
\ No newline at end of file
+gh.close()
+transport.close()
\ No newline at end of file
@@ -0,0 +1,324 @@
+import os
+import json
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from common import *
+from checkpoint import *
+
+PLAN_VERSION = 1
+DEFAULT_PLAN_FILE = 'modify.plan.json'
+DEFAULT_APPLY_JOURNAL_FILE = 'modify.journal'
+
+# Actions are applied phase by phase. Team changes go first the same way modify.py always ran them,
+# then org membership changes, which can drop a login from every team at once.
+TEAM_ACTIONS = ['team_description', 'team_remove', 'team_role', 'team_add']
+ORG_ACTIONS = ['org_invite', 'org_convert', 'org_remove', 'org_remove_collab']
+APPLY_PHASES = [TEAM_ACTIONS, ORG_ACTIONS]
+
+
+def describe_action(action:dict)-> str:
+    ''' One line description of a plan action for plan output and apply logs '''
+    op = action['op']
+    if op == 'team_description':
+        return f"Update description of Team: {action['team']}"
+    elif op == 'team_add':
+        return f"Add Login: {action['login']} to Team: {action['team']} with Role: {action['role']}"
+    elif op == 'team_role':
+        return f"Change Role of Login: {action['login']} in Team: {action['team']} from {action['old_role']} to {action['role']}"
+    elif op == 'team_remove':
+        return f"Remove Login: {action['login']} from Team: {action['team']}"
+    elif op == 'org_invite':
+        return f"Invite Login: {action['login']} to GitHub Org"
+    elif op == 'org_convert':
+        return f"Convert Login: {action['login']} to outside collaborator"
+    elif op == 'org_remove':
+        return f"Remove Login: {action['login']} from GitHub Org"
+    elif op == 'org_remove_collab':
+        return f"Remove Login: {action['login']} as Outside Collaborator"
+    return f'Unknown action {op}'
+
+
+def plan_team_changes(current_team:TeamObject, input_team:dict)-> list:
+    '''
+    Work out the changes that make a team match its structure from an input file.
+    A login that stays in the team with a different role gets one team_role action rather than a remove and an add.
+    ---
+    current_team:TeamObject = The team as it is now in GitHub, ie. from discover_team
+    input_team:dict = Team structure loaded from an input file, ie. input_data[team_slug]
+    '''
+    actions = []
+    team_slug = current_team.slug
+    # Exported structures hold str(description), so a team with no description reads back as 'None'
+    if 'description' in input_team and str(input_team['description']) != str(current_team.description):
+        actions.append({'op': 'team_description', 'team': team_slug, 'name': current_team.name, 'description': input_team['description']})
+
+    diff = RoleDiff(current_team.members, input_team.get('members'))
+    for login in sorted_logins(diff.removed):
+        actions.append({'op': 'team_remove', 'team': team_slug, 'login': login, 'old_role': diff.removed[login]})
+    for login in sorted_logins(diff.desired):
+        if login in diff.added:
+            actions.append({'op': 'team_add', 'team': team_slug, 'login': login, 'role': diff.added[login]})
+        elif login in diff.changed:
+            old_role, role = diff.changed[login]
+            actions.append({'op': 'team_role', 'team': team_slug, 'login': login, 'role': role, 'old_role': old_role})
+    return actions
+
+
+def plan_org_changes(current_org:OrgObject, input_org:dict)-> list:
+    '''
+    Work out the changes that make the org membership match its structure from an input file.
+    Same rules as set_org_membership_from_yaml, including removing members missing from the input.
+    ---
+    current_org:OrgObject = The org as it is now in GitHub, ie. from discover_org
+    input_org:dict = Org structure loaded from an input file, ie. input_data[org.login]
+    '''
+    diff = OrgMembershipDiff(current_org.members_list, current_org.outside_collaborators, current_org.invitations,
+                             input_org.get('members'), input_org.get('collaborators'))
+    for login in sorted_logins(diff.pending):
+        print(f'[UNCHANGED] Login: {login} has pending invite to GitHub Org: {current_org.login}')
+    actions = []
+    for op, logins in (('org_invite', diff.invite), ('org_convert', diff.convert), ('org_remove', diff.remove), ('org_remove_collab', diff.remove_collab)):
+        actions.extend({'op': op, 'login': login} for login in sorted_logins(logins))
+    return actions
+
+
+def build_plan(context:OrgContext, input_data:dict, team_slug:str = None, org_members:bool = False, input_file:str = None)-> dict:
+    '''
+    Discover the current state of the org once and return every change needed to match input_data, without changing anything.
+    Teams are found with a single listing of the org's teams rather than a lookup per slug.
+    ---
+    context:OrgContext = Cached org lookups for this run
+    input_data:dict = Structures loaded from the input file
+    team_slug:str = Team to plan for, or 'all' for every team in input_data. None to skip teams.
+    org_members:bool = Plan org membership changes from the org structure in input_data
+    input_file:str = Name of the input file. Recorded in the plan for reference.
+    '''
+    org = context.org
+    actions = []
+    if team_slug:
+        if team_slug == 'all':
+            slugs = [slug for slug, data in input_data.items() if isinstance(data, dict) and data.get('type') == 'team']
+        else:
+            slugs = [team_slug]
+        for slug in slugs:
+            if not isinstance(input_data.get(slug), dict) or input_data[slug].get('type') != 'team':
+                print(f"[WARNING] Team Slug '{slug}' not found with type=team in input file '{input_file}'")
+                continue
+            team = context.get_team(slug)
+            if not team:
+                print(f"[WARNING] Team Slug '{slug}' not found in GitHub Org: {org.login}. Create the team first.")
+                continue
+            actions.extend(plan_team_changes(discover_team(team), input_data[slug]))
+
+    if org_members:
+        if org.login in input_data:
+            actions.extend(plan_org_changes(discover_org(org), input_data[org.login]))
+        else:
+            print(f"[WARNING] Org: {org.login} not found in input file '{input_file}'")
+
+    return {
+        'version': PLAN_VERSION,
+        'org': org.login,
+        'input_file': input_file,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'actions': actions,
+    }
+
+
+def save_plan(plan:dict, plan_file:str)-> None:
+    tmp_file = f'{plan_file}.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(plan, file, indent=2)
+    os.replace(tmp_file, plan_file)
+
+
+def load_plan(plan_file:str)-> dict:
+    with open(plan_file, 'r') as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Plan file '{plan_file}' has version {plan.get('version')}, expected {PLAN_VERSION}")
+    return plan
+
+
+def action_key(action:dict)-> str:
+    ''' The same change always gets the same key, whatever order its fields are in '''
+    return json.dumps(action, sort_keys=True)
+
+
+class ApplyJournal(JsonLinesJournal):
+    '''
+    Write-ahead journal of the changes modify.py makes, so a run stopped part way, ie. by a rate limit, can be resumed.
+    Changes are plan actions. Each one is journaled as pending before it is sent and as done or failed once GitHub answers.
+    A resumed run skips the changes the journal has as done without asking GitHub about them again.
+    A change left pending by the last run is sent again. Every change is a PUT, PATCH or DELETE that is safe to repeat.
+    A team or the org membership whose changes were all made is journaled as complete and not looked up again at all.
+        {"run": {options}}          First line. What the run changes.
+        {"pending": action}         About to be sent
+        {"done": action}            GitHub confirmed the change
+        {"failed": action}          The change was refused or could not be sent
+        {"complete": "team:slug"}   Every change of the team or of "org:login" is done
+    ---
+    journal_file:str = File to write the journal to
+    options:dict = Options of the run, ie. {'org': 'my-org', 'file': 'teams.yml', 'teamslug': 'all'}
+    resume:bool = Load the journal in journal_file and append to it. Otherwise any old journal is replaced.
+
+    Example:
+    ```
+    journal = ApplyJournal('modify.journal', {'org': 'my-org'}, resume=True)
+    journal.apply({'op': 'team_add', 'team': 'team-awesome', 'login': 'DevDude76', 'role': 'member'},
+                  lambda: team.add_membership(lazy_user(gh, 'DevDude76'), 'member') or True)
+    ```
+    '''
+    def __init__(self, journal_file:str, options:dict, resume:bool = False) -> None:
+        self.done = set() # action keys
+        self.completed = set() # scopes, ie. team:team-awesome
+        self.failed = 0 # Changes that failed during this run
+        super().__init__(journal_file, options, resume)
+
+    def load_record(self, record:dict) -> None:
+        if 'done' in record:
+            self.done.add(action_key(record['done']))
+        elif 'complete' in record:
+            self.completed.add(record['complete'])
+
+    def confirmed(self, action:dict)-> bool:
+        return action_key(action) in self.done
+
+    def apply(self, action:dict, change)-> bool:
+        '''
+        Make one change through the journal. Returns True if it was made now, None if an earlier run made it
+        so callers don't report it as changed again, and False if it was not made.
+        ---
+        action:dict = The change as a plan action, ie. {'op': 'team_remove', 'team': 'team-awesome', 'login': 'Dev1'}
+        change = Callable making the change. Returns True when it was made. Exceptions are journaled as failed and raised again.
+        '''
+        if self.confirmed(action):
+            print(f'[UNCHANGED] Already done by an earlier run: {describe_action(action)}')
+            return None
+        self._append({'pending': action})
+        try:
+            changed = change()
+        except Exception:
+            self._record_failed(action)
+            raise
+        if changed:
+            with self.lock:
+                self.done.add(action_key(action))
+            self._append({'done': action})
+        else:
+            self._record_failed(action)
+        return changed
+
+    def _record_failed(self, action:dict)-> None:
+        with self.lock:
+            self.failed += 1
+        self._append({'failed': action})
+
+    def is_complete(self, scope:str)-> bool:
+        return scope in self.completed
+
+    def complete(self, scope:str)-> None:
+        ''' Every change of scope is done, ie. 'team:team-awesome' or 'org:my-org' '''
+        with self.lock:
+            self.completed.add(scope)
+        self._append({'complete': scope})
+
+
+def apply_action(context:OrgContext, action:dict)-> bool:
+    '''
+    Make the change described by one plan action. Returns True if it was made.
+    ---
+    context:OrgContext = Cached org lookups of this worker
+    action:dict = One action from a plan
+    '''
+    gh = context.gh
+    org = context.org
+    op = action['op']
+    try:
+        if op in TEAM_ACTIONS:
+            team = context.get_team(action['team'])
+            if not team:
+                print(f"[UNCHANGED] GitHub reports the provided team was not found: {action['team']}")
+                return False
+            if op == 'team_description':
+                team.edit(name=action['name'], description=action['description'])
+                return True
+            # The plan already knows the login's role in the team, so only the change itself is sent
+            elif op == 'team_remove':
+                return update_team_membership(gh, team, action['login'], 'del', current_members={action['login']: action.get('old_role')})
+            else: # team_add and team_role. Adding an existing member sets the new role.
+                return update_team_membership(gh, team, action['login'], 'add', role=action['role'], current_members={action['login']: action.get('old_role')} if op == 'team_role' else {})
+
+        if op not in ORG_ACTIONS:
+            print(f'[WARNING] Unknown plan action: {op}')
+            return False
+        user_obj = lazy_user(gh, action['login']) # A login that does not exist fails on the change with UnknownObjectException
+        if op == 'org_invite':
+            org.add_to_members(member=user_obj, role='member')
+        elif op == 'org_convert':
+            org.convert_to_outside_collaborator(user_obj)
+        elif op == 'org_remove':
+            org.remove_from_membership(user_obj)
+        elif op == 'org_remove_collab':
+            org.remove_outside_collaborator(user_obj)
+        return True
+    except UnknownObjectException:
+        print(f"[UNCHANGED] GitHub reports the provided login or team was not found: {action.get('login') or action.get('team')}")
+        return False
+    except github.GithubException as err:
+        print(err)
+        return False
+
+
+def apply_plan(plan:dict, client_factory, workers:int = 4, journal:ApplyJournal = None)-> dict:
+    '''
+    Make every change in a plan over a bounded pool of worker threads.
+    Each phase in APPLY_PHASES finishes before the next one starts. One failed action does not stop the rest.
+    Writes are still spaced out by the rate limit scheduler, so the gain is in overlapping lookups and round trips.
+    Returns the number of actions {'changed': int, 'failed': int, 'skipped': int}
+    ---
+    plan:dict = Plan from build_plan or load_plan
+    client_factory = callable returning a new authenticated github.Github instance. Every worker thread gets a client of its own.
+    workers:int = Max number of actions applied at the same time.
+    journal:ApplyJournal = Optional. Every action is journaled, and actions an earlier run made are skipped without calling GitHub.
+    '''
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+    results = {'changed': 0, 'failed': 0, 'skipped': 0}
+
+    def apply(action:dict)-> bool:
+        if journal and journal.confirmed(action):
+            print(f'[UNCHANGED] Already done by an earlier run: {describe_action(action)}')
+            return None
+        if not hasattr(local, 'gh'):
+            local.gh = client_factory()
+            with clients_lock:
+                clients.append(local.gh)
+        try:
+            if not hasattr(local, 'context'):
+                local.context = OrgContext(local.gh, plan['org'])
+            if journal:
+                changed = journal.apply(action, lambda: apply_action(local.context, action))
+            else:
+                changed = apply_action(local.context, action)
+        except Exception as err: # ie. connection errors. Count it as failed and carry on with the rest of the plan.
+            print(f'[WARNING] {type(err).__name__}: {err}')
+            changed = False
+        if changed:
+            print(f'[CHANGED] {describe_action(action)}')
+            return True
+        print(f'[WARNING] Something prevented: {describe_action(action)}')
+        return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for phase in APPLY_PHASES:
+                actions = [action for action in plan['actions'] if action['op'] in phase]
+                for changed in executor.map(apply, actions):
+                    results['skipped' if changed is None else 'changed' if changed else 'failed'] += 1
+    finally:
+        for client in clients:
+            client.close()
+    return results
@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import json
+import functools
+import threading
+import contextvars
+from urllib.parse import urlparse
+
+# Path segments that are names or ids are replaced so calls to the same endpoint are counted together.
+# Applied in order to the URL path.
+ENDPOINT_PATTERNS = [
+    (re.compile(r'^/api/v3'), ''), # GitHub Enterprise Server prefix
+    (re.compile(r'^/repos/[^/]+/[^/]+'), '/repos/{owner}/{repo}'),
+    (re.compile(r'^/organizations/\d+/team/\d+'), '/organizations/{org_id}/team/{team_id}'),
+    (re.compile(r'^/orgs/[^/]+'), '/orgs/{org}'),
+    (re.compile(r'^/teams/\d+'), '/teams/{team_id}'),
+    (re.compile(r'^/users/[^/]+'), '/users/{login}'),
+    (re.compile(r'^(/orgs/\{org\}/teams)/[^/]+'), r'\1/{slug}'),
+    (re.compile(r'/(members|memberships|collaborators|outside_collaborators|public_members)/[^/]+'), r'/\1/{login}'),
+    (re.compile(r'/(branches|git/refs/heads)/.+$'), r'/\1/{ref}'), # Branch names can hold slashes
+    (re.compile(r'/commits/[^/]+'), '/commits/{ref}'),
+    (re.compile(r'/(invitations|hooks)/\d+'), r'/\1/{id}'),
+]
+# Files whose functions send requests on behalf of others. Calls are blamed on the code that called them.
+# None means every function in the file, otherwise a set of function names.
+PLUMBING = {
+    'profiler.py': None,
+    'transport.py': None,
+    'ratelimit.py': None,
+    'graphql_discovery.py': {'query', 'paginate'},
+}
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Calling function set by @profiled. asyncio tasks copy it when they are created, so requests made by
+# tasks that a coroutine gathers are blamed on that coroutine. Its stack ends at the event loop.
+CALLER = contextvars.ContextVar('profiler_caller', default=None)
+
+
+def profiled(coroutine_function):
+    ''' Decorator blaming the requests of an async function, and of the tasks it starts, on that function '''
+    @functools.wraps(coroutine_function)
+    async def wrapper(*args, **kwargs):
+        token = CALLER.set(coroutine_function.__qualname__)
+        try:
+            return await coroutine_function(*args, **kwargs)
+        finally:
+            CALLER.reset(token)
+    return wrapper
+
+
+def endpoint_template(verb:str, url:str)-> str:
+    '''
+    Endpoint of a request with names and ids replaced, ie. GET /repos/{owner}/{repo}/collaborators
+    ---
+    verb:str = HTTP method
+    url:str = Full request URL. The query string is dropped.
+    '''
+    path = urlparse(url).path.rstrip('/') or '/'
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return f'{verb} {path}'
+
+
+def calling_function(frame = None)-> str:
+    '''
+    Name of the innermost function of this repo on the calling thread's stack, skipping PLUMBING,
+    ie. discover_repository or OrgContext.get_team. Module level code is named after its file.
+    Inside a @profiled coroutine its name is used instead.
+    '''
+    if CALLER.get():
+        return CALLER.get()
+    frame = frame or sys._getframe(1)
+    while frame:
+        code = frame.f_code
+        if os.path.dirname(os.path.abspath(code.co_filename)) == PACKAGE_DIR:
+            file_name = os.path.basename(code.co_filename)
+            skipped = PLUMBING.get(file_name, set())
+            if skipped is not None and code.co_name not in skipped:
+                if code.co_name == '<module>':
+                    return file_name
+                return getattr(code, 'co_qualname', code.co_name).replace('.<locals>', '')
+        frame = frame.f_back
+    return 'unknown'
+
+
+class CallStats:
+    '''
+    Counters for a group of API requests
+    '''
+    FIELDS = ['calls', 'not_modified', 'errors', 'cost', 'bytes_sent', 'bytes_received', 'seconds', 'max_seconds', 'wait_seconds']
+
+    def __init__(self) -> None:
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, other:"CallStats")-> None:
+        for field in self.FIELDS:
+            if field == 'max_seconds':
+                self.max_seconds = max(self.max_seconds, other.max_seconds)
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def to_dict(self)-> dict:
+        stats = {field: getattr(self, field) for field in self.FIELDS}
+        for field in ('seconds', 'max_seconds', 'wait_seconds'):
+            stats[field] = round(stats[field], 4)
+        stats['avg_ms'] = round(self.seconds / self.calls * 1000, 1) if self.calls else 0.0
+        return stats
+
+
+class ApiProfiler:
+    '''
+    Counts API requests, bytes, latency and rate limit cost per endpoint and per calling function.
+    Safe to share between threads. The Transport and GraphQLClient record every request they send,
+    including retries, when given a profiler.
+
+    Rate limit cost is 1 per request except 304 Not Modified, which GitHub does not count.
+    GraphQL queries are counted the same way, though GitHub charges them by complexity,
+    so the remaining budget reported in X-RateLimit-Remaining at the first and last response is kept per resource as well.
+    ---
+    Example:
+    ```
+    profiler = ApiProfiler()
+    transport = Transport(cache=cache, scheduler=scheduler, profiler=profiler)
+    ...
+    profiler.report()              # Table on stderr
+    profiler.save('profile.json')  # Or as json
+    ```
+    '''
+    def __init__(self) -> None:
+        self.stats = {} # (function, endpoint) -> CallStats
+        self.rate_limits = {} # resource -> {'limit', 'first_remaining', 'last_remaining', 'reset'}
+        self.lock = threading.Lock()
+
+    def record(self, verb:str, url:str, status:int, headers, bytes_sent:int, bytes_received:int, seconds:float, wait_seconds:float = 0.0, function:str = None)-> None:
+        '''
+        Record one request
+        ---
+        verb:str, url:str = The request
+        status:int = Response status, or 0 if no response was received
+        headers = Response headers, any mapping
+        bytes_sent:int, bytes_received:int = Request and response body sizes
+        seconds:float = Time from sending the request to having the response
+        wait_seconds:float = Time the request was held back by the rate limit scheduler
+        function:str = Calling function. Found from the stack when not set.
+        '''
+        function = function or calling_function(sys._getframe(1))
+        key = (function, endpoint_template(verb, url))
+        headers = {str(name).lower(): value for name, value in (headers or {}).items()}
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = CallStats()
+            stats.calls += 1
+            stats.not_modified += status == 304
+            stats.errors += status == 0 or status >= 400
+            stats.cost += status != 304
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.wait_seconds += wait_seconds
+            if 'x-ratelimit-remaining' in headers:
+                resource = headers.get('x-ratelimit-resource', 'core')
+                remaining = int(float(headers['x-ratelimit-remaining']))
+                limit = self.rate_limits.setdefault(resource, {
+                    'limit': int(float(headers.get('x-ratelimit-limit', 0))),
+                    'first_remaining': remaining + (status != 304), # Budget before this request
+                    'reset': headers.get('x-ratelimit-reset'),
+                })
+                limit['last_remaining'] = remaining
+                if limit['reset'] != headers.get('x-ratelimit-reset'):
+                    limit['windows'] = limit.get('windows', 1) + 1 # Budget was refilled during the run
+                    limit['reset'] = headers.get('x-ratelimit-reset')
+
+    def group(self, by:str)-> dict:
+        ''' Stats summed per 'function' or per 'endpoint', largest cost first '''
+        index = 0 if by == 'function' else 1
+        groups = {}
+        with self.lock:
+            for key, stats in self.stats.items():
+                groups.setdefault(key[index], CallStats()).add(stats)
+        return dict(sorted(groups.items(), key=lambda item: (-item[1].cost, -item[1].calls, item[0])))
+
+    def totals(self)-> CallStats:
+        totals = CallStats()
+        with self.lock:
+            for stats in self.stats.values():
+                totals.add(stats)
+        return totals
+
+    def summary(self)-> dict:
+        ''' Everything recorded as a json friendly dict '''
+        with self.lock:
+            calls = {}
+            for (function, endpoint), stats in sorted(self.stats.items()):
+                calls.setdefault(function, {})[endpoint] = stats.calls
+            rate_limits = {resource: dict(limit) for resource, limit in self.rate_limits.items()}
+        return {
+            'totals': self.totals().to_dict(),
+            'rate_limits': rate_limits,
+            'functions': {name: stats.to_dict() for name, stats in self.group('function').items()},
+            'endpoints': {name: stats.to_dict() for name, stats in self.group('endpoint').items()},
+            'calls': calls, # function -> {endpoint: calls}
+        }
+
+    def save(self, profile_file:str)-> None:
+        with open(profile_file, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def report(self, file = None, top:int = 20)-> None:
+        ''' Print summary tables to file, default stderr so yaml on stdout stays valid '''
+        file = file or sys.stderr
+        totals = self.totals()
+        print(f'[PROFILE] {totals.calls} API calls, rate limit cost {totals.cost}, {totals.not_modified} not modified, {totals.errors} errors, '
+              f'{totals.bytes_received / 1048576:.1f} MB received, {totals.seconds:.1f}s in requests, {totals.wait_seconds:.1f}s waiting for the rate limit', file=file)
+        for resource, limit in sorted(self.rate_limits.items()):
+            used = '' if limit.get('windows') else f", {limit['first_remaining'] - limit['last_remaining']} used during the run"
+            print(f"[PROFILE] Rate limit {resource}: {limit['last_remaining']} of {limit['limit']} remaining{used}", file=file)
+        for by in ('function', 'endpoint'):
+            groups = list(self.group(by).items())
+            width = min(max([len(by)] + [len(name) for name, stats in groups]), 80) + 2
+            print(f"{by:<{width}}{'calls':>7}{'cost':>7}{'304s':>6}{'errors':>7}{'MB in':>8}{'avg ms':>8}{'max ms':>8}{'wait s':>8}", file=file)
+            for name, stats in groups[:top]:
+                print(f'{name[:width - 2]:<{width}}{stats.calls:>7}{stats.cost:>7}{stats.not_modified:>6}{stats.errors:>7}{stats.bytes_received / 1048576:>8.2f}'
+                      f'{stats.seconds / stats.calls * 1000:>8.1f}{stats.max_seconds * 1000:>8.1f}{stats.wait_seconds:>8.1f}', file=file)
+            if len(groups) > top:
+                print(f'... {len(groups) - top} more. Save as json with --profile FILE for everything', file=file)
@@ -0,0 +1,93 @@
+import os
+import sys
+import argparse
+
+from common import *
+from snapshot_store import *
+from access import *
+
+parser = argparse.ArgumentParser(
+                    prog=os.path.basename(sys.argv[0]),
+                    description='Answer access questions from the snapshots saved by "discovery.py --db" without calling the GitHub API',
+                    epilog='Queries read the latest discovered state of each repo and team unless --snapshot is set.')
+
+parser.add_argument('--db', default=DEFAULT_DB_FILE, metavar='DB_FILE', help=f'SQLite snapshot database written by discovery.py --db. Default is {DEFAULT_DB_FILE}')
+parser.add_argument('-s','--snapshot', type=int, help='Query the state as of this snapshot id instead of the latest. See the snapshots command')
+parser.add_argument('-o','--org', help='Org to query. Needed when the database holds several, except by the snapshots and export commands')
+commands = parser.add_subparsers(dest='command', required=True)
+
+commands.add_parser('snapshots', help='List saved snapshots')
+
+user_repos = commands.add_parser('user-repos', help='Repos a login can access directly or through a team, including access inherited from parent teams')
+user_repos.add_argument('login', help='GitHub login')
+user_repos.add_argument('-r','--role', help='Only repos where the login has at least this role, ie. write also lists maintain and admin')
+
+user_teams = commands.add_parser('user-teams', help='Teams a login belongs to')
+user_teams.add_argument('login', help='GitHub login')
+
+repo_teams = commands.add_parser('repo-teams', help='Teams with access to a repo')
+repo_teams.add_argument('repo', help='Name of repository')
+repo_teams.add_argument('-r','--role', help='Only teams granting at least this role, ie. admin')
+
+repo_users = commands.add_parser('repo-users', help='Logins that can access a repo directly or through a team, including child teams of teams granted access')
+repo_users.add_argument('repo', help='Name of repository')
+repo_users.add_argument('-r','--role', help='Only logins with at least this role, ie. write also lists maintain and admin')
+
+access = commands.add_parser('access', help='Write the effective access of every login as {login: {role: [repos]}}')
+access.add_argument('-f','--file', nargs='?', const='stdout.yml', help='File name to write output')
+access.add_argument('--format', choices=OUTPUT_FORMATS, default='yaml', help='Output format. yaml, json or ndjson. Default is yaml')
+
+export = commands.add_parser('export', help='Write the stored repos, teams and org membership in the same format as discovery.py')
+export.add_argument('-f','--file', nargs='?', const='stdout.yml', help='File name to write output')
+export.add_argument('--format', choices=OUTPUT_FORMATS, default='yaml', help='Output format. yaml, json or ndjson. Default is yaml')
+args = parser.parse_args()
+
+if not os.path.exists(args.db):
+    print(f"Exiting: Snapshot database '{args.db}' not found. Create it with discovery.py --db")
+    exit()
+
+store = SnapshotStore(args.db)
+# Repos and teams of different orgs can share names, so lookups are made for one org at a time
+if args.command not in ('snapshots', 'export') and not args.org and len(store.orgs()) > 1:
+    print(f"Exiting: {args.db} holds several orgs: {', '.join(store.orgs())}. Choose one with --org")
+    exit()
+
+
+if args.command == 'snapshots':
+    for snapshot in store.snapshots():
+        scope = ' '.join(scope for scope in ('all_repos', 'all_teams') if snapshot[scope])
+        print(f"{snapshot['id']}\t{snapshot['org']}\t{snapshot['started_at']}\t{snapshot['finished_at'] or 'unfinished'}\t{scope}")
+
+elif args.command == 'user-repos':
+    print(dump_yaml({args.login: by_role(store.repos_for_login(args.login, args.role, args.snapshot, args.org))}), end='')
+
+elif args.command == 'user-teams':
+    print(dump_yaml({args.login: by_role(store.teams_for_login(args.login, args.snapshot, args.org))}), end='')
+
+elif args.command == 'repo-teams':
+    print(dump_yaml({args.repo: by_role(store.teams_for_repo(args.repo, args.role, args.snapshot, args.org))}), end='')
+
+elif args.command == 'repo-users':
+    index = AccessIndex(store.structures(args.snapshot, args.org))
+    users = index.repo_access(args.repo)
+    if args.role:
+        allowed = roles_at_least(args.role)
+        users = {login: role for login, role in users.items() if role in allowed}
+    print(dump_yaml({args.repo: by_role(users)}), end='')
+
+elif args.command == 'access':
+    index = AccessIndex(store.structures(args.snapshot, args.org))
+    if index.missing_teams:
+        print(f'[WARNING] Members unknown for {len(index.missing_teams)} teams with repo access. Discover them with discovery.py -t all --db', file=sys.stderr)
+    writer = OutputWriter(args.file, args.format)
+    for structure in index.export():
+        writer.write(structure)
+    writer.close()
+
+elif args.command == 'export':
+    writer = OutputWriter(args.file, args.format)
+    for structure in store.structures(args.snapshot, args.org):
+        writer.write(structure)
+    writer.close()
+
+store.close()
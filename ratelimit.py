@@ -0,0 +1,151 @@
+import time
+import threading
+
+SECONDARY_RATE_WAIT = 60 # GitHub asks clients to wait at least a minute after a secondary rate limit with no Retry-After
+MAX_BACKOFF = 10.0 # Max seconds between requests after repeated secondary rate limits
+
+
+def rate_limit_resource(url:str) -> str:
+    ''' Best guess of the rate limit resource a request counts against before the response tells us '''
+    if '/graphql' in url:
+        return 'graphql'
+    elif '/search/' in url:
+        return 'search'
+    return 'core'
+
+
+class RateLimitBudget:
+    '''
+    What we know about one rate limit resource ie. core, graphql or search.
+    '''
+    def __init__(self) -> None:
+        self.limit: int = None
+        self.remaining: int = None # None until a response tells us or after the window resets
+        self.reset: float = 0.0 # Epoch time the window resets
+        self.tokens: float = 1.0
+        self.updated: float = time.time()
+        self.last_start: float = 0.0
+
+
+class RateLimitScheduler:
+    '''
+    Paces every GitHub API call made by the process so long crawls use the rate limit budget
+    as fast as it allows instead of failing part way with 403s.
+    Safe to share between threads. One instance is shared by all Github clients through the Transport,
+    and by the GraphQL client.
+
+    - X-RateLimit-Remaining / X-RateLimit-Reset of each response keep the budget for its resource up to date.
+      Requests we have sent but not had an answer for yet are counted too, so concurrent workers don't overshoot.
+    - While plenty of budget is left requests are not delayed. Once remaining drops to the reserve,
+      a token bucket spreads what is left evenly over the time until the window resets.
+      At zero, requests wait for the reset.
+    - Retry-After and secondary rate limits pause the resource for every worker, and widen the minimum gap
+      between requests. The gap shrinks again with each successful response.
+    - Writes are spaced write_interval seconds apart as GitHub recommends for mutating requests.
+    ---
+    reserve_fraction:float = Fraction of the limit held back before pacing starts
+    burst:int = Requests that may be sent back to back while pacing
+    write_interval:float = Min seconds between write requests, shared by all workers
+
+    Example:
+    ```
+    scheduler = RateLimitScheduler()
+    time.sleep(scheduler.reserve('core'))
+    response = session.get(url)
+    retry_after = scheduler.update('core', response.status_code, response.headers, response.text)
+    ```
+    '''
+    def __init__(self, reserve_fraction:float = 0.1, burst:int = 10, write_interval:float = 1.0) -> None:
+        self.reserve_fraction = reserve_fraction
+        self.burst = burst
+        self.write_interval = write_interval
+        self.budgets = {}
+        self.paused_until = {}
+        self.backoff = 0.0
+        self.last_write = 0.0
+        self.lock = threading.Lock()
+
+    def _budget(self, resource:str) -> RateLimitBudget:
+        if resource not in self.budgets:
+            self.budgets[resource] = RateLimitBudget()
+        return self.budgets[resource]
+
+    def reserve(self, resource:str = 'core', write:bool = False) -> float:
+        '''
+        Claim a slot for one request and return the seconds to wait before sending it.
+        Never blocks so it can be used from threads and from asyncio code alike.
+        '''
+        with self.lock:
+            now = time.time()
+            budget = self._budget(resource)
+            start = max(now, self.paused_until.get(resource, 0.0))
+            if write:
+                start = max(start, self.last_write + self.write_interval)
+                self.last_write = start
+            if budget.remaining is not None and now >= budget.reset:
+                budget.remaining = None # New window. Wait for the next response to tell us the budget.
+            if budget.remaining is not None:
+                if budget.remaining <= 0: # Stays exhausted so every worker waits for the reset, not just this one
+                    start = max(start, budget.reset + 1)
+                elif budget.remaining > budget.limit * self.reserve_fraction:
+                    budget.tokens = self.burst
+                    budget.remaining -= 1
+                else:
+                    rate = budget.remaining / max(budget.reset - now, 1.0)
+                    budget.tokens = min(self.burst, budget.tokens + (now - budget.updated) * rate)
+                    budget.tokens -= 1
+                    if budget.tokens < 0: # Take a slot in the future
+                        start = max(start, now - budget.tokens / rate)
+                    budget.remaining -= 1
+                budget.updated = now
+            start = max(start, budget.last_start + self.backoff)
+            budget.last_start = start
+            return max(0.0, start - now)
+
+    def acquire(self, resource:str = 'core', write:bool = False) -> None:
+        ''' Block until a request may be sent '''
+        delay = self.reserve(resource, write)
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, resource:str, status:int, headers:dict, body:str = '') -> float:
+        '''
+        Record a response. Returns the seconds to wait before the request should be retried
+        if it hit a rate limit, otherwise None.
+        headers may be any mapping. Header names are matched case insensitively.
+        '''
+        headers = {str(key).lower(): value for key, value in headers.items()}
+        with self.lock:
+            now = time.time()
+            resource = headers.get('x-ratelimit-resource', resource)
+            budget = self._budget(resource)
+            remaining = None
+            if 'x-ratelimit-remaining' in headers and 'x-ratelimit-reset' in headers:
+                remaining = int(float(headers['x-ratelimit-remaining']))
+                reset = float(headers['x-ratelimit-reset'])
+                # Responses can arrive out of order and don't know about requests still in flight,
+                # so within the same window only ever lower our count.
+                if reset != budget.reset or budget.remaining is None or remaining < budget.remaining:
+                    budget.remaining = remaining
+                budget.reset = reset
+                budget.limit = int(float(headers.get('x-ratelimit-limit', remaining)))
+
+            if status not in (403, 429):
+                self.backoff = self.backoff * 0.9 if self.backoff > 0.05 else 0.0
+                return None
+
+            secondary = False
+            if 'retry-after' in headers:
+                delay = float(headers['retry-after'])
+                secondary = True
+            elif remaining == 0:
+                delay = max(budget.reset - now, 0.0) + 1
+            elif status == 429 or 'secondary rate limit' in (body or '').lower():
+                delay = SECONDARY_RATE_WAIT
+                secondary = True
+            else: # A plain 403 ie. missing permissions. Not ours to retry.
+                return None
+            if secondary:
+                self.backoff = min(max(self.backoff * 2, 1.0), MAX_BACKOFF)
+            self.paused_until[resource] = max(self.paused_until.get(resource, 0.0), now + delay)
+            return delay
@@ -0,0 +1,390 @@
+import sqlite3
+import datetime
+from common import *
+
+DEFAULT_DB_FILE = 'snapshots.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    org TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    all_repos INTEGER NOT NULL DEFAULT 0,
+    all_teams INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS repos (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    name TEXT NOT NULL,
+    description TEXT,
+    html_url TEXT,
+    PRIMARY KEY (name, snapshot_id)
+);
+CREATE TABLE IF NOT EXISTS repo_access (
+    snapshot_id INTEGER NOT NULL,
+    repo TEXT NOT NULL,
+    kind TEXT NOT NULL, -- direct_collabs, outside_collabs or teams
+    principal TEXT NOT NULL, -- login or team slug
+    role TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS repo_access_repo ON repo_access (repo, snapshot_id);
+CREATE INDEX IF NOT EXISTS repo_access_principal ON repo_access (principal, kind, snapshot_id);
+CREATE TABLE IF NOT EXISTS contributors (
+    snapshot_id INTEGER NOT NULL,
+    repo TEXT NOT NULL,
+    login TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contributors_repo ON contributors (repo, snapshot_id);
+CREATE TABLE IF NOT EXISTS teams (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    slug TEXT NOT NULL,
+    name TEXT,
+    description TEXT,
+    html_url TEXT,
+    id INTEGER,
+    parent_id INTEGER,
+    parent_name TEXT,
+    PRIMARY KEY (slug, snapshot_id)
+);
+CREATE TABLE IF NOT EXISTS team_members (
+    snapshot_id INTEGER NOT NULL,
+    team TEXT NOT NULL,
+    login TEXT NOT NULL,
+    role TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS team_members_team ON team_members (team, snapshot_id);
+CREATE INDEX IF NOT EXISTS team_members_login ON team_members (login, snapshot_id);
+CREATE TABLE IF NOT EXISTS orgs (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    login TEXT NOT NULL,
+    name TEXT,
+    description TEXT,
+    PRIMARY KEY (login, snapshot_id)
+);
+CREATE TABLE IF NOT EXISTS org_members (
+    snapshot_id INTEGER NOT NULL,
+    org TEXT NOT NULL,
+    kind TEXT NOT NULL, -- members, collaborators or pending_invites
+    login TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS org_members_org ON org_members (org, snapshot_id);
+CREATE INDEX IF NOT EXISTS org_members_login ON org_members (login, snapshot_id);
+CREATE TABLE IF NOT EXISTS removed (
+    snapshot_id INTEGER NOT NULL,
+    kind TEXT NOT NULL, -- repo or team
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS removed_name ON removed (name, kind, snapshot_id);
+'''
+
+
+def current_sql(table:str, key:str, snapshot:int = None)-> str:
+    '''
+    SQL for the (org, key, snapshot_id) rows of the latest state of each row in table, org by org.
+    The org of a row is the org of the snapshot it was found in.
+    A "--repo all" or "--team all" run of an org replaces everything before it for that org, so repos and teams deleted since drop out.
+    A repo or team seen deleted by a later snapshot of the same org, ie. an --audit-log run, drops out too.
+    With a snapshot id it is the state as of that snapshot instead.
+    '''
+    until = f' AND {{}}.id <= {int(snapshot)}' if snapshot is not None else ''
+    sql = (f'SELECT snapshot.org, row.{key}, MAX(row.snapshot_id) AS snapshot_id FROM {table} AS row'
+           f' JOIN snapshots AS snapshot ON snapshot.id = row.snapshot_id WHERE 1{until.format("snapshot")}')
+    if table in ('repos', 'teams'):
+        sql += (f' AND row.snapshot_id >= (SELECT IFNULL(MAX(complete.id), 0) FROM snapshots AS complete'
+                f' WHERE complete.all_{table} AND complete.org = snapshot.org{until.format("complete")})')
+    sql += f' GROUP BY snapshot.org, row.{key}'
+    if table in ('repos', 'teams'):
+        sql += (f' HAVING MAX(row.snapshot_id) > (SELECT IFNULL(MAX(removed.snapshot_id), 0) FROM removed'
+                f' JOIN snapshots AS removal ON removal.id = removed.snapshot_id'
+                f" WHERE removed.name = row.{key} AND removed.kind = '{table[:-1]}' AND removal.org = snapshot.org{until.format('removal')})")
+    return sql
+
+
+# Views hold no data so they are made again on open, which brings databases from older versions up to date
+VIEWS = f'''
+DROP VIEW IF EXISTS current_repos;
+CREATE VIEW current_repos AS {current_sql('repos', 'name')};
+DROP VIEW IF EXISTS current_teams;
+CREATE VIEW current_teams AS {current_sql('teams', 'slug')};
+DROP VIEW IF EXISTS current_orgs;
+CREATE VIEW current_orgs AS {current_sql('orgs', 'login')};
+'''
+
+
+def text(value)-> str:
+    ''' Exported structures hold str(None) for fields that were never set. Store those as NULL. '''
+    return None if value in (None, 'None') else value
+
+
+class SnapshotStore:
+    '''
+    Local SQLite database of discovered org, team and repo structures.
+    Every discovery run adds a timestamped snapshot. Queries read the latest state of each repo and team
+    by default, or the state as of one snapshot, without calling the API.
+    Structures read back are the same dicts the RepoObject, TeamObject and OrgObject exporters produce,
+    so the yaml and json output can be rebuilt from the store.
+    ---
+    db_file:str = SQLite database file. Created on first use.
+
+    Example:
+    ```
+    store = SnapshotStore('snapshots.db')
+    store.begin_snapshot(ORG_NAME)
+    store.add(this_repo.get_repo_structure())
+    store.finish_snapshot(all_repos=True)
+    store.repos_for_login('DevDude76', 'write')
+    ```
+    '''
+    def __init__(self, db_file:str = DEFAULT_DB_FILE) -> None:
+        self.db_file = db_file
+        self.db = sqlite3.connect(db_file)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA + VIEWS)
+        self.snapshot_id: int = None
+
+    def close(self)-> None:
+        self.db.close()
+
+    @staticmethod
+    def now()-> str:
+        return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    ### Writing
+
+    def begin_snapshot(self, org:str)-> int:
+        ''' Start a snapshot for one discovery run. Returns its id. '''
+        cursor = self.db.execute('INSERT INTO snapshots (org, started_at) VALUES (?, ?)', (org, self.now()))
+        self.db.commit()
+        self.snapshot_id = cursor.lastrowid
+        return self.snapshot_id
+
+    def finish_snapshot(self, all_repos:bool = False, all_teams:bool = False)-> None:
+        '''
+        Mark the snapshot finished.
+        all_repos / all_teams = The run discovered every repo / team of the org, so the ones it didn't see are gone.
+        Only set these when the run completed without errors, otherwise the repos or teams it missed drop out of queries.
+        '''
+        self.db.execute('UPDATE snapshots SET finished_at = ?, all_repos = ?, all_teams = ? WHERE id = ?',
+                        (self.now(), int(all_repos), int(all_teams), self.snapshot_id))
+        self.db.commit()
+
+    def add(self, structure:dict)-> None:
+        ''' Store a structure from get_repo_structure, get_team_structure or get_org_member_structure '''
+        for name, data in structure.items():
+            if data.get('type') == 'repo':
+                self.add_repo(name, data)
+            elif data.get('type') == 'team':
+                self.add_team(name, data)
+            elif data.get('type') == 'org':
+                self.add_org(name, data)
+        self.db.commit() # Each structure is committed as it arrives so a failed run keeps what it found
+
+    def remove(self, kind:str, name:str)-> None:
+        '''
+        Record that a repo or team no longer exists, so it drops out of queries from this snapshot on.
+        ---
+        kind:str = repo or team
+        name:str = Repo name or team slug
+        '''
+        self.db.execute('INSERT INTO removed VALUES (?, ?, ?)', (self.snapshot_id, kind, name))
+        self.db.commit()
+
+    def add_repo(self, name:str, data:dict)-> None:
+        snapshot = self.snapshot_id
+        self.db.execute('INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)', (snapshot, name, text(data['description']), text(data['html_url'])))
+        self.db.execute('DELETE FROM repo_access WHERE snapshot_id = ? AND repo = ?', (snapshot, name))
+        self.db.execute('DELETE FROM contributors WHERE snapshot_id = ? AND repo = ?', (snapshot, name))
+        self.db.executemany('INSERT INTO repo_access VALUES (?, ?, ?, ?, ?)',
+                            [(snapshot, name, kind, principal, role)
+                             for kind in ('direct_collabs', 'outside_collabs', 'teams')
+                             for role, principals in data[kind].items() for principal in principals])
+        self.db.executemany('INSERT INTO contributors VALUES (?, ?, ?)', [(snapshot, name, login) for login in data['contributors']])
+
+    def add_team(self, slug:str, data:dict)-> None:
+        snapshot = self.snapshot_id
+        self.db.execute('INSERT OR REPLACE INTO teams VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (snapshot, slug, text(data['name']), text(data['description']), text(data['html_url']),
+                         data['id'], data['parent_id'], text(data['parent_name'])))
+        self.db.execute('DELETE FROM team_members WHERE snapshot_id = ? AND team = ?', (snapshot, slug))
+        self.db.executemany('INSERT INTO team_members VALUES (?, ?, ?, ?)',
+                            [(snapshot, slug, login, role) for role, logins in data['members'].items() for login in logins])
+
+    def add_org(self, login:str, data:dict)-> None:
+        snapshot = self.snapshot_id
+        self.db.execute('INSERT OR REPLACE INTO orgs VALUES (?, ?, ?, ?)', (snapshot, login, text(data['name']), text(data['description'])))
+        self.db.execute('DELETE FROM org_members WHERE snapshot_id = ? AND org = ?', (snapshot, login))
+        self.db.executemany('INSERT INTO org_members VALUES (?, ?, ?, ?)',
+                            [(snapshot, login, kind, member) for kind in ('members', 'collaborators', 'pending_invites') for member in data[kind]])
+
+    ### Reading
+
+    def snapshots(self)-> list:
+        ''' Every snapshot as a dict, oldest first '''
+        cursor = self.db.execute('SELECT id, org, started_at, finished_at, all_repos, all_teams FROM snapshots ORDER BY id')
+        return [{'id': id, 'org': org, 'started_at': started_at, 'finished_at': finished_at, 'all_repos': bool(all_repos), 'all_teams': bool(all_teams)}
+                for id, org, started_at, finished_at, all_repos, all_teams in cursor]
+
+    def orgs(self)-> list:
+        ''' Logins of the orgs the store has snapshots of '''
+        return [org for (org,) in self.db.execute('SELECT DISTINCT org FROM snapshots ORDER BY org')]
+
+    def _query_org(self, org:str)-> str:
+        '''
+        The org a query keyed by repo name, team slug or login is limited to.
+        Raises ValueError when org is not set and the store holds several orgs, since their repos and teams can share names.
+        '''
+        if org is None and len(self.orgs()) > 1:
+            raise ValueError(f'{self.db_file} holds several orgs: {", ".join(self.orgs())}. Say which one to query.')
+        return org
+
+    def _current(self, table:str, key:str, snapshot:int = None)-> str:
+        '''
+        SQL for the (org, key, snapshot_id) rows of the latest state of each row in table.
+        With a snapshot id it is the state as of that snapshot instead.
+        Limited to the org bound to the :org parameter, or every org when it is None.
+        '''
+        current = f'current_{table}' if snapshot is None else f'({current_sql(table, key, snapshot)})'
+        return f'SELECT org, {key}, snapshot_id FROM {current} WHERE :org IS NULL OR org = :org'
+
+    def repos_for_login(self, login:str, role:str = None, snapshot:int = None, org:str = None)-> dict:
+        '''
+        Repos a login has access to as {repo: role}. Directly, as a member of a team,
+        or through a parent of one of their teams since child teams inherit the access of their parents.
+        When a login has access more than one way the strongest role is kept.
+        ---
+        role:str = Only repos where the login has at least this role, ie. 'write' also matches maintain and admin
+        org:str = Org to query. Only needed when the store holds several orgs.
+        '''
+        org = self._query_org(org)
+        current_repos = self._current('repos', 'name', snapshot)
+        current_teams = self._current('teams', 'slug', snapshot)
+        rows = self.db.execute(f'''
+            WITH RECURSIVE team_rows AS (
+                SELECT latest.org, team.slug, team.id, team.parent_id FROM teams AS team
+                JOIN ({current_teams}) AS latest ON latest.slug = team.slug AND latest.snapshot_id = team.snapshot_id
+            ), login_teams(org, slug, parent_id) AS (
+                SELECT team.org, team.slug, team.parent_id FROM team_members AS member
+                JOIN ({current_teams}) AS latest ON latest.slug = member.team AND latest.snapshot_id = member.snapshot_id
+                JOIN team_rows AS team ON team.slug = member.team AND team.org = latest.org
+                WHERE member.login = :login
+                UNION -- UNION rather than UNION ALL so a loop in the hierarchy ends
+                SELECT parent.org, parent.slug, parent.parent_id FROM login_teams AS child
+                JOIN team_rows AS parent ON parent.id = child.parent_id
+            )
+            SELECT access.repo, access.role FROM repo_access AS access
+            JOIN ({current_repos}) AS repo ON repo.name = access.repo AND repo.snapshot_id = access.snapshot_id
+            WHERE access.kind = 'direct_collabs' AND access.principal = :login
+            UNION ALL
+            SELECT access.repo, access.role FROM login_teams AS team
+            JOIN repo_access AS access ON access.kind = 'teams' AND access.principal = team.slug
+            JOIN ({current_repos}) AS repo ON repo.name = access.repo AND repo.snapshot_id = access.snapshot_id AND repo.org = team.org''', {'login': login, 'org': org})
+        access = {}
+        for repo, repo_role in rows:
+            access.setdefault(repo, []).append(repo_role)
+        access = {repo: strongest_role(roles) for repo, roles in access.items()}
+        if role:
+            allowed = roles_at_least(role)
+            access = {repo: repo_role for repo, repo_role in access.items() if repo_role in allowed}
+        return access
+
+    def teams_for_repo(self, repo:str, role:str = None, snapshot:int = None, org:str = None)-> dict:
+        '''
+        Teams with access to a repo as {team_slug: role}
+        ---
+        role:str = Only teams granting at least this role
+        org:str = Org to query. Only needed when the store holds several orgs.
+        '''
+        current_repos = self._current('repos', 'name', snapshot)
+        rows = self.db.execute(f'''
+            SELECT access.principal, access.role FROM repo_access AS access
+            JOIN ({current_repos}) AS repo ON repo.name = access.repo AND repo.snapshot_id = access.snapshot_id
+            WHERE access.kind = 'teams' AND access.repo = :repo''', {'repo': repo, 'org': self._query_org(org)})
+        allowed = roles_at_least(role) if role else None
+        return {team: team_role for team, team_role in rows if allowed is None or team_role in allowed}
+
+    def collaborator_repos(self, login:str, snapshot:int = None, org:str = None)-> dict:
+        ''' Repos a login is a direct collaborator of as {repo: role}. Access through teams is not included. '''
+        current_repos = self._current('repos', 'name', snapshot)
+        rows = self.db.execute(f'''
+            SELECT access.repo, access.role FROM repo_access AS access
+            JOIN ({current_repos}) AS repo ON repo.name = access.repo AND repo.snapshot_id = access.snapshot_id
+            WHERE access.kind = 'direct_collabs' AND access.principal = :login''', {'login': login, 'org': self._query_org(org)})
+        return dict(rows)
+
+    def team_repos(self, team:str, snapshot:int = None, org:str = None)-> dict:
+        ''' Repos a team is granted access to as {repo: role}. Access inherited from parent teams is not included. '''
+        current_repos = self._current('repos', 'name', snapshot)
+        rows = self.db.execute(f'''
+            SELECT access.repo, access.role FROM repo_access AS access
+            JOIN ({current_repos}) AS repo ON repo.name = access.repo AND repo.snapshot_id = access.snapshot_id
+            WHERE access.kind = 'teams' AND access.principal = :team''', {'team': team, 'org': self._query_org(org)})
+        return dict(rows)
+
+    def contributors(self, repo:str, snapshot:int = None, org:str = None)-> list:
+        ''' Contributors of a repo as last discovered '''
+        current_repos = self._current('repos', 'name', snapshot)
+        rows = self.db.execute(f'''
+            SELECT contributor.login FROM contributors AS contributor
+            JOIN ({current_repos}) AS repo ON repo.name = contributor.repo AND repo.snapshot_id = contributor.snapshot_id
+            WHERE contributor.repo = :repo''', {'repo': repo, 'org': self._query_org(org)})
+        return [login for (login,) in rows]
+
+    def teams_for_login(self, login:str, snapshot:int = None, org:str = None)-> dict:
+        ''' Teams a login belongs to as {team_slug: role} '''
+        current_teams = self._current('teams', 'slug', snapshot)
+        rows = self.db.execute(f'''
+            SELECT member.team, member.role FROM team_members AS member
+            JOIN ({current_teams}) AS team ON team.slug = member.team AND team.snapshot_id = member.snapshot_id
+            WHERE member.login = :login''', {'login': login, 'org': self._query_org(org)})
+        return dict(rows)
+
+    def structures(self, snapshot:int = None, org:str = None):
+        '''
+        Yields the stored repo, team and org structures in the same form the exporters produce,
+        so they can be written with OutputWriter as if they were just discovered.
+        ---
+        org:str = Only the structures of this org. Every org in the store by default.
+        '''
+        for (_, name, snapshot_id) in self.db.execute(f"{self._current('repos', 'name', snapshot)} ORDER BY name", {'org': org}).fetchall():
+            description, html_url = self.db.execute('SELECT description, html_url FROM repos WHERE name = ? AND snapshot_id = ?', (name, snapshot_id)).fetchone()
+            this_repo = RepoObject(name)
+            this_repo.description = description
+            this_repo.html_url = html_url
+            for kind, principal, role in self.db.execute('SELECT kind, principal, role FROM repo_access WHERE repo = ? AND snapshot_id = ?', (name, snapshot_id)):
+                if kind == 'direct_collabs':
+                    this_repo.add_direct_collabs(principal, role)
+                elif kind == 'outside_collabs':
+                    this_repo.add_outside_collabs(principal, role)
+                else:
+                    this_repo.add_team(principal, role)
+            for (login,) in self.db.execute('SELECT login FROM contributors WHERE repo = ? AND snapshot_id = ?', (name, snapshot_id)):
+                this_repo.add_contributor(login)
+            yield this_repo.get_repo_structure()
+
+        for (_, slug, snapshot_id) in self.db.execute(f"{self._current('teams', 'slug', snapshot)} ORDER BY slug", {'org': org}).fetchall():
+            name, description, html_url, id, parent_id, parent_name = self.db.execute(
+                'SELECT name, description, html_url, id, parent_id, parent_name FROM teams WHERE slug = ? AND snapshot_id = ?', (slug, snapshot_id)).fetchone()
+            this_team = TeamObject(slug)
+            this_team.name = name
+            this_team.description = description
+            this_team.html_url = html_url
+            this_team.id = id
+            this_team.parent_id = parent_id
+            this_team.parent_name = parent_name
+            for login, role in self.db.execute('SELECT login, role FROM team_members WHERE team = ? AND snapshot_id = ?', (slug, snapshot_id)):
+                this_team.add_member(login, role)
+            yield this_team.get_team_structure()
+
+        for (_, login, snapshot_id) in self.db.execute(f"{self._current('orgs', 'login', snapshot)} ORDER BY login", {'org': org}).fetchall():
+            name, description = self.db.execute('SELECT name, description FROM orgs WHERE login = ? AND snapshot_id = ?', (login, snapshot_id)).fetchone()
+            this_org = OrgObject(login)
+            this_org.name = name
+            this_org.description = description
+            for kind, member in self.db.execute('SELECT kind, login FROM org_members WHERE org = ? AND snapshot_id = ?', (login, snapshot_id)):
+                if kind == 'members':
+                    this_org.add_member(member)
+                elif kind == 'collaborators':
+                    this_org.add_collab(member)
+                else:
+                    this_org.add_invited_user(member)
+            yield this_org.get_org_member_structure()
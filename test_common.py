@@ -0,0 +1,55 @@
+from common import RoleDiff, OrgMembershipDiff
+
+
+def test_org_membership_diff_invites_new_members():
+    diff = OrgMembershipDiff(['Dev1'], [], [], ['Dev1', 'Dev2'], [])
+    assert diff.invite == {'Dev2'}
+    assert diff.pending == set()
+    assert diff
+
+
+def test_org_membership_diff_skips_pending_invites():
+    diff = OrgMembershipDiff(['Dev1'], [], ['Dev2'], ['Dev1', 'Dev2'], [])
+    assert diff.invite == set()
+    assert diff.pending == {'Dev2'}
+    assert not diff # A pending invite is nothing to do
+
+
+def test_org_membership_diff_converts_members_to_collaborators():
+    diff = OrgMembershipDiff(['Dev1', 'Contractor'], [], [], ['Dev1'], ['Contractor'])
+    assert diff.convert == {'Contractor'}
+    assert diff.remove == set() # Converted, not removed
+    assert diff.remove_collab == set()
+
+
+def test_org_membership_diff_keeps_members_listed_as_both():
+    diff = OrgMembershipDiff(['Dev1'], [], [], ['Dev1'], ['Dev1'])
+    assert diff.convert == set()
+    assert not diff
+
+
+def test_org_membership_diff_removes_unlisted_logins():
+    diff = OrgMembershipDiff(['Dev1', 'Leaver'], ['Collab', 'OldCollab'], [], ['Dev1'], ['Collab'])
+    assert diff.remove == {'Leaver'}
+    assert diff.remove_collab == {'OldCollab'}
+    assert diff.invite == set()
+
+
+def test_org_membership_diff_accepts_missing_lists():
+    diff = OrgMembershipDiff(None, None, None, None, None)
+    assert not diff
+
+
+def test_role_diff_added_removed_and_changed():
+    diff = RoleDiff({'maintainer': ['TeamLead'], 'member': ['Dev1', 'Dev3']},
+                    {'member': ['TeamLead', 'Dev2', 'Dev3']})
+    assert diff.added == {'Dev2': 'member'}
+    assert diff.removed == {'Dev1': 'member'}
+    assert diff.changed == {'TeamLead': ('maintainer', 'member')}
+    assert diff
+
+
+def test_role_diff_unchanged_is_empty():
+    diff = RoleDiff({'member': ['Dev1'], 'maintainer': ['TeamLead']}, {'maintainer': ['TeamLead'], 'member': ['Dev1']})
+    assert (diff.added, diff.removed, diff.changed) == ({}, {}, {})
+    assert not diff
@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+import subprocess
+import pytest
+from fake_github import FakeGitHubState, make_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# discovery.py has no option for the REST url, so point PyGithub at the fake API before running it
+RUN_DISCOVERY = '''
+import sys, runpy, functools, github
+github.Github = functools.partial(github.Github, base_url=sys.argv[1])
+sys.argv = ['discovery.py'] + sys.argv[2:]
+runpy.run_path('discovery.py', run_name='__main__')
+'''
+
+
+@pytest.fixture(scope='module')
+def fake_api():
+    ''' Fake API small enough to be quick, with GraphQL pages small enough that every connection has several '''
+    state = FakeGitHubState({'repos': 12, 'teams': 8, 'members': 30, 'collaborators': 5, 'seed': 3}, graphql_page_size=3)
+    server = make_server(state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', state
+    server.shutdown()
+    server.server_close()
+
+
+def discover(base_url:str, tmp_path, *args) -> str:
+    env = dict(os.environ, GITHUB_PRIVATE_TOKEN='fake-token', GITHUB_ORG_NAME='fake-org')
+    result = subprocess.run([sys.executable, '-c', RUN_DISCOVERY, base_url, '--no-cache',
+                             '--cache-dir', str(tmp_path / 'cache'), *args], cwd=HERE, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_graphql_output_matches_rest(fake_api, tmp_path):
+    base_url, state = fake_api
+    rest = discover(base_url, tmp_path, '-r', 'all', '-t', 'all', '-m')
+    before = state.stats()['routes'].get('POST /graphql', 0)
+    graphql = discover(base_url, tmp_path, '-r', 'all', '-t', 'all', '-m', '--backend', 'graphql', '--graphql-url', f'{base_url}/graphql')
+    assert state.stats()['routes'].get('POST /graphql', 0) > before
+    assert 'repo-0:' in rest and 'team-0:' in rest and 'fake-org:' in rest
+    assert graphql == rest
+
+
+def test_graphql_single_repo_and_team_match_rest(fake_api, tmp_path):
+    base_url, state = fake_api
+    for args in (['-r', 'repo-3'], ['-t', 'team-5']):
+        rest = discover(base_url, tmp_path, *args)
+        graphql = discover(base_url, tmp_path, *args, '--backend', 'graphql', '--graphql-url', f'{base_url}/graphql')
+        assert graphql == rest
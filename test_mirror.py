@@ -0,0 +1,100 @@
+import os
+from mirror import OrgMirror, read_deliveries
+
+DELIVERIES = {delivery: (event, payload) for event, payload, delivery in
+              read_deliveries(os.path.join(os.path.dirname(__file__), 'test_mirror.ndjson'))}
+
+
+def org_structures() -> list:
+    ''' A small discovery output. Contractor is an outside collaborator on SomeRepo, team-child sits under team-awesome. '''
+    return [
+        {'SomeRepo': {'type': 'repo', 'html_url': 'https://github.com/my-org/SomeRepo',
+                      'direct_collabs': {'write': ['Contractor', 'Dev1', 'Leaver']},
+                      'outside_collabs': {'write': ['Contractor']},
+                      'teams': {'write': ['team-awesome'], 'read': ['team-child']}}},
+        {'OtherRepo': {'type': 'repo', 'html_url': 'https://github.com/my-org/OtherRepo',
+                       'teams': {'read': ['team-awesome']}}},
+        {'team-awesome': {'type': 'team', 'name': 'Team Awesome', 'id': 1,
+                          'members': {'maintainer': ['TeamLead'], 'member': ['Dev1', 'Leaver']}}},
+        {'team-child': {'type': 'team', 'name': 'Team Child', 'id': 2, 'parent_id': 1, 'parent_name': 'Team Awesome',
+                        'members': {'member': ['Leaver']}}},
+        {'my-org': {'type': 'org', 'members': ['Dev1', 'Leaver', 'TeamLead'], 'collaborators': ['Contractor']}},
+    ]
+
+
+def apply(*deliveries) -> OrgMirror:
+    mirror = OrgMirror(org_structures())
+    for delivery in deliveries:
+        assert mirror.apply(*DELIVERIES[delivery])
+    return mirror
+
+
+def structures(mirror:OrgMirror) -> dict:
+    ''' Mirror output keyed by repo, team or org name '''
+    return {name: data for structure in mirror.structures() for name, data in structure.items()}
+
+
+def test_membership_added_and_removed():
+    team = structures(apply('membership-added', 'membership-removed'))['team-awesome']
+    assert team['members'] == {'maintainer': ['TeamLead'], 'member': ['Dev2', 'Leaver']}
+
+
+def test_organization_member_added_drops_outside_collaborator():
+    output = structures(apply('org-member-added'))
+    assert output['my-org']['members'] == ['Contractor', 'Dev1', 'Leaver', 'TeamLead']
+    assert output['my-org']['collaborators'] == []
+    assert output['SomeRepo']['outside_collabs'] == {}
+    assert output['SomeRepo']['direct_collabs'] == {'write': ['Contractor', 'Dev1', 'Leaver']}
+
+
+def test_organization_member_removed_drops_teams_and_repo_access():
+    output = structures(apply('org-member-removed'))
+    assert output['my-org']['members'] == ['Dev1', 'TeamLead']
+    assert output['team-awesome']['members'] == {'maintainer': ['TeamLead'], 'member': ['Dev1']}
+    assert output['team-child']['members'] == {}
+    assert output['SomeRepo']['direct_collabs'] == {'write': ['Contractor', 'Dev1']}
+
+
+def test_member_added_outside_collaborator():
+    output = structures(apply('member-added'))
+    assert output['OtherRepo']['direct_collabs'] == {'read': ['NewCollab']}
+    assert output['OtherRepo']['outside_collabs'] == {'read': ['NewCollab']}
+    assert output['my-org']['collaborators'] == ['Contractor', 'NewCollab']
+
+
+def test_member_edited_changes_role():
+    output = structures(apply('member-edited'))
+    assert output['SomeRepo']['direct_collabs'] == {'admin': ['Contractor'], 'write': ['Dev1', 'Leaver']}
+    assert output['SomeRepo']['outside_collabs'] == {'admin': ['Contractor']}
+    assert output['my-org']['collaborators'] == ['Contractor']
+
+
+def test_member_removed_drops_last_outside_collaboration():
+    output = structures(apply('member-removed'))
+    assert output['SomeRepo']['direct_collabs'] == {'write': ['Dev1', 'Leaver']}
+    assert output['SomeRepo']['outside_collabs'] == {}
+    assert output['my-org']['collaborators'] == []
+
+
+def test_member_removed_keeps_outside_collaborator_of_another_repo():
+    output = structures(apply('member-added', 'member-removed'))
+    assert output['my-org']['collaborators'] == ['NewCollab']
+
+
+def test_team_renamed_rewrites_slug_and_children():
+    output = structures(apply('team-renamed'))
+    assert 'team-awesome' not in output
+    assert output['team-great']['name'] == 'Team Great'
+    assert output['team-great']['members'] == {'maintainer': ['TeamLead'], 'member': ['Dev1', 'Leaver']}
+    assert output['team-child']['parent_name'] == 'Team Great'
+    assert output['SomeRepo']['teams'] == {'read': ['team-child'], 'write': ['team-great']}
+    assert output['OtherRepo']['teams'] == {'read': ['team-great']}
+
+
+def test_repository_renamed_and_deleted():
+    output = structures(apply('repo-renamed', 'repo-deleted'))
+    assert 'SomeRepo' not in output
+    assert 'OtherRepo' not in output
+    assert output['NewName']['html_url'] == 'https://github.com/my-org/NewName'
+    assert output['NewName']['description'] == 'None' # Not part of what discovery outputs
+    assert output['NewName']['direct_collabs'] == {'write': ['Contractor', 'Dev1', 'Leaver']}
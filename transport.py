@@ -0,0 +1,265 @@
+import os
+import time
+import json
+import hashlib
+import threading
+import io
+import requests
+from urllib3.util.retry import Retry
+from github.Requester import Requester, RequestsResponse
+from ratelimit import *
+
+DEFAULT_CACHE_DIR = os.getenv("GITHUB_CACHE_DIR", os.path.join(os.path.expanduser('~'), '.cache', 'GitHubOrgMgmt'))
+DEFAULT_CACHE_SIZE_MB = 256
+MAX_ATTEMPTS = 5 # Attempts per request when rate limited
+
+
+class CachedResponse:
+    '''
+    Mimics the httplib style response PyGithub expects from a connection class.
+    Used to serve a 304 Not Modified from the body stored on disk.
+    '''
+    def __init__(self, status:int, headers:dict, text:str) -> None:
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self) -> str:
+        return self.text
+
+
+class ResponseCache:
+    '''
+    On-disk cache of GitHub API GET responses used for conditional requests.
+    Each entry keeps the body with its ETag and Last-Modified headers so the next request for the same URL
+    can be sent with If-None-Match / If-Modified-Since. A 304 is then served from disk.
+    Entries are keyed by URL and a hash of the auth header so two tokens never share responses.
+    The least recently used entries are removed once the cache grows over max_bytes.
+    ---
+    cache_dir:str = Directory for cache files. Created with user only access since it holds API responses.
+    max_bytes:int = Size limit of the cache
+    '''
+    def __init__(self, cache_dir:str = DEFAULT_CACHE_DIR, max_bytes:int = DEFAULT_CACHE_SIZE_MB * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self.size = sum(size for path, size in self._entries())
+
+    def _entries(self):
+        ''' Yields (path, size) of every cache file '''
+        for sub_dir in os.scandir(self.cache_dir):
+            if sub_dir.is_dir():
+                for entry in os.scandir(sub_dir.path):
+                    if entry.name.endswith('.json'):
+                        yield entry.path, entry.stat().st_size
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    @staticmethod
+    def key(url:str, headers:dict) -> str:
+        ''' Cache key from the URL, the auth scope and the requested media type '''
+        scope = '\n'.join([headers.get('Authorization', ''), headers.get('Accept', ''), url])
+        return hashlib.sha256(scope.encode()).hexdigest()
+
+    def get(self, key:str) -> dict:
+        ''' Returns a stored entry or None '''
+        try:
+            with open(self._path(key), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def touch(self, key:str) -> None:
+        ''' Mark an entry as recently used so eviction keeps it '''
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def put(self, key:str, entry:dict) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        data = json.dumps(entry)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(data)
+        with self.lock:
+            try:
+                old_size = os.stat(path).st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path) # Atomic so a crash never leaves half an entry
+            self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        ''' Remove least recently used entries until the cache is back under 90% of max_bytes '''
+        entries = sorted(self._entries(), key=lambda entry: os.stat(entry[0]).st_mtime)
+        for path, size in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+
+class Transport:
+    '''
+    HTTP layer shared by every Github instance in the process.
+    Installed underneath PyGithub with Requester.injectConnectionClasses so all REST calls go through one
+    pooled requests.Session. GET requests are made conditional when a ResponseCache is set,
+    and every request is paced by the RateLimitScheduler when one is set.
+    ---
+    cache = ResponseCache or None to disable caching
+    scheduler = RateLimitScheduler or None to leave rate limits to PyGithub
+    profiler = ApiProfiler to record every request sent, or None
+
+    Example:
+    ```
+    transport = Transport(cache=ResponseCache('~/.cache/GitHubOrgMgmt'), scheduler=RateLimitScheduler())
+    transport.install()
+    gh = Github(auth=auth, seconds_between_requests=None, seconds_between_writes=None)
+    ```
+    '''
+    def __init__(self, cache:ResponseCache = None, scheduler:RateLimitScheduler = None, profiler = None) -> None:
+        self.cache = cache
+        self.scheduler = scheduler
+        self.profiler = profiler
+        self.session = requests.Session()
+        # Same as PyGithub. Stops requests falling back to credentials from a .netrc file
+        self.session.auth = Requester.noopAuth
+        self.mounted = False
+        self.lock = threading.Lock()
+
+    def mount(self, retry, pool_size:int) -> None:
+        ''' Configure the session with the retry and pool settings of the first Github instance that connects '''
+        with self.lock:
+            if self.mounted:
+                return
+            if self.scheduler:
+                # PyGithub's default retry sleeps on 403 rate limits on its own. The scheduler handles those
+                # for all workers at once, so only server errors are retried here.
+                retry = Retry(total=10, backoff_factor=1, status_forcelist=list(range(500, 600)), raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=requests.adapters.DEFAULT_RETRIES if retry is None else retry,
+                pool_connections=pool_size or requests.adapters.DEFAULT_POOLSIZE,
+                pool_maxsize=pool_size or requests.adapters.DEFAULT_POOLSIZE,
+            )
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.mounted = True
+
+    def send(self, verb:str, url:str, body, headers:dict, timeout:int, verify):
+        cache_key = None
+        entry = None
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+        if self.cache and verb == 'GET' and not conditional: # Leave requests that are already conditional alone
+            cache_key = self.cache.key(url, headers)
+            entry = self.cache.get(cache_key)
+            if entry:
+                headers = dict(headers)
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.request(verb, url, body, headers, timeout, verify)
+
+        if entry and response.status_code == 304:
+            self.cache.touch(cache_key)
+            cached_headers = dict(entry['headers'])
+            # Keep the fresh rate limit and date headers from the 304
+            cached_headers.update({key: value for key, value in response.headers.items() if key.lower() != 'content-length'})
+            return CachedResponse(entry['status'], cached_headers, entry['body'])
+
+        if cache_key and response.status_code == 200:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.cache.put(cache_key, {
+                    'url': url,
+                    'status': response.status_code,
+                    'headers': dict(response.headers),
+                    'body': response.text,
+                    'etag': etag,
+                    'last_modified': last_modified,
+                })
+        return RequestsResponse(response)
+
+    def request(self, verb:str, url:str, body, headers:dict, timeout:int, verify) -> requests.Response:
+        ''' Send one request through the scheduler, retrying it while it is rate limited '''
+        if not self.scheduler:
+            return self.send_once(verb, url, body, headers, timeout, verify)
+        resource = rate_limit_resource(url)
+        for attempt in range(MAX_ATTEMPTS):
+            start = time.perf_counter()
+            self.scheduler.acquire(resource, write=verb != 'GET')
+            response = self.send_once(verb, url, body, headers, timeout, verify, wait_seconds=time.perf_counter() - start)
+            rate_limited = response.status_code in (403, 429)
+            retry_after = self.scheduler.update(resource, response.status_code, response.headers, response.text if rate_limited else '')
+            if retry_after is None or isinstance(body, io.IOBase):
+                return response # Not rate limited, or an upload stream that can't be sent twice
+        return response
+
+    def send_once(self, verb:str, url:str, body, headers:dict, timeout:int, verify, wait_seconds:float = 0.0) -> requests.Response:
+        ''' Send one request on the session and record it with the profiler '''
+        if not self.profiler:
+            return self.session.request(verb, url, data=body, headers=headers, timeout=timeout, verify=verify, allow_redirects=False)
+        start = time.perf_counter()
+        bytes_sent = len(body) if isinstance(body, (str, bytes)) else 0
+        try:
+            response = self.session.request(verb, url, data=body, headers=headers, timeout=timeout, verify=verify, allow_redirects=False)
+        except Exception:
+            self.profiler.record(verb, url, 0, {}, bytes_sent, 0, time.perf_counter() - start, wait_seconds)
+            raise
+        self.profiler.record(verb, url, response.status_code, response.headers, bytes_sent, len(response.content), time.perf_counter() - start, wait_seconds)
+        return response
+
+    def connection_classes(self):
+        ''' Returns (http, https) connection classes bound to this transport for Requester.injectConnectionClasses '''
+        http_class = type('HTTPTransportConnection', (TransportConnection,), {'transport': self, 'protocol': 'http', 'default_port': 80})
+        https_class = type('HTTPSTransportConnection', (TransportConnection,), {'transport': self, 'protocol': 'https', 'default_port': 443})
+        return http_class, https_class
+
+    def install(self) -> None:
+        ''' Route every PyGithub request through this transport '''
+        Requester.injectConnectionClasses(*self.connection_classes())
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class TransportConnection:
+    '''
+    Mimics the httplib connection object PyGithub expects and hands the request to the Transport.
+    PyGithub may share one connection object between threads, so the pending request is kept per thread.
+    '''
+    transport: Transport = None
+    protocol: str = 'https'
+    default_port: int = 443
+
+    def __init__(self, host:str, port:int = None, strict:bool = False, timeout:int = None, retry = None, pool_size:int = None, **kwargs) -> None:
+        self.host = host
+        self.port = port if port else self.default_port
+        self.timeout = timeout
+        self.verify = kwargs.get('verify', True)
+        self.pending = threading.local()
+        self.transport.mount(retry, pool_size)
+
+    def request(self, verb:str, url:str, input, headers:dict) -> None:
+        self.pending.request = (verb, url, input, headers)
+
+    def getresponse(self):
+        verb, url, input, headers = self.pending.request
+        return self.transport.send(verb, f'{self.protocol}://{self.host}:{self.port}{url}', input, headers, self.timeout, self.verify)
+
+    def close(self) -> None:
+        pass # The pooled session belongs to the transport and is closed with it
@@ -0,0 +1,162 @@
+import io
+import os
+import sys
+import json
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from common import *
+from mirror import *
+from snapshot_store import *
+
+DEFAULT_PORT = 8080
+
+parser = argparse.ArgumentParser(
+                    prog=os.path.basename(sys.argv[0]),
+                    description='Keep a live mirror of org membership and repo access from GitHub webhook deliveries, without calling the GitHub API',
+                    epilog='The mirror starts from a discovery.py output file or snapshot database. Run a full discovery now and then and reload it to put right any missed delivery.')
+
+parser.add_argument('-s','--snapshot', metavar='SNAPSHOT_FILE', help='discovery.py output file to start from. yaml, json or ndjson')
+parser.add_argument('--db', metavar='DB_FILE', help='SQLite snapshot database written by discovery.py --db to start from instead of a file')
+parser.add_argument('-o','--org', help='Login of the org to mirror. Needed when the snapshot has several orgs or no org membership')
+commands = parser.add_subparsers(dest='command', required=True)
+
+serve = commands.add_parser('serve', help='Receive webhook deliveries. GET / returns the mirrored state, POST /reload loads the snapshot again')
+serve.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default is 127.0.0.1')
+serve.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on. Default is {DEFAULT_PORT}')
+serve.add_argument('--secret', default=os.environ.get('GITHUB_WEBHOOK_SECRET'), help='Webhook secret used to check the X-Hub-Signature-256 of each delivery. Default is $GITHUB_WEBHOOK_SECRET')
+serve.add_argument('--record', metavar='DELIVERIES_FILE', help='Append every delivery to this file so it can be replayed')
+
+replay = commands.add_parser('replay', help='Apply recorded deliveries to the snapshot and write the result')
+replay.add_argument('deliveries', nargs='+', metavar='DELIVERIES_FILE', help='Files written by serve --record')
+replay.add_argument('-f','--file', nargs='?', const='stdout.yml', help='File name to write output')
+replay.add_argument('--format', choices=OUTPUT_FORMATS, default='yaml', help='Output format. yaml, json or ndjson. Default is yaml')
+args = parser.parse_args()
+
+if args.snapshot and args.db:
+    print("Exiting: Use --snapshot or --db, not both")
+    exit()
+if args.snapshot and not os.path.exists(args.snapshot):
+    print(f"Exiting: Snapshot file '{args.snapshot}' not found. Create it with discovery.py -f")
+    exit()
+if args.db and not os.path.exists(args.db):
+    print(f"Exiting: Snapshot database '{args.db}' not found. Create it with discovery.py --db")
+    exit()
+
+
+def snapshot_structures()-> list:
+    ''' The structures the mirror starts from. Read again on every reload. '''
+    if args.db:
+        store = SnapshotStore(args.db)
+        structures = list(store.structures(org=args.org))
+        store.close()
+        return structures
+    if args.snapshot:
+        return [{name: data} for name, data in load_documents(args.snapshot).items()]
+    return []
+
+
+def apply_delivery(event:str, payload:dict, delivery:str = None)-> bool:
+    ''' Apply a delivery to the mirror. Returns None if the payload is not what GitHub documents for the event. '''
+    try:
+        changed = mirror.apply(event, payload)
+    except (KeyError, TypeError) as err:
+        print(f'[WARNING] Could not apply {event} delivery {delivery} - {type(err).__name__}: {err}', file=sys.stderr)
+        return None
+    if changed:
+        print(f'[CHANGED] {event} {payload.get("action") or ""}'.rstrip(), file=sys.stderr)
+    return changed
+
+
+def export(output_format:str)-> str:
+    buffer = io.StringIO()
+    writer = OutputWriter(output_format=output_format, stdout=buffer)
+    for structure in mirror.structures():
+        writer.write(structure)
+    writer.close()
+    return buffer.getvalue()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    '''
+    POST / a webhook delivery. Events the mirror doesn't use are accepted and ignored.
+    GET / the mirrored state. ?format=json or ndjson, default is yaml
+    POST /reload load the snapshot again after a full discovery
+    '''
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status:int, text:str, content_type:str = 'text/plain')-> None:
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        output_format = parse_qs(url.query).get('format', ['yaml'])[-1]
+        if url.path != '/' or output_format not in OUTPUT_FORMATS:
+            return self.send(404, 'Not Found\n')
+        self.send(200, export(output_format), 'application/json' if output_format != 'yaml' else 'application/yaml')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if args.secret and not verify_signature(args.secret, body, self.headers.get('X-Hub-Signature-256')):
+            print(f'[WARNING] Rejected delivery {self.headers.get("X-GitHub-Delivery")} with a bad signature', file=sys.stderr)
+            return self.send(401, 'Bad signature\n')
+        if urlparse(self.path).path == '/reload':
+            mirror.load(snapshot_structures())
+            print(f'[INFO] Reloaded {len(mirror.structures())} documents', file=sys.stderr)
+            return self.send(200, 'Reloaded\n')
+
+        event = self.headers.get('X-GitHub-Event')
+        if not event:
+            return self.send(400, 'Missing X-GitHub-Event header\n')
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self.send(400, 'Body is not json\n')
+        if record:
+            with record_lock:
+                record.write({'event': event, 'delivery': self.headers.get('X-GitHub-Delivery'), 'payload': payload})
+        changed = apply_delivery(event, payload, self.headers.get('X-GitHub-Delivery'))
+        if changed is None:
+            return self.send(400, 'Unexpected payload\n')
+        self.send(200, 'Applied\n' if changed else 'Ignored\n')
+
+
+mirror = OrgMirror(snapshot_structures(), args.org)
+
+
+if args.command == 'serve':
+    record = None
+    record_lock = threading.Lock()
+    if args.record:
+        record = OutputWriter(args.record, 'ndjson', stdout=None)
+    server = ThreadingHTTPServer((args.host, args.port), WebhookHandler)
+    server.daemon_threads = True
+    print(f'[INFO] Mirroring org {mirror.org_login} with {len(mirror.repos)} repos and {len(mirror.teams)} teams on http://{args.host}:{server.server_port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    if record:
+        record.close()
+
+elif args.command == 'replay':
+    for deliveries_file in args.deliveries:
+        if not os.path.exists(deliveries_file):
+            print(f"Exiting: Deliveries file '{deliveries_file}' not found")
+            exit()
+        for event, payload, delivery in read_deliveries(deliveries_file):
+            apply_delivery(event, payload, delivery)
+    print(f'[INFO] Deliveries applied: {mirror.applied} ignored: {mirror.ignored}', file=sys.stderr)
+    writer = OutputWriter(args.file, args.format)
+    for structure in mirror.structures():
+        writer.write(structure)
+    writer.close()